@@ -1,5 +1,6 @@
 import streamlit as st
 import base64
+import os
 import pandas as pd
 
 from logic import(
@@ -10,11 +11,34 @@ from logic import(
     get_sales_trends,
     get_sales_trend_for_merchant
 )
-from data_loader import load_data
+from data_loader import get_dataset_version, load_data, load_keyword_index
 from datetime import datetime, timedelta
 from helper import BusinessAnalytics
+from instrumentation import flatten, is_enabled, rename_span, to_json, to_prometheus, trace
+from planner import Aggregates, plan_query
+from profiling import (
+    PROFILE_SCOPES,
+    PROFILER_ADMIN,
+    PROFILER_MODES,
+    configure_profiler,
+    finish_profile,
+    profile_request,
+    profiler_settings,
+    recent_profiles,
+    start_profile
+)
+from warmup import start_background_warmup
+
+@st.cache_resource(show_spinner=False)
+def start_server_warmup():
+    """Warm the caches once per server process, in the background (MEX_WARMUP=0 disables)"""
+    if os.environ.get("MEX_WARMUP", "1") == "0":
+        return None
+    return start_background_warmup()
+
+start_server_warmup()
 
-# Load data once at startup
+# Shared dataset; tables are loaded on first access
 data = load_data()
 merchant_df = data["merchant"]
 
@@ -24,6 +48,33 @@ if "logged_in" not in st.session_state:
 if "merchant_id" not in st.session_state:
     st.session_state.merchant_id = None
 
+# --- Session analytics lifecycle ---
+def start_analytics_session(merchant_id):
+    """Build the session's BusinessAnalytics (called on login)"""
+    end_analytics_session()
+    st.session_state.analytics = BusinessAnalytics(merchant_id=merchant_id)
+    return st.session_state.analytics
+
+def end_analytics_session():
+    """Drop the session's BusinessAnalytics and release its dataset (called on logout)"""
+    analytics = st.session_state.pop("analytics", None)
+    if analytics is not None:
+        analytics.close()
+
+def get_session_analytics(merchant_id):
+    """
+    Return the session's BusinessAnalytics, kept across reruns and rebuilt
+    only when the merchant or the dataset version changes
+    """
+    analytics = st.session_state.get("analytics")
+    if (
+        analytics is None or
+        analytics.merchant_id != merchant_id or
+        analytics.data_version != get_dataset_version()
+    ):
+        analytics = start_analytics_session(merchant_id)
+    return analytics
+
 # --- Login Page ---
 def login_page():
     st.set_page_config(page_title="Login | MEX Assistant", page_icon="🔐")
@@ -40,6 +91,7 @@ def login_page():
             merchant_id = merchant_df[merchant_df["merchant_name"] == username]["merchant_id"].iloc[0]
             st.session_state.logged_in = True
             st.session_state.merchant_id = merchant_id
+            start_analytics_session(merchant_id)
             st.success("✅ Login successful!")
             st.rerun()
         else:
@@ -50,17 +102,11 @@ if not st.session_state.logged_in:
     login_page()
     st.stop()
 
-# Initialize analytics after login
-analytics = BusinessAnalytics(merchant_id=st.session_state.merchant_id)
+# Whole-rerun profile when the profiler scope is "rerun", finished at the end of the script
+rerun_profile = start_profile("rerun", scope="rerun", merchant_id=st.session_state.merchant_id)
 
-# Display smart nudges
-if st.session_state.logged_in:
-    nudges = analytics.get_smart_nudges()
-    if nudges:
-        st.markdown("### 💡 Smart Suggestions")
-        for nudge in nudges:
-            st.info(nudge)
-        st.markdown("---")
+# Analytics built at login, reused by every rerun of this session
+analytics = get_session_analytics(st.session_state.merchant_id)
 
 def get_img_as_base64(file_path):
     with open(file_path, "rb") as f:
@@ -69,202 +115,251 @@ def get_img_as_base64(file_path):
 
 img_data = get_img_as_base64("Grab_white.png")
 
+# What the query branches render from, by name; a plan's steps share them
+# (see planner.branch_aggregates for the keys each branch needs)
+AGGREGATES = {
+    "global_hourly": lambda: analytics.global_hourly,
+    "daily_summary": get_daily_sales_summary,
+    "yearly_sales": lambda year: analytics.get_yearly_sales(year),
+    "sales_trends": get_sales_trends,
+    "sales_trend_chart": get_sales_trend_for_merchant,
+    "top_selling_items": lambda date_str: get_top_selling_items(date_str=date_str),
+    "customer_insights": lambda: analytics.get_customer_behavior_insights(),
+    "profitability": lambda: analytics.get_profitability_analysis(),
+    "seasonal_trends": lambda: analytics.get_seasonal_trends(),
+    "low_stock_alerts": lambda: analytics.get_low_stock_alerts(merchant_id=analytics.merchant_id),
+    "promotion_effectiveness": lambda: analytics.get_promotion_effectiveness(),
+    "personalized_suggestions": lambda: analytics.get_personalized_suggestions("Restaurant", "Small"),
+    "inventory_suggestions": lambda: analytics.get_inventory_optimization_suggestions(),
+    "keyword_funnel": lambda text: load_keyword_index().lookup(text)
+}
+
 def process_query(query, merchant_id=None, date_param=None):
     """Process user queries and return appropriate responses"""
-    # Load data if not already loaded
-    if 'data' not in st.session_state:
-        st.session_state.data = load_data()
-    
-    data = st.session_state.data
-    
-    # Check for sales-related queries
-    sales_keywords = [
-        "sales", "how much", "revenue", "earnings", "income",
-        "top selling", "best selling", "popular items", "most sold",
-        "what's selling", "what sells", "selling well", "trends",
-        "compare", "versus", "vs", "difference", "average", "mean",
-        "median", "total", "sum", "amount", "value"
-    ]
-    
-    if any(keyword in query for keyword in sales_keywords):
-        # Handle comparative queries
-        if any(word in query for word in ["compare", "vs", "versus", "difference"]):
-            if "today" in query and "yesterday" in query:
-                today_sales = get_daily_sales_summary()
-                yesterday_sales = get_daily_sales_summary((datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d"))
-                st.markdown("**Comparison: Today vs Yesterday**")
-                st.write(f"Today: {today_sales}")
-                st.write(f"Yesterday: {yesterday_sales}")
-                return
-        
-        # Handle specific metric queries
-        if any(word in query for word in ["average", "mean", "median", "total", "sum"]):
-            if "order" in query and "value" in query:
-                avg_order_value = analytics.transaction_data['order_value'].mean()
-                st.success(f"Average Order Value: RM{avg_order_value:,.2f}")
-                return
-            elif "revenue" in query or "total" in query:
-                total_revenue = analytics.transaction_data['order_value'].sum()
-                total_orders = len(analytics.transaction_data)
-                avg_order_value = total_revenue / total_orders if total_orders > 0 else 0
-                
-                st.markdown("**💰 Total Revenue Summary:**")
-                st.write(f"• Total Revenue: RM{total_revenue:,.2f}")
-                st.write(f"• Total Orders: {total_orders:,}")
-                st.write(f"• Average Order Value: RM{avg_order_value:,.2f}")
-                
-                # Get yearly breakdown
-                yearly_data = analytics.transaction_data.groupby(
-                    analytics.transaction_data['order_time'].dt.year
-                )['order_value'].agg(['sum', 'count']).rename(columns={'sum': 'revenue', 'count': 'orders'})
-                
-                st.markdown("**📊 Yearly Breakdown:**")
-                for year, data in yearly_data.iterrows():
-                    st.write(f"• {year}: RM{data['revenue']:,.2f} ({data['orders']:,} orders)")
-                return
-        
-        # Handle year-specific queries
-        if any(str(year) in query for year in range(2000, 2100)):
-            year = int(next((str(year) for year in range(2000, 2100) if str(year) in query), None))
-            st.markdown(f"**Yearly Sales Summary ({year}):**")
-            yearly_data = analytics.get_yearly_sales(year)
-            
-            if isinstance(yearly_data, dict):
-                st.markdown(f"""
-                • Total Sales: RM{yearly_data['total_sales']:,.2f}
-                • Total Orders: {yearly_data['total_orders']:,}
-                • Average Order Value: RM{yearly_data['average_order_value']:,.2f}
-                • Year-over-Year Growth: {yearly_data['year_over_year_growth']:+.1f}%
-                • Best Month: {yearly_data['best_month'] if yearly_data['best_month'] else 'N/A'}
-                • Worst Month: {yearly_data['worst_month'] if yearly_data['worst_month'] else 'N/A'}
-                """)
-                
-                # Display monthly breakdown
-                st.markdown("**Monthly Breakdown:**")
-                for month, data in yearly_data['monthly_breakdown'].items():
-                    st.write(f"Month {month}: RM{data['sales']:,.2f} ({data['orders']:,} orders)")
-            else:
-                st.warning(yearly_data)
-        
-        # Handle "today" in query
-        elif "today" in query:
-            st.markdown("**Today's Sales Summary:**")
-            today_summary = get_daily_sales_summary()
-            if "No sales data available" in today_summary:
-                st.warning(today_summary)
-            else:
-                st.success(today_summary)
-        
-        # Handle "yesterday" in query
-        elif "yesterday" in query and not date_param:
-            date_param = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-            st.markdown("**Yesterday's Sales Summary:**")
-            yesterday_summary = get_daily_sales_summary(date_param)
-            if "No sales data available" in yesterday_summary:
-                st.warning(yesterday_summary)
-            else:
-                st.success(yesterday_summary)
+    # One step per intent asked for (compound queries get several); the
+    # aggregates the steps need are computed once and shared between them
+    plan = plan_query(query, date_param)
+    rename_span(f"process_query.{plan.name}")
+    aggregates = Aggregates(AGGREGATES)
+    aggregates.compute(plan)
+    for number, step in enumerate(plan.steps):
+        if number:
+            st.divider()
+        render_step(step, date_param, aggregates)
+
+def render_step(step, date_param, aggregates):
+    """Render one planned branch of a query from the shared aggregates"""
+    branch = step.branch
+    
+    # Handle search keyword funnel queries
+    if branch == "keyword_funnel":
+        funnel = aggregates.get(*step.aggregates[0])
+        keywords = funnel['keywords'] or [keyword for item in funnel['items'] for keyword in item['keywords']]
+        if not keywords:
+            st.warning(f"No search keywords found for \"{funnel['term']}\"")
+            return
         
-        # For queries specifically about trends
-        elif "trend" in query:
-            st.markdown("**Sales Trends (Last 7 Days):**")
-            trends = get_sales_trends()
+        # Combined funnel of each menu item mentioned
+        for item in funnel['items']:
+            st.markdown(f"**🔎 Search Funnel: {item['item']}**")
+            st.write(f"• Views: {item['view']:,} → Menu: {item['menu']:,} → Checkout: {item['checkout']:,} → Orders: {item['order']:,}")
+            st.write(f"• Search-to-order conversion: {item['conversion']:.2%} across {len(item['keywords'])} keywords")
+        
+        st.markdown("**🔎 Search Keyword Funnel:**")
+        st.table(pd.DataFrame([{
+            'Keyword': keyword['keyword'],
+            'Views': f"{keyword['view']:,}",
+            'Menu': f"{keyword['menu']:,}",
+            'Checkout': f"{keyword['checkout']:,}",
+            'Orders': f"{keyword['order']:,}",
+            'View → Menu': f"{keyword['menu_rate']:.1%}",
+            'Menu → Checkout': f"{keyword['checkout_rate']:.1%}",
+            'Checkout → Order': f"{keyword['order_rate']:.1%}",
+            'Conversion': f"{keyword['conversion']:.2%}"
+        } for keyword in keywords]))
+        
+        related = sorted({name for keyword in keywords for name in keyword['items']})
+        if related:
+            st.write("Related menu items: " + ", ".join(related))
+        return
+    
+    # Handle comparative queries
+    elif branch == "sales.compare":
+        today_sales, yesterday_sales = (aggregates.get(*key) for key in step.aggregates)
+        st.markdown("**Comparison: Today vs Yesterday**")
+        st.write(f"Today: {today_sales}")
+        st.write(f"Yesterday: {yesterday_sales}")
+        return
+    
+    # Handle specific metric queries
+    elif branch == "sales.average_order_value":
+        hourly = aggregates.get("global_hourly")
+        avg_order_value = hourly['sales'].sum() / hourly['orders'].sum()
+        st.success(f"Average Order Value: RM{avg_order_value:,.2f}")
+        return
+    
+    elif branch == "sales.total_revenue":
+        hourly = aggregates.get("global_hourly")
+        total_revenue = hourly['sales'].sum()
+        total_orders = hourly['orders'].sum()
+        avg_order_value = total_revenue / total_orders if total_orders > 0 else 0
+        
+        st.markdown("**💰 Total Revenue Summary:**")
+        st.write(f"• Total Revenue: RM{total_revenue:,.2f}")
+        st.write(f"• Total Orders: {total_orders:,}")
+        st.write(f"• Average Order Value: RM{avg_order_value:,.2f}")
+        
+        # Get yearly breakdown
+        yearly_data = hourly.groupby(
+            hourly['date'].dt.year
+        ).agg({'sales': 'sum', 'orders': 'sum'}).rename(columns={'sales': 'revenue'})
+        
+        st.markdown("**📊 Yearly Breakdown:**")
+        for year, data in yearly_data.iterrows():
+            st.write(f"• {year}: RM{data['revenue']:,.2f} ({data['orders']:,} orders)")
+        return
+    
+    # Handle year-specific queries
+    elif branch == "sales.yearly":
+        year = step.match.year
+        st.markdown(f"**Yearly Sales Summary ({year}):**")
+        yearly_data = aggregates.get("yearly_sales", year)
+        
+        if isinstance(yearly_data, dict):
+            st.markdown(f"""
+            • Total Sales: RM{yearly_data['total_sales']:,.2f}
+            • Total Orders: {yearly_data['total_orders']:,}
+            • Average Order Value: RM{yearly_data['average_order_value']:,.2f}
+            • Year-over-Year Growth: {yearly_data['year_over_year_growth']:+.1f}%
+            • Best Month: {yearly_data['best_month'] if yearly_data['best_month'] else 'N/A'}
+            • Worst Month: {yearly_data['worst_month'] if yearly_data['worst_month'] else 'N/A'}
+            """)
             
-            if not trends['daily_sales'].empty:
-                # Display daily sales
-                st.write("Daily Sales:")
-                for date, sales in trends['daily_sales'].items():
-                    # Highlight outliers
-                    if date in trends['outliers']:
-                        st.warning(f"{date.strftime('%A, %Y-%m-%d')}: RM{sales:,.2f} ⚠️ Unusual activity")
-                    else:
-                        st.write(f"{date.strftime('%A, %Y-%m-%d')}: RM{sales:,.2f}")
-                
-                # Display summary statistics
-                st.markdown("**Summary Statistics:**")
-                st.write(f"Total Sales: RM{trends['total_sales']:,.2f}")
-                st.write(f"Average Daily Sales: RM{trends['avg_daily_sales']:,.2f}")
-                st.write(f"Growth Rate: {trends['growth_rate']:.2f}%")
-                st.write(f"Best Day: {trends['best_day']}")
-                st.write(f"Worst Day: {trends['worst_day']}")
-                
-                if trends['outliers']:
-                    st.warning("⚠️ Note: Some days show unusual sales activity and were excluded from trend calculations")
-            else:
-                st.warning("No sales data available for trend analysis")
-        
-        # For queries specifically about top/best selling items
-        elif any(phrase in query for phrase in ["top selling", "best selling", "popular items", "most sold"]):
-            st.markdown("**Top Selling Items:**")
-            top_items = get_top_selling_items(date_str=date_param)
-            for item in top_items:
-                st.info(item)
-
-        elif any(word in query for word in ["trend", "graph", "chart", "sales trend", "sales graph"]):
-            st.markdown("### 📈 Sales Trend (Last 7 Days)")
-            trend_data = get_sales_trend_for_merchant()
-            if not trend_data.empty:
-                st.line_chart(trend_data.set_index("Date"))
-            else:
-                st.warning("Not enough data to show trend.")
-
-        
-        # Handle monthly sales queries
-        elif any(phrase in query for phrase in ["monthly sales", "sales by month", "monthly revenue"]):
-            # Get the most recent year with data
-            current_year = analytics.transaction_data['order_time'].dt.year.max()
-            yearly_data = analytics.get_yearly_sales(current_year)
+            # Display monthly breakdown
+            st.markdown("**Monthly Breakdown:**")
+            for month, data in yearly_data['monthly_breakdown'].items():
+                st.write(f"Month {month}: RM{data['sales']:,.2f} ({data['orders']:,} orders)")
+        else:
+            st.warning(yearly_data)
+    
+    # Handle "today" in query
+    elif branch == "sales.today":
+        st.markdown("**Today's Sales Summary:**")
+        today_summary = aggregates.get("daily_summary", None)
+        if "No sales data available" in today_summary:
+            st.warning(today_summary)
+        else:
+            st.success(today_summary)
+    
+    # Handle "yesterday" in query
+    elif branch == "sales.yesterday":
+        st.markdown("**Yesterday's Sales Summary:**")
+        yesterday_summary = aggregates.get(*step.aggregates[0])
+        if "No sales data available" in yesterday_summary:
+            st.warning(yesterday_summary)
+        else:
+            st.success(yesterday_summary)
+    
+    # For queries specifically about trends
+    elif branch == "sales.trends":
+        st.markdown("**Sales Trends (Last 7 Days):**")
+        trends = aggregates.get("sales_trends")
+        
+        if not trends['daily_sales'].empty:
+            # Display daily sales
+            st.write("Daily Sales:")
+            for date, sales in trends['daily_sales'].items():
+                # Highlight outliers
+                if date in trends['outliers']:
+                    st.warning(f"{date.strftime('%A, %Y-%m-%d')}: RM{sales:,.2f} ⚠️ Unusual activity")
+                else:
+                    st.write(f"{date.strftime('%A, %Y-%m-%d')}: RM{sales:,.2f}")
             
-            if isinstance(yearly_data, dict):
-                st.markdown(f"**Monthly Sales Summary ({current_year}):**")
-                
-                # Create a table for monthly data
-                monthly_data = []
-                for month, data in yearly_data['monthly_breakdown'].items():
-                    monthly_data.append({
-                        'Month': month,
-                        'Sales': f"RM{data['sales']:,.2f}",
-                        'Orders': f"{data['orders']:,}",
-                        'Average Order Value': f"RM{data['sales']/data['orders']:,.2f}" if data['orders'] > 0 else "RM0.00"
-                    })
-                
-                # Convert to DataFrame and display
-                df = pd.DataFrame(monthly_data)
-                st.table(df)
-                
-                # Add summary statistics
-                st.markdown("**Summary Statistics:**")
-                total_sales = sum(data['sales'] for data in yearly_data['monthly_breakdown'].values())
-                total_orders = sum(data['orders'] for data in yearly_data['monthly_breakdown'].values())
-                avg_monthly_sales = total_sales / 12
-                avg_monthly_orders = total_orders / 12
-                
-                st.write(f"• Total Annual Sales: RM{total_sales:,.2f}")
-                st.write(f"• Average Monthly Sales: RM{avg_monthly_sales:,.2f}")
-                st.write(f"• Total Annual Orders: {total_orders:,}")
-                st.write(f"• Average Monthly Orders: {avg_monthly_orders:,.0f}")
-                
-                # Show best and worst months
-                best_month = max(yearly_data['monthly_breakdown'].items(), key=lambda x: x[1]['sales'])
-                worst_month = min(yearly_data['monthly_breakdown'].items(), key=lambda x: x[1]['sales'])
-                
-                st.write(f"• Best Month: Month {best_month[0]} (RM{best_month[1]['sales']:,.2f})")
-                st.write(f"• Worst Month: Month {worst_month[0]} (RM{worst_month[1]['sales']:,.2f})")
-            else:
-                st.warning(yearly_data)
+            # Display summary statistics
+            st.markdown("**Summary Statistics:**")
+            st.write(f"Total Sales: RM{trends['total_sales']:,.2f}")
+            st.write(f"Average Daily Sales: RM{trends['avg_daily_sales']:,.2f}")
+            st.write(f"Growth Rate: {trends['growth_rate']:.2f}%")
+            st.write(f"Best Day: {trends['best_day']}")
+            st.write(f"Worst Day: {trends['worst_day']}")
+            
+            if trends['outliers']:
+                st.warning("⚠️ Note: Some days show unusual sales activity and were excluded from trend calculations")
         else:
-            # For general sales queries, just show the daily summary
-            st.markdown("**Sales Summary:**")
-            summary = get_daily_sales_summary(date_param)
-            if "No sales data available" in summary:
-                st.warning(summary)
-            else:
-                st.success(summary)
-        
+            st.warning("No sales data available for trend analysis")
+    
+    # For queries specifically about top/best selling items
+    elif branch == "sales.top_items":
+        st.markdown("**Top Selling Items:**")
+        top_items = aggregates.get("top_selling_items", date_param)
+        for item in top_items:
+            st.info(item)
+    
+    elif branch == "sales.graph":
+        st.markdown("### 📈 Sales Trend (Last 7 Days)")
+        trend_data = aggregates.get("sales_trend_chart")
+        if not trend_data.empty:
+            st.line_chart(trend_data.set_index("Date"))
+        else:
+            st.warning("Not enough data to show trend.")
+    
+    # Handle monthly sales queries
+    elif branch == "sales.monthly":
+        # Get the most recent year with data
+        current_year = aggregates.get("global_hourly")['date'].dt.year.max()
+        yearly_data = aggregates.get("yearly_sales", current_year)
+        
+        if isinstance(yearly_data, dict):
+            st.markdown(f"**Monthly Sales Summary ({current_year}):**")
+            
+            # Create a table for monthly data
+            monthly_data = []
+            for month, data in yearly_data['monthly_breakdown'].items():
+                monthly_data.append({
+                    'Month': month,
+                    'Sales': f"RM{data['sales']:,.2f}",
+                    'Orders': f"{data['orders']:,}",
+                    'Average Order Value': f"RM{data['sales']/data['orders']:,.2f}" if data['orders'] > 0 else "RM0.00"
+                })
+            
+            # Convert to DataFrame and display
+            df = pd.DataFrame(monthly_data)
+            st.table(df)
+            
+            # Add summary statistics
+            st.markdown("**Summary Statistics:**")
+            total_sales = sum(data['sales'] for data in yearly_data['monthly_breakdown'].values())
+            total_orders = sum(data['orders'] for data in yearly_data['monthly_breakdown'].values())
+            avg_monthly_sales = total_sales / 12
+            avg_monthly_orders = total_orders / 12
+            
+            st.write(f"• Total Annual Sales: RM{total_sales:,.2f}")
+            st.write(f"• Average Monthly Sales: RM{avg_monthly_sales:,.2f}")
+            st.write(f"• Total Annual Orders: {total_orders:,}")
+            st.write(f"• Average Monthly Orders: {avg_monthly_orders:,.0f}")
+            
+            # Show best and worst months
+            best_month = max(yearly_data['monthly_breakdown'].items(), key=lambda x: x[1]['sales'])
+            worst_month = min(yearly_data['monthly_breakdown'].items(), key=lambda x: x[1]['sales'])
+            
+            st.write(f"• Best Month: Month {best_month[0]} (RM{best_month[1]['sales']:,.2f})")
+            st.write(f"• Worst Month: Month {worst_month[0]} (RM{worst_month[1]['sales']:,.2f})")
+        else:
+            st.warning(yearly_data)
+    
+    # For general sales queries, just show the daily summary
+    elif branch == "sales.summary":
+        # For general sales queries, just show the daily summary
+        st.markdown("**Sales Summary:**")
+        summary = aggregates.get("daily_summary", date_param)
+        if "No sales data available" in summary:
+            st.warning(summary)
+        else:
+            st.success(summary)
     
     # Handle customer behavior queries
-    elif any(word in query for word in ["customer", "behavior", "pattern", "preference"]):
-        customer_insights = analytics.get_customer_behavior_insights()
+    elif branch == "customer_behavior":
+        customer_insights = aggregates.get("customer_insights")
         st.markdown("**Customer Behavior Insights:**")
         st.write(f"Average Order Value: RM{customer_insights['average_order_value']:,.2f}")
         st.write(f"Average Items per Order: {customer_insights['average_items_per_order']:.1f}")
@@ -276,8 +371,8 @@ def process_query(query, merchant_id=None, date_param=None):
             st.write(f"• {cuisine}: {count} orders")
     
     # Handle profitability queries
-    elif any(word in query for word in ["profit", "revenue", "income", "earnings"]):
-        profitability = analytics.get_profitability_analysis()
+    elif branch == "profitability":
+        profitability = aggregates.get("profitability")
         st.markdown("**Profitability Analysis:**")
         
         st.markdown("**Item-Level Profitability:**")
@@ -295,8 +390,8 @@ def process_query(query, merchant_id=None, date_param=None):
             st.write(f"  - Total Orders: {metrics['total_orders']}")
     
     # Handle seasonal trend queries
-    elif any(word in query for word in ["seasonal", "trend", "pattern", "monthly"]):
-        trends = analytics.get_seasonal_trends()
+    elif branch == "seasonal_trends":
+        trends = aggregates.get("seasonal_trends")
         st.markdown("**Seasonal Trends:**")
         
         st.markdown("**Monthly Trends:**")
@@ -308,11 +403,12 @@ def process_query(query, merchant_id=None, date_param=None):
             st.write(f"{day}: RM{data[('order_value', 'sum')]:,.2f} sales")
     
     # Handle inventory queries
-    elif any(word in query for word in ["inventory", "stock", "supply", "restock"]):
-        # Get low stock alerts using the analytics object
-        alerts = analytics.get_low_stock_alerts()
+    elif branch == "inventory":
+        # Get low stock alerts for the logged-in merchant's items
+        alerts = aggregates.get("low_stock_alerts")
         
-        if alerts and isinstance(alerts, list) and len(alerts) > 0 and isinstance(alerts[0], dict):
+        # A healthy merchant gets a single status entry instead of alerts
+        if alerts and isinstance(alerts, list) and isinstance(alerts[0], dict) and 'status' not in alerts[0]:
             st.markdown("**📦 Inventory Alerts**")
             
             # Create a container for alerts
@@ -400,8 +496,8 @@ def process_query(query, merchant_id=None, date_param=None):
             """)
     
     # Handle promotion queries
-    elif any(word in query for word in ["promotion", "discount", "offer", "deal"]):
-        promotion_metrics = analytics.get_promotion_effectiveness()
+    elif branch == "promotions":
+        promotion_metrics = aggregates.get("promotion_effectiveness")
         
         if isinstance(promotion_metrics, dict):
             if promotion_metrics.get('status') == 'no_promotions':
@@ -440,10 +536,10 @@ def process_query(query, merchant_id=None, date_param=None):
             st.error(promotion_metrics)
     
     # Handle help and greeting queries
-    elif any(word in query for word in ["hi", "hello", "hey", "greetings"]):
+    elif branch == "greeting":
         st.success("Hello! How can I help you today? You can ask me about sales, inventory, or business insights.")
     
-    elif any(word in query for word in ["help", "what can you do", "capabilities"]):
+    elif branch == "help":
         st.markdown("""
         Definitely!! I can help you with:
         
@@ -473,9 +569,9 @@ def process_query(query, merchant_id=None, date_param=None):
         """)
     
     # Handle business tips queries
-    elif any(phrase in query for phrase in ["business tips", "suggestions", "improve", "advice", "recommendations"]):
+    elif branch == "business_tips":
         # Get personalized suggestions based on business type and size
-        suggestions = analytics.get_personalized_suggestions("Restaurant", "Small")
+        suggestions = aggregates.get("personalized_suggestions")
         
         st.markdown("**📈 Data-Driven Business Tips:**")
         
@@ -489,14 +585,14 @@ def process_query(query, merchant_id=None, date_param=None):
         st.write("• " + suggestions[2])  # Staffing suggestion
         
         # Get inventory suggestions
-        inventory_suggestions = analytics.get_inventory_optimization_suggestions()
+        inventory_suggestions = aggregates.get("inventory_suggestions")
         if inventory_suggestions:
             st.markdown("### 📦 Inventory Management")
             for suggestion in inventory_suggestions:
                 st.write("• " + suggestion)
         
         # Get promotion effectiveness
-        promo_metrics = analytics.get_promotion_effectiveness()
+        promo_metrics = aggregates.get("promotion_effectiveness")
         if isinstance(promo_metrics, dict):
             st.markdown("### 🎯 Promotions & Marketing")
             if promo_metrics.get('status') == 'no_promotions':
@@ -509,7 +605,7 @@ def process_query(query, merchant_id=None, date_param=None):
                 st.write(f"• Total promotional days: {promo_metrics['total_promotional_days']}")
         
         # Get customer behavior insights
-        customer_insights = analytics.get_customer_behavior_insights()
+        customer_insights = aggregates.get("customer_insights")
         st.markdown("### 👥 Customer Insights")
         st.write(f"• Average order value: RM{customer_insights['average_order_value']:,.2f}")
         st.write(f"• Average items per order: {customer_insights['average_items_per_order']:.1f}")
@@ -521,7 +617,7 @@ def process_query(query, merchant_id=None, date_param=None):
             st.write(f"  - {cuisine}: {count} orders")
         
         # Get profitability analysis
-        profitability = analytics.get_profitability_analysis()
+        profitability = aggregates.get("profitability")
         st.markdown("### 💰 Profitability Insights")
         st.write("• Most profitable items:")
         for item, metrics in profitability['item_profitability'].head(3).iterrows():
@@ -530,10 +626,10 @@ def process_query(query, merchant_id=None, date_param=None):
         for category, metrics in profitability['category_profitability'].head(3).iterrows():
             st.write(f"  - {category}: RM{metrics['total_revenue']:,.2f} revenue")
     
-    elif any(word in query for word in ["trend", "graph", "chart", "sales trend", "sales graph"]):
+    elif branch == "sales_graph":
         st.markdown("### 📈 Sales Trend (Last 7 Days)")
 
-        trend_data = get_sales_trend_for_merchant()
+        trend_data = aggregates.get("sales_trend_chart")
 
         if not trend_data.empty:
             st.line_chart(trend_data.set_index("Date"))
@@ -541,12 +637,13 @@ def process_query(query, merchant_id=None, date_param=None):
             st.warning("Not enough data to show trend.")
 
     # Handle day performance queries
-    elif any(phrase in query for phrase in ["best day", "worst day", "best performing", "worst performing", "best and worst"]):
+    elif branch == "best_day":
         # Get daily sales patterns
+        hourly = aggregates.get("global_hourly")
         daily_sales = (
-            analytics.transaction_data.groupby(
-                analytics.transaction_data['order_time'].dt.day_name()
-            )['order_value'].agg(['sum', 'count']).rename(columns={'sum': 'revenue', 'count': 'orders'})
+            hourly.groupby(
+                hourly['date'].dt.day_name()
+            ).agg({'sales': 'sum', 'orders': 'sum'}).rename(columns={'sales': 'revenue'})
         )
         
         # Sort by revenue to get best and worst days
@@ -579,8 +676,8 @@ def process_query(query, merchant_id=None, date_param=None):
         return
     
     # Handle customer behavior queries
-    elif any(phrase in query for phrase in ["peak hours", "busiest hours", "busy times", "rush hours"]):
-        customer_insights = analytics.get_customer_behavior_insights()
+    elif branch == "peak_hours":
+        customer_insights = aggregates.get("customer_insights")
         
         st.markdown("**⏰ Peak Hours Analysis:**")
         
@@ -618,8 +715,8 @@ def process_query(query, merchant_id=None, date_param=None):
         return
     
     # Handle cuisine-related queries
-    elif any(phrase in query for phrase in ["popular cuisines", "most popular cuisines", "cuisine preferences", "favorite cuisines"]):
-        customer_insights = analytics.get_customer_behavior_insights()
+    elif branch == "popular_cuisines":
+        customer_insights = aggregates.get("customer_insights")
         
         st.markdown("**🍽️ Popular Cuisines Analysis:**")
         
@@ -655,6 +752,49 @@ def process_query(query, merchant_id=None, date_param=None):
         Try asking about any of these topics!
         """)
 
+def show_debug_panel(query_trace):
+    """Per-stage timings of the last query with JSON/Prometheus exports (shown when MEX_INSTRUMENTATION=1)"""
+    with st.expander("⏱️ Query timings"):
+        st.caption(
+            f"{query_trace.name}: {query_trace.seconds * 1000:,.1f} ms. "
+            "Self time is spent outside the nested stages, mostly rendering."
+        )
+        st.dataframe(pd.DataFrame(flatten(query_trace)), hide_index=True, use_container_width=True)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("Download JSON", to_json(), file_name="mex_traces.json", mime="application/json")
+        with col2:
+            st.download_button("Download Prometheus", to_prometheus(), file_name="mex_metrics.prom", mime="text/plain")
+
+def _apply_profiler_setting(setting):
+    # Applies to every session of this server process
+    configure_profiler(**{setting: st.session_state[f"profiler_{setting}"]})
+
+
+def show_profiler_panel():
+    """Sidebar controls for the profiler and the saved slow-request profiles (MEX_PROFILER_ADMIN=1)"""
+    # The widgets show the process-wide settings, which other sessions and
+    # the MEX_PROFILER* variables also set; only a change made here applies
+    settings = profiler_settings()
+    st.session_state.profiler_mode = settings["mode"]
+    st.session_state.profiler_scope = settings["scope"]
+    st.session_state.profiler_slow_ms = int(settings["slow_ms"])
+    with st.sidebar.expander("🛠️ Profiler"):
+        st.selectbox("Mode", PROFILER_MODES, key="profiler_mode", on_change=_apply_profiler_setting, args=("mode",))
+        st.selectbox("Scope", PROFILE_SCOPES, key="profiler_scope", on_change=_apply_profiler_setting, args=("scope",))
+        st.number_input(
+            "Save requests slower than (ms)", min_value=0, step=100,
+            key="profiler_slow_ms", on_change=_apply_profiler_setting, args=("slow_ms",)
+        )
+
+        for entry in reversed(recent_profiles()):
+            st.caption(f"{entry['name']} {entry['attrs'].get('query', '')} - {entry['ms']:,.0f} ms ({entry['mode']})")
+            if os.path.exists(entry["path"]):
+                with open(entry["path"], "rb") as f:
+                    st.download_button(
+                        "Download", f.read(), file_name=os.path.basename(entry["path"]), key=entry["path"]
+                    )
+
 # Streamlit UI
 st.set_page_config(page_title="MEX Assistant", page_icon="=")
 # Inject custom CSS to make sidebar green
@@ -672,6 +812,15 @@ st.image("grab-merchant.png", width=150)
 st.title("MEX Assistant - AI Business Assistant")
 st.write("Hi there!! Ask me about your sales, stock or tips to improve your business.")
 
+# Display smart nudges (after set_page_config, which must come first)
+if st.session_state.logged_in:
+    nudges = analytics.get_smart_nudges()
+    if nudges:
+        st.markdown("### 💡 Smart Suggestions")
+        for nudge in nudges:
+            st.info(nudge)
+        st.markdown("---")
+
 with st.sidebar:
     st.markdown(
         f"""
@@ -700,10 +849,9 @@ merchant_name = merchant_df[merchant_df["merchant_id"] == merchant_id]["merchant
 st.sidebar.markdown(f"**Logged in as:** {merchant_name}")
 
 
-# Convert dataset order_time to datetime
-data["transaction_data"]["order_time"] = pd.to_datetime(data["transaction_data"]["order_time"])
-min_date = data["transaction_data"]["order_time"].min().date()
-max_date = data["transaction_data"]["order_time"].max().date()
+# Date range of the whole dataset, from the shared global aggregate
+min_date = analytics.global_aggregate["first_order_time"].date()
+max_date = analytics.global_aggregate["last_order_time"].date()
 
 # Initialize date in session state if not present
 if "selected_date" not in st.session_state:
@@ -756,10 +904,14 @@ selected_language = st.sidebar.selectbox(
     # Store selected language code in session state
 st.session_state.language = LANGUAGES[selected_language]
 
+if PROFILER_ADMIN:
+    show_profiler_panel()
+
 # Add logout button
 if st.sidebar.button("🔓 Log Out"):
     st.session_state.logged_in = False
     st.session_state.merchant_id = None
+    end_analytics_session()
     st.rerun()
 
 # Add help section
@@ -810,6 +962,11 @@ with st.expander("💡 What can I ask?"):
     - "What are our weekday patterns?"
     - "What's our best performing month?"
     
+    ### Search Keywords
+    - "How is 'spring rolls' converting?"
+    - "Show me the search funnel for fried spring rolls"
+    - "What's the conversion for 'egg rols'?" (typos are fine)
+    
     ### Business Tips
     - "Give me some business tips"
     - "What suggestions do you have?"
@@ -833,5 +990,11 @@ if query:
     # Convert date to string if selected
     date_param = selected_date.strftime("%Y-%m-%d") if selected_date else None
     
-    # Process the query
-    process_query(query.lower().strip(), merchant_id, date_param)
\ No newline at end of file
+    # Process the query, timed per stage when instrumentation is enabled
+    with trace("process_query", query=query) as query_trace:
+        with profile_request("process_query", query=query):
+            process_query(query.lower().strip(), merchant_id, date_param)
+    if is_enabled():
+        show_debug_panel(query_trace)
+
+finish_profile(rerun_profile)
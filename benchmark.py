@@ -0,0 +1,496 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Generated datasets and reports are written under this directory
+BENCH_DIR = os.environ.get("MEX_BENCH_DIR", "benchmarks")
+
+# Orders in a 1x dataset, about the size of the shipped transaction CSVs
+# (~1M orders, ~2M item rows). Scales multiply it.
+BASE_ORDERS = int(os.environ.get("MEX_BENCH_BASE_ORDERS", "1000000"))
+SCALES = (1, 10, 100)
+
+# Timed calls per function after the first (cold) one
+REPEATS = int(os.environ.get("MEX_BENCH_REPEATS", "5"))
+
+# Orders generated and written per CSV chunk, bounds the generator's memory
+GENERATE_CHUNK_ORDERS = 1000000
+
+# A benchmark counts as regressed when its time grows by more than this
+REGRESSION_TOLERANCE = 0.2
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_META = "dataset.json"
+
+# Copied from the repo into every dataset: the catalog tables and the
+# images app.py reads from its working directory
+CATALOG_FILES = ("merchant.csv", "items.csv", "keywords.csv")
+APP_ASSETS = ("Grab_white.png", "grab-merchant.png")
+
+FIRST_DATE = "2023-01-01"
+LAST_DATE = "2024-06-30"
+
+# One query per process_query branch in app.py, matched in the same order,
+# then compound queries whose steps share their aggregates
+QUERIES = {
+    "keyword_funnel": "how is 'spring rolls' converting?",
+    "compare_days": "compare today vs yesterday sales",
+    "average_order_value": "average order value",
+    "total_revenue": "total revenue",
+    "yearly_sales": "sales 2023",
+    "today": "today's sales",
+    "yesterday": "yesterday sales",
+    "sales_trends": "sales trend",
+    "top_selling": "top selling items",
+    "sales_graph": "show me sales graph",
+    "monthly_sales": "monthly sales",
+    "sales_summary": "sales",
+    "customer_behavior": "customer behavior",
+    "profitability": "profit",
+    "seasonal_trends": "seasonal",
+    "inventory": "inventory",
+    "promotions": "promotion",
+    "greeting": "hello",
+    "help": "what can you do",
+    "business_tips": "business tips",
+    "best_day": "best day",
+    "peak_hours": "peak hours",
+    "popular_cuisines": "popular cuisines",
+    "fallback": "xyz",
+    "compound_today_top_selling": "show me today's sales and top items",
+    "compound_tips_peak_hours": "business tips and peak hours"
+}
+
+# Queries also timed for a merchant with no low stock alerts, whose
+# inventory view renders the healthy message instead of the alerts
+HEALTHY_QUERIES = {
+    "inventory_healthy": "inventory",
+    "stock_levels_healthy": "check my stock levels"
+}
+
+
+def _order_ids(numbers):
+    """Unique 10-hex-digit order ids (an odd multiplier permutes 40-bit numbers)"""
+    keys = (numbers.astype(np.uint64) * np.uint64(0x9E3779B97F)) % np.uint64(2**40)
+    return [f"{key:010x}" for key in keys.tolist()]
+
+
+def generate_dataset(directory, scale=1, base_orders=BASE_ORDERS, seed=0, progress=print):
+    """
+    Write a synthetic dataset with the schema of the shipped CSVs into
+    directory: base_orders * scale orders over FIRST_DATE..LAST_DATE with
+    1-3 items each, spread over the merchants and menus of the repo's
+    merchant.csv and items.csv (copied along with keywords.csv). Sales
+    follow weekday, hour and month patterns and a long tail of merchant
+    and item popularity. Transactions are written in chunks, so any scale
+    fits in memory. Returns the dataset's metadata.
+    """
+    started = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    for name in CATALOG_FILES + APP_ASSETS:
+        shutil.copy(os.path.join(PACKAGE_DIR, name), directory)
+
+    rng = np.random.default_rng(seed)
+    items = pd.read_csv(os.path.join(PACKAGE_DIR, "items.csv"), dtype={"merchant_id": str})
+    known = set(pd.read_csv(os.path.join(PACKAGE_DIR, "merchant.csv"), dtype={"merchant_id": str})["merchant_id"])
+    items = items[items["merchant_id"].isin(known)]
+    merchant_ids = np.array(sorted(items["merchant_id"].unique()), dtype=object)
+    merchant_weights = rng.pareto(1.5, len(merchant_ids)) + 0.2
+    merchant_weights /= merchant_weights.sum()
+
+    # Each merchant's menu, its first items ordered most often
+    menus = []
+    for merchant_id in merchant_ids:
+        menu = items[items["merchant_id"] == merchant_id]
+        weights = 1.0 / np.arange(1, len(menu) + 1) ** 1.2
+        menus.append((menu["item_id"].to_numpy(), menu["item_price"].to_numpy(), weights / weights.sum()))
+
+    days = pd.date_range(FIRST_DATE, LAST_DATE, freq="D")
+    weekday, month = days.dayofweek.to_numpy(), days.month.to_numpy()
+    day_weights = np.select([weekday >= 5, weekday == 1], [1.6, 0.6], 1.0) * (1 + 0.2 * np.sin(2 * np.pi * (month - 3) / 12))
+    day_weights /= day_weights.sum()
+    hour_weights = np.ones(24)
+    hour_weights[:6], hour_weights[11:14], hour_weights[18:21] = 0.2, 4, 3
+    hour_weights /= hour_weights.sum()
+
+    total = base_orders * scale
+    merchant_orders = np.zeros(len(merchant_ids), dtype=np.int64)
+    order_path = os.path.join(directory, "transaction_data.csv")
+    item_path = os.path.join(directory, "transaction_items.csv")
+    item_rows = 0
+    for start in range(0, total, GENERATE_CHUNK_ORDERS):
+        n = min(GENERATE_CHUNK_ORDERS, total - start)
+        order_ids = _order_ids(np.arange(start, start + n))
+        merchants = rng.choice(len(merchant_ids), n, p=merchant_weights)
+        merchant_orders += np.bincount(merchants, minlength=len(merchant_ids))
+
+        order_time = (
+            days.values[rng.choice(len(days), n, p=day_weights)]
+            + rng.choice(24, n, p=hour_weights).astype("timedelta64[h]")
+            + rng.integers(0, 3600, n).astype("timedelta64[s]")
+        ).astype("datetime64[s]")
+        arrival = order_time + rng.integers(180, 600, n).astype("timedelta64[s]")
+        pickup = arrival + rng.integers(120, 600, n).astype("timedelta64[s]")
+        delivery = pickup + rng.integers(600, 2400, n).astype("timedelta64[s]")
+
+        # 1-3 items per order from its merchant's menu; the order value is their total
+        counts = rng.integers(1, 4, n)
+        item_merchants = np.repeat(merchants, counts)
+        item_ids = np.empty(len(item_merchants), dtype=np.int64)
+        prices = np.empty(len(item_merchants))
+        for code in np.unique(item_merchants):
+            rows = np.flatnonzero(item_merchants == code)
+            ids, menu_prices, weights = menus[code]
+            picked = rng.choice(len(ids), len(rows), p=weights)
+            item_ids[rows], prices[rows] = ids[picked], menu_prices[picked]
+        order_value = np.add.reduceat(prices, np.concatenate([[0], np.cumsum(counts)[:-1]])).round(2)
+
+        header, mode = start == 0, "w" if start == 0 else "a"
+        pd.DataFrame({
+            "order_id": order_ids,
+            "order_time": order_time,
+            "driver_arrival_time": arrival,
+            "driver_pickup_time": pickup,
+            "delivery_time": delivery,
+            "order_value": order_value,
+            "eater_id": rng.integers(1, 20000 * scale, n),
+            "merchant_id": merchant_ids[merchants]
+        }).to_csv(order_path, mode=mode, header=header, index=False)
+        pd.DataFrame({
+            "order_id": np.repeat(np.array(order_ids, dtype=object), counts),
+            "item_id": item_ids,
+            "merchant_id": merchant_ids[item_merchants]
+        }).to_csv(item_path, mode=mode, header=header, index=False)
+        item_rows += len(item_ids)
+        progress(f"Generated {start + n:,}/{total:,} orders ({time.perf_counter() - started:,.1f} s)")
+
+    meta = {
+        "scale": scale,
+        "base_orders": base_orders,
+        "seed": seed,
+        "orders": total,
+        "item_rows": item_rows,
+        "merchants": len(merchant_ids),
+        "busiest_merchant": merchant_ids[int(merchant_orders.argmax())],
+        "first_date": FIRST_DATE,
+        "last_date": LAST_DATE,
+        "bytes": os.path.getsize(order_path) + os.path.getsize(item_path)
+    }
+    with open(os.path.join(directory, DATASET_META), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def ensure_dataset(scale, base_orders=BASE_ORDERS, seed=0, regenerate=False, progress=print):
+    """Directory of the dataset for a scale under BENCH_DIR, generated unless an identical one exists"""
+    directory = os.path.join(BENCH_DIR, f"scale-{scale}")
+    try:
+        with open(os.path.join(directory, DATASET_META)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = None
+    if regenerate or meta is None or (meta["base_orders"], meta["seed"]) != (base_orders, seed):
+        generate_dataset(directory, scale, base_orders, seed, progress)
+    return directory
+
+
+def measure(function, repeats=REPEATS):
+    """
+    Time function: the first call (which also loads whatever the call reads
+    for the first time), then repeats more calls, then one more call under
+    tracemalloc for its peak traced allocation. Errors are recorded, not
+    raised.
+    """
+    try:
+        started = time.perf_counter()
+        function()
+        result = {"first_ms": (time.perf_counter() - started) * 1000}
+        times = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            function()
+            times.append((time.perf_counter() - started) * 1000)
+        if times:
+            result.update(median_ms=statistics.median(times), min_ms=min(times), max_ms=max(times))
+
+        tracemalloc.start()
+        try:
+            function()
+            result["peak_alloc_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+        return result
+    except Exception as e:
+        print(f"Error in benchmark: {str(e)}")
+        return {"error": str(e)}
+
+
+def _logic_script():
+    """AppTest script timing the logic.get_* functions (they read the merchant and date from session state)"""
+    import streamlit as st
+    from datetime import date
+
+    import logic
+    from benchmark import measure
+
+    params = st.session_state.benchmark_params
+    st.session_state.merchant_id = params["merchant_id"]
+    st.session_state.selected_date = date.fromisoformat(params["date"])
+    functions = {
+        "get_merged_data": lambda: logic.get_merged_data(logic.data),
+        "get_daily_sales_summary": lambda: logic.get_daily_sales_summary(params["date"]),
+        "get_sales_trend_for_merchant": lambda: logic.get_sales_trend_for_merchant(),
+        "get_top_selling_items": lambda: logic.get_top_selling_items(date_str=params["date"]),
+        "get_low_stock_alerts": lambda: logic.get_low_stock_alerts(logic.data, params["merchant_id"]),
+        "get_sales_trends": lambda: logic.get_sales_trends(),
+        "get_simple_suggestion": lambda: logic.get_simple_suggestion("Restaurant", "Small")
+    }
+    st.session_state.benchmark_results = {
+        f"logic.{name}": measure(function, params["repeats"]) for name, function in functions.items()
+    }
+
+
+def _run_query(app, query):
+    app.text_input[0].set_value(query).run()
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+
+
+def _logged_in_app(merchant_id, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(PACKAGE_DIR, "app.py"), default_timeout=timeout)
+    app.session_state.logged_in = True
+    app.session_state.merchant_id = merchant_id
+    return app
+
+
+def benchmark_queries(merchant_id, repeats=REPEATS, timeout=3600, healthy_merchant_id=None):
+    """
+    Time each process_query branch as the app's rerun for its query
+    (QUERIES), logged in as merchant_id, then HEALTHY_QUERIES logged in as
+    healthy_merchant_id (when given). "rerun" is the rerun with no query,
+    the part of every entry that isn't the branch itself. A query the app
+    fails on raises, so a crashing view fails the benchmark.
+    """
+    app = _logged_in_app(merchant_id, timeout)
+    results = {"app.login": measure(app.run, 0)}
+    results["app.rerun"] = measure(lambda: _run_query(app, ""), repeats)
+    for branch, query in QUERIES.items():
+        results[f"process_query.{branch}"] = dict(measure(lambda: _run_query(app, query), repeats), query=query)
+    if healthy_merchant_id is not None:
+        app = _logged_in_app(healthy_merchant_id, timeout)
+        app.run()
+        for branch, query in HEALTHY_QUERIES.items():
+            results[f"process_query.{branch}"] = dict(
+                measure(lambda: _run_query(app, query), repeats), query=query, merchant_id=healthy_merchant_id
+            )
+
+    failed = {name: timing["error"] for name, timing in results.items() if "error" in timing}
+    if failed:
+        raise RuntimeError(f"Queries failed: {failed}")
+    return results
+
+
+def find_healthy_merchant(analytics, merchant_ids):
+    """First of merchant_ids without low stock alerts, or None"""
+    for merchant_id in merchant_ids:
+        alerts = analytics.get_low_stock_alerts(merchant_id=merchant_id)
+        if alerts and "status" in alerts[0]:
+            return merchant_id
+    return None
+
+
+def run_benchmarks(merchant_id, date, repeats=REPEATS, progress=print):
+    """
+    Benchmark every analytics entry point on the dataset in the working
+    directory, from a cold start (no snapshots). Results are memoized per
+    call otherwise, so the results cache is disabled to time the work
+    itself; the data each function reads stays loaded after its first call.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    from data_loader import get_peak_rss_mb, load_data
+    from helper import BusinessAnalytics
+    from nudge_table import build_nudge_table
+    from results_cache import ResultsCache, set_results_cache
+    from smart_nudges import SmartNudges
+
+    set_results_cache(ResultsCache(max_entries=0))
+    results = {}
+
+    def record(name, timing):
+        results[name] = timing
+        shown = timing.get("median_ms", timing.get("first_ms"))
+        progress(f"{name}: " + (f"{shown:,.1f} ms" if shown is not None else timing.get("error", "")))
+
+    # Setup: parse the CSVs and build the snapshots, partitions and aggregates
+    data = load_data()
+    for name in ("transaction_data", "transaction_items"):
+        record(f"load_data.{name}", measure(lambda: data[name], 0))
+    record("BusinessAnalytics.__init__", measure(lambda: BusinessAnalytics(merchant_id).close(), repeats))
+    setup_rss = get_peak_rss_mb()
+
+    analytics = BusinessAnalytics(merchant_id)
+    year = int(date[:4])
+    views = {
+        "get_smart_nudges": lambda: analytics.get_smart_nudges(),
+        "get_weekly_growth_trends": lambda: analytics.get_weekly_growth_trends(),
+        "get_top_3_items": lambda: analytics.get_top_3_items(),
+        "get_low_stock_alerts": lambda: analytics.get_low_stock_alerts(merchant_id=merchant_id),
+        "get_personalized_suggestions": lambda: analytics.get_personalized_suggestions("Restaurant", "Small"),
+        "get_yearly_sales": lambda: analytics.get_yearly_sales(year - 1),
+        "get_sales_insights": lambda: analytics.get_sales_insights(),
+        "get_customer_behavior_insights": lambda: analytics.get_customer_behavior_insights(),
+        "get_seasonal_trends": lambda: analytics.get_seasonal_trends(),
+        "get_profitability_analysis": lambda: analytics.get_profitability_analysis(),
+        "get_inventory_optimization_suggestions": lambda: analytics.get_inventory_optimization_suggestions(),
+        "get_promotion_effectiveness": lambda: analytics.get_promotion_effectiveness()
+    }
+    for name, function in views.items():
+        record(f"BusinessAnalytics.{name}", measure(function, repeats))
+
+    record("SmartNudges.generate_nudges", measure(lambda: SmartNudges(
+        analytics.merchant_transactions,
+        merchant_id,
+        analytics.items,
+        analytics.merchant_transaction_items,
+        hourly_rollup=analytics.merchant_hourly,
+        order_items=analytics.smart_nudges.order_items
+    ).generate_nudges(), repeats))
+    record("nudge_table.build_nudge_table", measure(build_nudge_table, min(repeats, 1)))
+    healthy_merchant_id = find_healthy_merchant(analytics, analytics.merchant["merchant_id"])
+    analytics.close()
+
+    # logic.get_* and process_query read streamlit session state, so they run in an AppTest
+    app = AppTest.from_function(_logic_script, default_timeout=3600)
+    app.session_state.benchmark_params = {"merchant_id": merchant_id, "date": date, "repeats": repeats}
+    app.run()
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+    for name, timing in app.session_state.benchmark_results.items():
+        record(name, timing)
+    if healthy_merchant_id is None:
+        progress("No merchant without low stock alerts, healthy inventory queries skipped")
+    for name, timing in benchmark_queries(merchant_id, repeats, healthy_merchant_id=healthy_merchant_id).items():
+        record(name, timing)
+
+    return {"setup_peak_rss_mb": setup_rss, "peak_rss_mb": get_peak_rss_mb(), "results": results}
+
+
+def _environment():
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {key: value for key, value in sorted(os.environ.items()) if key.startswith("MEX_")}
+    }
+
+
+def run_scale(scale, base_orders=BASE_ORDERS, seed=0, repeats=REPEATS, regenerate=False, merchant_id=None):
+    """
+    Benchmark one scale in a fresh process (so caches and peak RSS start
+    clean), working in the dataset's directory with its snapshots removed.
+    Returns the scale's report entry.
+    """
+    directory = ensure_dataset(scale, base_orders, seed, regenerate)
+    with open(os.path.join(directory, DATASET_META)) as f:
+        dataset = json.load(f)
+    shutil.rmtree(os.path.join(directory, ".snapshots"), ignore_errors=True)
+
+    output = os.path.join(directory, "results.json")
+    command = [
+        sys.executable, os.path.abspath(__file__), "--run",
+        "--merchant", merchant_id or dataset["busiest_merchant"],
+        "--date", dataset["last_date"],
+        "--repeats", str(repeats),
+        "--output", os.path.abspath(output)
+    ]
+    started = time.perf_counter()
+    subprocess.run(command, cwd=directory, env={**os.environ, "MEX_WARMUP": "0"}, check=True)
+    with open(output) as f:
+        measured = json.load(f)
+    return {
+        "scale": scale,
+        "dataset": dataset,
+        "merchant_id": merchant_id or dataset["busiest_merchant"],
+        "seconds": time.perf_counter() - started,
+        **measured
+    }
+
+
+def compare_reports(baseline, current, tolerance=REGRESSION_TOLERANCE):
+    """
+    Entries of current slower than in baseline by more than tolerance, as
+    (scale, name, baseline ms, current ms). Compares median times, or the
+    first call for entries timed once.
+    """
+    def timings(report):
+        return {
+            (entry["scale"], name): timing.get("median_ms", timing.get("first_ms"))
+            for entry in report["scales"]
+            for name, timing in entry["results"].items()
+        }
+
+    before, after = timings(baseline), timings(current)
+    return [
+        (scale, name, before[(scale, name)], ms)
+        for (scale, name), ms in after.items()
+        if ms is not None and before.get((scale, name)) and ms > before[(scale, name)] * (1 + tolerance)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the analytics entry points on synthetic datasets")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(SCALES), help="dataset sizes as multiples of --base-orders")
+    parser.add_argument("--base-orders", type=int, default=BASE_ORDERS, help="orders in a 1x dataset")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the generated data")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="timed calls per function after the first")
+    parser.add_argument("--merchant", help="merchant to benchmark (default: the busiest)")
+    parser.add_argument("--regenerate", action="store_true", help="regenerate datasets that already exist")
+    parser.add_argument("--output", default=os.path.join(BENCH_DIR, "report.json"), help="JSON report path")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "REPORT"), help="list regressions between two reports")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="slowdown allowed by --compare")
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--date", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        regressions = compare_reports(baseline, current, args.tolerance)
+        for scale, name, before, after in regressions:
+            print(f"{scale}x {name}: {before:,.1f} ms -> {after:,.1f} ms ({after / before - 1:+.0%})")
+        print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    if args.run:
+        # Child process of run_scale, working in the dataset's directory
+        measured = run_benchmarks(args.merchant, args.date, args.repeats)
+        with open(args.output, "w") as f:
+            json.dump(measured, f, indent=2)
+        sys.exit(0)
+
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "repeats": args.repeats, **_environment(), "scales": []}
+    for scale in args.scales:
+        print(f"Benchmarking {scale}x ({args.base_orders * scale:,} orders)")
+        report["scales"].append(run_scale(scale, args.base_orders, args.seed, args.repeats, args.regenerate, args.merchant))
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
@@ -9,6 +9,7 @@ from logic import (
 import pandas as pd
 from datetime import datetime
 from helper import BusinessAnalytics
+from intents import CHAT_ROUTER
 
 # Initialize session state for chat history
 if 'chat_history' not in st.session_state:
@@ -83,10 +84,11 @@ if prompt := st.chat_input("Ask me something..."):
 
 def process_query(query):
     query = query.lower()
+    match = CHAT_ROUTER.match(query)
     
     # Sales related queries
-    if any(word in query for word in ["sales", "revenue", "earnings", "income", "how much"]):
-        if any(word in query for word in ["week", "weekly", "trend", "growth"]):
+    if match.topic == "sales":
+        if match.has("weekly"):
             growth_data = analytics.get_weekly_growth_trends()
             response = f"""📈 Weekly Growth Analysis:
 • Current Week Sales: RM{growth_data['current_week']['total_sales']:,.2f}
@@ -107,7 +109,7 @@ Compared to last week:
         return response
     
     # Inventory related queries
-    elif any(word in query for word in ["stock", "inventory", "items", "running low"]):
+    elif match.topic == "inventory":
         alerts = analytics.get_low_stock_alerts()
         response = "**Inventory Status:**\n"
         for alert in alerts:
@@ -121,7 +123,7 @@ Compared to last week:
         return response
     
     # Tips and suggestions
-    elif any(word in query for word in ["tip", "suggest", "advice", "help", "improve"]):
+    elif match.topic == "tips":
         suggestions = analytics.get_personalized_suggestions(merchant_type, business_size)
         response = "**Here are some personalized tips for your business:**\n"
         for suggestion in suggestions:
@@ -129,7 +131,7 @@ Compared to last week:
         return response
     
     # Top items queries
-    elif any(word in query for word in ["top", "best", "selling", "popular"]):
+    elif match.topic == "top_items":
         top_items = analytics.get_top_3_items()
         response = "**Top 3 Items by Revenue:**\n"
         for item in top_items:
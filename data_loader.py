@@ -1,15 +1,675 @@
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Mapping
+from functools import lru_cache
+from types import MappingProxyType
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 import pandas as pd
 
+from facts import build_fact_table
+from indexes import DateIndex, KeywordIndex
+from instrumentation import span, timed
+from parallel import AGGREGATE_WORKERS, sharded_aggregate
+from rollups import build_rollup
+from snapshot import (
+    PYARROW_AVAILABLE,
+    append_partitions,
+    concat_rows,
+    read_partition,
+    read_partition_aggregate,
+    read_partition_manifest,
+    read_table,
+    read_table_batches,
+    write_partitions
+)
+
+# Source files for every table in the dataset
+DATA_FILES = {
+    "transaction_data": "transaction_data.csv",
+    "transaction_items": "transaction_items.csv",
+    "merchant": "merchant.csv",
+    "items": "items.csv",
+    "keywords": "keywords.csv"
+}
+
+# Compact string storage for high-cardinality ids (falls back to object)
+STRING_DTYPE = "string[pyarrow]" if PYARROW_AVAILABLE else "object"
+
+# Declared column types, applied when a CSV is parsed and baked into its
+# snapshot. Ids are downcast to int32, low-cardinality labels become
+# categoricals and unit prices use float32 (menu prices are exact in
+# float32). order_value stays float64 because it is summed over the whole
+# table for revenue totals, where float32 accumulation loses cents.
+SCHEMA = {
+    "transaction_data": {
+        "order_id": STRING_DTYPE,
+        "order_time": "datetime",
+        "driver_arrival_time": "datetime",
+        "driver_pickup_time": "datetime",
+        "delivery_time": "datetime",
+        "order_value": "float64",
+        "eater_id": "int32",
+        "merchant_id": "category"
+    },
+    "transaction_items": {
+        "order_id": STRING_DTYPE,
+        "item_id": "int32",
+        "merchant_id": "category"
+    },
+    "merchant": {
+        "city_id": "int32"
+    },
+    "items": {
+        "item_id": "int32",
+        "item_price": "float32"
+    },
+    "keywords": {
+        "view": "int32",
+        "menu": "int32",
+        "checkout": "int32",
+        "order": "int32"
+    }
+}
+
+
+def get_read_options(name, path=None):
+    """Translate a table's schema into pd.read_csv keyword arguments"""
+    # Only declare columns the file actually has, extracts differ slightly
+    header = set(pd.read_csv(path or DATA_FILES[name], nrows=0).columns)
+    schema = {col: dtype for col, dtype in SCHEMA[name].items() if col in header}
+    return {
+        "parse_dates": [col for col, dtype in schema.items() if dtype == "datetime"],
+        "dtype": {col: dtype for col, dtype in schema.items() if dtype != "datetime"}
+    }
+
+# Storage backend for the large transaction tables: "feather" loads them into
+# each process's heap, "mmap" memory-maps NumPy column files so all workers
+# on a host share one copy through the page cache.
+DATA_BACKEND = os.environ.get("MEX_DATA_BACKEND", "feather")
+MMAP_TABLES = ("transaction_data", "transaction_items")
+
+# Tables stored per merchant so a session only reads its own rows;
+# merchant_hourly is the (merchant, date, hour) rollup of transaction_data
+PARTITIONED_TABLES = ("transaction_data", "transaction_items", "merchant_hourly")
+
+# New transactions arrive as delta batches: one directory per batch under
+# DELTA_DIR holding transaction_data.csv and/or transaction_items.csv with
+# the same columns as the base files. Batches are applied in name order and
+# each one should carry complete orders (items together with their order).
+DELTA_DIR = os.environ.get("MEX_DELTA_DIR", "deltas")
+DELTA_TABLES = ("transaction_data", "transaction_items")
+
+# How a full partition rebuild reads the transaction tables: "memory" loads
+# them whole, "chunked" streams the CSVs through ingest.py in bounded memory
+# for tables larger than RAM
+INGEST_MODE = os.environ.get("MEX_INGEST_MODE", "memory")
+
+# Process-wide dataset cache, keyed by dataset version.
+# Each entry holds the read-only table mapping and the number of holders
+# that acquired it through acquire_data().
+_cache_lock = threading.RLock()
+_cache = {}
+_current_version = None
+
+
+def list_deltas():
+    """Names of the delta batches present under DELTA_DIR, in apply order"""
+    if not os.path.isdir(DELTA_DIR):
+        return []
+    return sorted(
+        batch for batch in os.listdir(DELTA_DIR)
+        if any(os.path.exists(_delta_path(batch, name)) for name in DELTA_TABLES)
+    )
+
+
+def _delta_path(batch, name):
+    return os.path.join(DELTA_DIR, batch, DATA_FILES[name])
+
+
+def _read_delta(batch, name):
+    """One table of a delta batch, typed like the base table (None if absent)"""
+    path = _delta_path(batch, name)
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path, **get_read_options(name, path))
+
+
+def _fingerprint_files(fingerprint, files):
+    for name, path in files:
+        stat = os.stat(path)
+        fingerprint.update(f"{name}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+
+
+def get_base_version():
+    """Fingerprint of the base CSVs, derived from their mtime and size"""
+    fingerprint = hashlib.sha1()
+    _fingerprint_files(fingerprint, DATA_FILES.items())
+    return fingerprint.hexdigest()[:16]
+
+
+def get_dataset_version():
+    """Fingerprint of the base CSVs plus every delta batch"""
+    fingerprint = hashlib.sha1(get_base_version().encode())
+    for batch in list_deltas():
+        _fingerprint_files(fingerprint, [
+            (f"{batch}/{name}", _delta_path(batch, name))
+            for name in DELTA_TABLES if os.path.exists(_delta_path(batch, name))
+        ])
+    return fingerprint.hexdigest()[:16]
+
+
+def iter_table_batches(name, batch_rows=100000):
+    """
+    Rows of a table, base file first and then every delta batch, as typed
+    frames of bounded size for consumers that stream instead of loading
+    """
+    yield from read_table_batches(DATA_FILES[name], get_read_options(name), batch_rows)
+    if name in DELTA_TABLES:
+        for batch in list_deltas():
+            delta = _read_delta(batch, name)
+            if delta is not None:
+                yield delta
+
+
+def get_peak_rss_mb():
+    """Peak resident set size of this process in MB (None if unsupported)"""
+    if resource is None:
+        return None
+    # ru_maxrss is reported in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _table_format(name):
+    return "npy" if DATA_BACKEND == "mmap" and name in MMAP_TABLES else "feather"
+
+
+class _Dataset(Mapping):
+    """
+    Read-only table mapping that loads each table on first access.
+    Transaction tables include the rows of every delta batch.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _load(self, name):
+        with span(f"load_data.{name}") as load_span:
+            table = read_table(DATA_FILES[name], get_read_options(name), _table_format(name))
+            if name in DELTA_TABLES:
+                deltas = [_read_delta(batch, name) for batch in list_deltas()]
+                deltas = [delta for delta in deltas if delta is not None]
+                if deltas:
+                    table = concat_rows([table] + deltas)
+            load_span.rows = len(table)
+            load_span.set(backend=DATA_BACKEND, peak_rss_mb=get_peak_rss_mb())
+        return table
+
+    def __getitem__(self, name):
+        if name not in DATA_FILES:
+            raise KeyError(name)
+        if name not in self._tables:
+            with self._lock:
+                if name not in self._tables:
+                    self._tables[name] = self._load(name)
+        return self._tables[name]
+
+    def __iter__(self):
+        return iter(DATA_FILES)
+
+    def __len__(self):
+        return len(DATA_FILES)
+
+
+def _evict_stale():
+    """Drop superseded dataset versions nobody holds anymore"""
+    for version in list(_cache):
+        if version != _current_version and _cache[version]["refs"] <= 0:
+            del _cache[version]
+
+
+def _get_entry():
+    global _current_version
+    version = get_dataset_version()
+    with _cache_lock:
+        if version not in _cache:
+            _cache[version] = {"data": _Dataset(), "refs": 0}
+            _current_version = version
+            _evict_stale()
+        return version, _cache[version]
+
+
 def load_data():
-    transaction_data = pd.read_csv("transaction_data.csv")
-    transaction_items = pd.read_csv("transaction_items.csv")
-    merchant = pd.read_csv("merchant.csv")
-    items = pd.read_csv("items.csv")
-    keywords = pd.read_csv("keywords.csv")
-    return {
-        "transaction_data" : transaction_data, 
-        "transaction_items" : transaction_items, 
-        "merchant" : merchant, 
-        "items" : items, 
-        "keywords" : keywords
-    }
\ No newline at end of file
+    """
+    Return the shared, read-only dataset for this process.
+
+    Each table is parsed on first access, once per dataset version, and every
+    caller receives the same DataFrames, so callers must treat them as
+    immutable and work on copies when they need to modify anything.
+    """
+    _, entry = _get_entry()
+    return entry["data"]
+
+
+def acquire_data():
+    """Return (version, data) and keep that version cached until released"""
+    version, entry = _get_entry()
+    with _cache_lock:
+        entry["refs"] += 1
+    return version, entry["data"]
+
+
+def release_data(version):
+    """Release a version obtained from acquire_data()"""
+    with _cache_lock:
+        entry = _cache.get(version)
+        if entry is not None:
+            entry["refs"] -= 1
+            _evict_stale()
+
+
+def get_partition_version():
+    """
+    Base dataset version plus schema and partition layout. Delta batches
+    don't change it, they are appended to the partitions as segments.
+    """
+    fingerprint = hashlib.sha1(get_base_version().encode())
+    fingerprint.update(json.dumps(SCHEMA, sort_keys=True).encode())
+    fingerprint.update(json.dumps(PARTITIONED_TABLES).encode())
+    return fingerprint.hexdigest()[:16]
+
+
+def _build_global_items(transaction_data, transaction_items):
+    """Cross-merchant item rows and the order value they belong to, per item_id"""
+    item_orders = transaction_items[["order_id", "item_id"]].merge(
+        transaction_data[["order_id", "order_value"]],
+        on="order_id",
+        how="left"
+    )
+    # order_rows counts rows after the join, which repeats an item row once
+    # per transaction sharing its order_id
+    return pd.concat([
+        transaction_items.groupby("item_id").size().rename("rows"),
+        item_orders.groupby("item_id").agg(
+            order_rows=("order_value", "size"),
+            order_value=("order_value", "sum")
+        )
+    ], axis=1).rename_axis("item_id").reset_index()
+
+
+def _global_totals(transaction_data, transaction_items):
+    """Dataset-wide scalars that can't be re-derived from the bucketed aggregates"""
+    items_per_order = transaction_items.groupby("order_id")["item_id"].count()
+    return {
+        "first_order_time": transaction_data["order_time"].min().isoformat(),
+        "last_order_time": transaction_data["order_time"].max().isoformat(),
+        "unique_orders": int(transaction_data["order_id"].nunique()),
+        "item_count": int(items_per_order.sum()),
+        "item_orders": int(len(items_per_order))
+    }
+
+
+def _combine_totals(parts):
+    """Totals of disjoint sets of orders (delta batches, shards) added up"""
+    combined = {key: sum(part[key] for part in parts) for key in ("unique_orders", "item_count", "item_orders")}
+    for key, pick in (("first_order_time", min), ("last_order_time", max)):
+        # Parts without any transactions don't move the bounds
+        times = [pd.Timestamp(part[key]) for part in parts if not pd.isna(pd.Timestamp(part[key]))]
+        combined[key] = pick(times).isoformat() if times else pd.NaT.isoformat()
+    return combined
+
+
+def _order_aggregates(transaction_data, transaction_items):
+    """Rollups, item totals, dataset totals and item partition keys of a set of complete orders"""
+    # Items follow the merchant of their order
+    order_merchant = (
+        transaction_data[["order_id", "merchant_id"]]
+        .drop_duplicates("order_id")
+        .set_index("order_id")["merchant_id"]
+    )
+    return {
+        "merchant_hourly": build_rollup(transaction_data, by="merchant_id"),
+        "item_merchants": transaction_items["order_id"].map(order_merchant),
+        # Built from the rows, distinct orders don't add up across merchants
+        "global_hourly": build_rollup(transaction_data),
+        "global_items": _build_global_items(transaction_data, transaction_items),
+        "totals": _global_totals(transaction_data, transaction_items)
+    }
+
+
+def _merge_order_aggregates(parts):
+    """
+    Combine the _order_aggregates() of shards holding disjoint orders.
+    Every bucket measure is a sum or a count of rows or distinct orders,
+    so the shards' buckets are re-summed.
+    """
+    if len(parts) == 1:
+        return parts[0]
+    return {
+        "merchant_hourly": concat_rows([part["merchant_hourly"] for part in parts]).groupby(
+            ["merchant_id", "date", "hour"], observed=True, as_index=False
+        ).sum(),
+        "item_merchants": pd.concat([part["item_merchants"] for part in parts]),
+        "global_hourly": pd.concat([part["global_hourly"] for part in parts]).groupby(
+            ["date", "hour"], as_index=False
+        ).sum(),
+        "global_items": pd.concat([part["global_items"] for part in parts]).groupby(
+            "item_id", as_index=False
+        ).sum(),
+        "totals": _combine_totals([part["totals"] for part in parts])
+    }
+
+
+def aggregate_orders(transaction_data, transaction_items, workers=AGGREGATE_WORKERS):
+    """
+    Rollups, item totals and dataset totals of the transaction tables.
+    Large tables are sharded by order_id over a pool of workers processes
+    (see parallel.py); every order and its items stay in one shard.
+    """
+    return sharded_aggregate(
+        _order_aggregates,
+        _merge_order_aggregates,
+        [transaction_data, transaction_items],
+        ["order_id", "order_id"],
+        workers
+    )
+
+
+def _partition_tables(transaction_data, transaction_items):
+    """Split the transaction tables and their rollups into partition arguments, plus their totals"""
+    aggregates = aggregate_orders(transaction_data, transaction_items)
+    merchant_hourly = aggregates["merchant_hourly"]
+    return (
+        {
+            "transaction_data": (transaction_data, transaction_data["merchant_id"]),
+            "transaction_items": (transaction_items, aggregates["item_merchants"].reindex(transaction_items.index)),
+            "merchant_hourly": (merchant_hourly, merchant_hourly["merchant_id"])
+        },
+        {
+            "global_hourly": aggregates["global_hourly"],
+            "global_items": aggregates["global_items"]
+        },
+        aggregates["totals"]
+    )
+
+
+def _apply_delta(batch, manifest):
+    """Append one delta batch to the partitions as a new segment"""
+    frames = {}
+    for name in DELTA_TABLES:
+        frame = _read_delta(batch, name)
+        if frame is None:
+            # A batch may only carry one of the tables
+            frame = pd.read_csv(DATA_FILES[name], nrows=0, **get_read_options(name))
+        frames[name] = frame
+
+    transaction_data = frames["transaction_data"]
+    transaction_items = frames["transaction_items"]
+    tables, aggregates, totals = _partition_tables(transaction_data, transaction_items)
+    meta = _combine_totals([manifest, totals])
+    meta["deltas"] = manifest["deltas"] + [batch]
+    return append_partitions(batch, tables, aggregates, meta)
+
+
+_partition_lock = threading.Lock()
+
+
+def _is_current(manifest, version, deltas):
+    return (
+        manifest is not None and
+        manifest.get("version") == version and
+        manifest.get("deltas") == deltas
+    )
+
+
+def ensure_partitions():
+    """
+    Make sure per-merchant partitions exist for the current dataset version.
+
+    The first process to see a new base version reads the full transaction
+    tables once and writes them out by merchant_id together with the global
+    hourly aggregate; every later session only reads its own merchant's
+    files. Delta batches that arrive afterwards are appended as segments,
+    so the cost of an update follows the size of the batch and the stored
+    history is never rewritten.
+    """
+    version = get_partition_version()
+    deltas = list_deltas()
+    manifest = read_partition_manifest()
+    if _is_current(manifest, version, deltas):
+        return manifest
+
+    with _partition_lock:
+        manifest = read_partition_manifest()
+        if _is_current(manifest, version, deltas):
+            return manifest
+
+        applied = manifest.get("deltas") if manifest is not None else None
+        if applied is not None and manifest.get("version") == version and deltas[:len(applied)] == applied:
+            for batch in deltas[len(applied):]:
+                with span("ensure_partitions.delta", batch=batch):
+                    manifest = _apply_delta(batch, manifest)
+                print(f"Appended delta batch {batch} to the partitions")
+            return manifest
+
+        # New base data, changed schema or a removed batch: rebuild everything
+        with span("ensure_partitions.rebuild", mode=INGEST_MODE):
+            if INGEST_MODE == "chunked":
+                from ingest import ingest_partitions
+                return ingest_partitions(version, deltas)
+
+            data = load_data()
+            transaction_data = data["transaction_data"]
+            transaction_items = data["transaction_items"]
+            tables, aggregates, totals = _partition_tables(transaction_data, transaction_items)
+            return write_partitions(
+                version,
+                tables,
+                aggregates=aggregates,
+                # The full tables already include every delta batch
+                meta={**totals, "deltas": deltas}
+            )
+
+
+def _partition_state():
+    """
+    Hashable (version, applied deltas, stored segments) of the partition set
+    in use, or of the full dataset when partitions are unavailable
+    """
+    if PYARROW_AVAILABLE:
+        manifest = ensure_partitions()
+        return manifest["version"], tuple(manifest["deltas"]), tuple(manifest["segments"])
+    return get_dataset_version(), (), ()
+
+
+def _merge_buckets(frame, keys, segments):
+    """Re-sum additive aggregates whose buckets repeat across segments"""
+    if not segments:
+        return frame
+    return frame.groupby(keys, observed=True, as_index=False).sum()
+
+
+@lru_cache(maxsize=64)
+@timed("load_merchant_data", rows=lambda tables: len(tables["transaction_data"]))
+def _load_merchant_tables(state, merchant_id):
+    if PYARROW_AVAILABLE:
+        segments = state[2]
+        tables = {
+            name: read_partition(name, merchant_id, segments) for name in PARTITIONED_TABLES
+        }
+        tables["merchant_hourly"] = _merge_buckets(
+            tables["merchant_hourly"], ["merchant_id", "date", "hour"], segments
+        )
+        return MappingProxyType(tables)
+
+    # No partition storage without pyarrow, filter the shared tables instead
+    data = load_data()
+    transaction_data = data["transaction_data"]
+    transaction_data = transaction_data[transaction_data["merchant_id"] == merchant_id]
+    transaction_items = data["transaction_items"]
+    return MappingProxyType({
+        "transaction_data": transaction_data,
+        "transaction_items": transaction_items[transaction_items["order_id"].isin(transaction_data["order_id"])],
+        "merchant_hourly": build_rollup(transaction_data, by="merchant_id")
+    })
+
+
+def load_merchant_data(merchant_id):
+    """
+    Return the read-only transaction_data / transaction_items rows of one
+    merchant and its merchant_hourly rollup (sales, orders and unique_orders
+    per date and hour), reading only that merchant's partitions.
+    """
+    return _load_merchant_tables(_partition_state(), merchant_id)
+
+
+@lru_cache(maxsize=64)
+@timed("load_date_index", rows=lambda index: len(index.frame))
+def _load_merchant_index(state, merchant_id):
+    return DateIndex(_load_merchant_tables(state, merchant_id)["transaction_data"])
+
+
+@lru_cache(maxsize=2)
+@timed("load_date_index", rows=lambda index: len(index.frame))
+def _load_global_index(version):
+    return DateIndex(load_data()["transaction_data"])
+
+
+def load_date_index(merchant_id=None):
+    """
+    DateIndex over order_time of one merchant's transaction_data, or of the
+    whole table when merchant_id is None. Built once per dataset version.
+    """
+    if merchant_id is None:
+        return _load_global_index(get_dataset_version())
+    return _load_merchant_index(_partition_state(), merchant_id)
+
+
+@lru_cache(maxsize=64)
+@timed("load_fact_table", rows=lambda index: len(index.frame))
+def _load_merchant_facts(state, merchant_id):
+    tables = _load_merchant_tables(state, merchant_id)
+    return DateIndex(build_fact_table(
+        tables["transaction_data"], tables["transaction_items"], load_data()["items"]
+    ))
+
+
+@lru_cache(maxsize=2)
+@timed("load_fact_table", rows=lambda index: len(index.frame))
+def _load_global_facts(version):
+    data = load_data()
+    return DateIndex(build_fact_table(
+        data["transaction_data"], data["transaction_items"], data["items"]
+    ))
+
+
+def load_fact_index(merchant_id=None):
+    """
+    DateIndex over the order-item fact table (see facts.FACT_COLUMNS) of one
+    merchant, or of all merchants when merchant_id is None. The joins run
+    once per dataset version; the table itself is index.frame.
+    """
+    if merchant_id is None:
+        return _load_global_facts(get_dataset_version())
+    return _load_merchant_facts(_partition_state(), merchant_id)
+
+
+def load_fact_table(merchant_id=None):
+    """Read-only order-item fact table, see load_fact_index()"""
+    return load_fact_index(merchant_id).frame
+
+
+@lru_cache(maxsize=2)
+@timed("load_global_aggregate", rows=lambda aggregate: len(aggregate["hourly"]))
+def _load_global_aggregate(state):
+    if PYARROW_AVAILABLE:
+        segments = state[2]
+        totals = dict(read_partition_manifest())
+        hourly = _merge_buckets(read_partition_aggregate("global_hourly", segments), ["date", "hour"], segments)
+        items = _merge_buckets(read_partition_aggregate("global_items", segments), ["item_id"], segments)
+    else:
+        data = load_data()
+        aggregates = aggregate_orders(data["transaction_data"], data["transaction_items"])
+        totals = aggregates["totals"]
+        hourly = aggregates["global_hourly"]
+        items = aggregates["global_items"]
+
+    return MappingProxyType({
+        "hourly": hourly,
+        "items": items,
+        "first_order_time": pd.Timestamp(totals["first_order_time"]),
+        "last_order_time": pd.Timestamp(totals["last_order_time"]),
+        "unique_orders": totals["unique_orders"],
+        "item_count": totals["item_count"],
+        "item_orders": totals["item_orders"]
+    })
+
+
+def load_global_aggregate():
+    """
+    Shared cross-merchant aggregate used by the all-merchant views:
+    - "hourly": sales, orders and unique_orders per (date, hour)
+    - "items": item rows and the summed value of their orders per item_id
+    - dataset-wide first/last order_time, unique order count and
+      item_count/item_orders (items per order)
+    """
+    return _load_global_aggregate(_partition_state())
+
+
+@lru_cache(maxsize=2)
+@timed("load_keyword_index", rows=len)
+def _load_keyword_index(version):
+    data = load_data()
+    return KeywordIndex(data["keywords"], data["items"])
+
+
+def load_keyword_index():
+    """KeywordIndex over keywords.csv linked to the items.csv names, built once per dataset version"""
+    return _load_keyword_index(get_dataset_version())
+
+
+def memory_report(data=None):
+    """
+    Bytes held by each table with pandas' default dtypes versus the declared
+    schema. The default-dtype size is measured by reparsing the CSVs, so this
+    is a diagnostic, not something to call on a hot path.
+    """
+    data = data if data is not None else load_data()
+    rows = []
+    for name, path in DATA_FILES.items():
+        before = pd.read_csv(path).memory_usage(deep=True).sum()
+        after = data[name].memory_usage(deep=True).sum()
+        rows.append({
+            "table": name,
+            "rows": len(data[name]),
+            "default_bytes": int(before),
+            "schema_bytes": int(after),
+            "saved_pct": round((1 - after / before) * 100, 1) if before else 0.0
+        })
+    return pd.DataFrame(rows).set_index("table")
+
+
+def clear_data_cache():
+    """Drop every cached dataset version, forcing the next load to reparse"""
+    global _current_version
+    with _cache_lock:
+        _cache.clear()
+        _current_version = None
+    _load_merchant_tables.cache_clear()
+    _load_merchant_index.cache_clear()
+    _load_global_index.cache_clear()
+    _load_merchant_facts.cache_clear()
+    _load_global_facts.cache_clear()
+    _load_global_aggregate.cache_clear()
+    _load_keyword_index.cache_clear()
+
+
+if __name__ == "__main__":
+    print(memory_report())
@@ -0,0 +1,414 @@
+import os
+import sqlite3
+import threading
+from functools import lru_cache
+from types import MappingProxyType
+
+import pandas as pd
+
+try:
+    import duckdb  # optional multi-threaded engine
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    duckdb = None
+    DUCKDB_AVAILABLE = False
+
+from data_loader import (
+    get_dataset_version,
+    iter_table_batches,
+    load_date_index,
+    load_global_aggregate,
+    load_merchant_data
+)
+from rollups import build_rollup
+from snapshot import SNAPSHOT_DIR
+
+# Where BusinessAnalytics' aggregations run. "pandas": over the in-memory
+# tables, partitions and rollups. "sqlite" / "duckdb": pushed down to an
+# embedded database loaded from the snapshots (and delta batches) once per
+# dataset version, so they are bounded by disk instead of RAM. DuckDB is an
+# optional dependency and runs each query on all cores.
+ANALYTICS_ENGINE = os.environ.get("MEX_ANALYTICS_ENGINE", "pandas")
+ENGINE_DIR = os.environ.get("MEX_ENGINE_DIR", SNAPSHOT_DIR)
+
+# Rows per insert while the database is loaded
+LOAD_BATCH_ROWS = 100000
+
+NS_PER_HOUR = 3600 * 10**9
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+# Only the columns the queries read are loaded; times are stored as int64
+# nanoseconds so both engines bucket them with the same integer arithmetic
+ENGINE_TABLES = {
+    "transaction_data": (
+        ("order_id", "TEXT"),
+        ("merchant_id", "TEXT"),
+        ("order_time", "BIGINT"),
+        ("order_value", "DOUBLE")
+    ),
+    "transaction_items": (
+        ("order_id", "TEXT"),
+        ("item_id", "BIGINT")
+    )
+}
+
+
+def _empty_rollup(by=None):
+    columns = {
+        "date": pd.Series(dtype="datetime64[ns]"),
+        "hour": pd.Series(dtype="int32"),
+        "sales": pd.Series(dtype="float64"),
+        "orders": pd.Series(dtype="int64"),
+        "unique_orders": pd.Series(dtype="int64")
+    }
+    if by is not None:
+        columns = {by: pd.Series(dtype="category"), **columns}
+    return pd.DataFrame(columns)
+
+
+class PandasEngine:
+    """The default engine: pandas over the loaded tables and partitions"""
+
+    name = "pandas"
+
+    def global_aggregate(self):
+        return load_global_aggregate()
+
+    def merchant_hourly(self, merchant_id):
+        return load_merchant_data(merchant_id)["merchant_hourly"]
+
+    def rollup_range(self, start, end):
+        return build_rollup(load_date_index().range(start, end))
+
+
+class SQLEngine:
+    """
+    Aggregations run as SQL over a database file holding the transaction
+    tables, rebuilt when the dataset version changes.
+
+    Returns the same frames as PandasEngine, column for column: the global
+    aggregate mapping, per-merchant and time-range (date, hour) rollups.
+    Subclasses provide the connection, bulk load and integer division.
+    """
+
+    name = None
+    suffix = None
+    int_div = "/"
+
+    def __init__(self, directory=ENGINE_DIR):
+        self.path = os.path.join(directory, f"analytics.{self.suffix}")
+        self._lock = threading.Lock()
+        self._version = None
+        self._generation = 0
+
+    # Engine specific
+
+    def _connect(self, path, read_only):
+        raise NotImplementedError
+
+    def _insert(self, connection, table, frame):
+        raise NotImplementedError
+
+    def _finish_load(self, connection):
+        pass
+
+    def _cursor(self):
+        raise NotImplementedError
+
+    def _reset(self):
+        pass
+
+    def _query(self, sql, params=()):
+        raise NotImplementedError
+
+    # Loading
+
+    def _stored_version(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            connection = self._connect(self.path, read_only=True)
+            try:
+                return connection.execute("SELECT version FROM engine_meta").fetchone()[0]
+            finally:
+                connection.close()
+        except Exception:
+            return None
+
+    def _load(self, version):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = self._connect(tmp_path, read_only=False)
+        try:
+            for table, columns in ENGINE_TABLES.items():
+                connection.execute(
+                    f"CREATE TABLE {table} ({', '.join(f'{col} {kind}' for col, kind in columns)})"
+                )
+                for batch in iter_table_batches(table, LOAD_BATCH_ROWS):
+                    self._insert(connection, table, _engine_rows(batch, columns))
+            self._finish_load(connection)
+            self._materialize(connection)
+            connection.execute("CREATE TABLE engine_meta (version TEXT)")
+            connection.execute("INSERT INTO engine_meta VALUES (?)", (version,))
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(tmp_path, self.path)
+
+    def ensure_database(self):
+        """Load the database for the current dataset version if needed; returns the version"""
+        version = get_dataset_version()
+        if self._version == version:
+            return version
+        with self._lock:
+            if self._version != version:
+                if self._stored_version() != version:
+                    self._load(version)
+                    print(f"Loaded {self.name} analytics database {self.path}")
+                self._reset()
+                self._generation += 1
+                self._version = version
+        return version
+
+    # Queries
+
+    def _rollup_sql(self, by=None, where=""):
+        day = f"order_time - order_time % {NS_PER_DAY}"
+        hour = f"(order_time {self.int_div} {NS_PER_HOUR}) % 24"
+        keys = ", ".join(([by] if by else []) + ["day", "hour"])
+        return (
+            f"SELECT {(by + ', ') if by else ''}{day} AS day, {hour} AS hour, "
+            "COALESCE(SUM(order_value), 0.0) AS sales, COUNT(*) AS orders, "
+            "COUNT(DISTINCT order_id) AS unique_orders "
+            f"FROM transaction_data WHERE order_time IS NOT NULL {where} "
+            f"GROUP BY {keys} ORDER BY {keys}"
+        )
+
+    def _materialize(self, connection):
+        """
+        Store the global and per-merchant rollups, item totals and dataset
+        totals while loading, as the partition build does for pandas, so a
+        session reads small tables instead of aggregating every row
+        """
+        connection.execute(f"CREATE TABLE global_hourly AS {self._rollup_sql()}")
+        connection.execute(f"CREATE TABLE merchant_hourly AS {self._rollup_sql('merchant_id')}")
+        # Pre-aggregating orders keeps the join one row per item row; an
+        # item whose order is missing counts as one row without a value
+        connection.execute(
+            "CREATE TABLE global_items AS "
+            "WITH orders AS ("
+            "SELECT order_id, COUNT(*) AS order_rows, SUM(order_value) AS order_value "
+            "FROM transaction_data WHERE order_id IS NOT NULL GROUP BY order_id) "
+            "SELECT i.item_id AS item_id, COUNT(*) AS item_rows, "
+            "SUM(COALESCE(o.order_rows, 1)) AS order_rows, "
+            "COALESCE(SUM(o.order_value), 0.0) AS order_value "
+            "FROM transaction_items i LEFT JOIN orders o ON o.order_id = i.order_id "
+            "WHERE i.item_id IS NOT NULL GROUP BY i.item_id ORDER BY i.item_id"
+        )
+        connection.execute(
+            "CREATE TABLE totals AS SELECT "
+            "(SELECT MIN(order_time) FROM transaction_data) AS first_order_time, "
+            "(SELECT MAX(order_time) FROM transaction_data) AS last_order_time, "
+            "(SELECT COUNT(DISTINCT order_id) FROM transaction_data) AS unique_orders, "
+            "(SELECT COUNT(item_id) FROM transaction_items WHERE order_id IS NOT NULL) AS item_count, "
+            "(SELECT COUNT(DISTINCT order_id) FROM transaction_items WHERE order_id IS NOT NULL) AS item_orders"
+        )
+
+    def _rollup_frame(self, sql, by=None, params=()):
+        frame = self._query(sql, params)
+        if frame.empty:
+            return _empty_rollup(by)
+        rollup = pd.DataFrame({
+            "date": pd.to_datetime(frame["day"].astype("int64")),
+            "hour": frame["hour"].astype("int32"),
+            "sales": frame["sales"].astype("float64"),
+            "orders": frame["orders"].astype("int64"),
+            "unique_orders": frame["unique_orders"].astype("int64")
+        })
+        if by is not None:
+            rollup.insert(0, by, frame[by].astype("category"))
+        return rollup
+
+    def _items(self):
+        frame = self._query("SELECT * FROM global_items ORDER BY item_id")
+        return pd.DataFrame({
+            "item_id": frame["item_id"].astype("int32"),
+            "rows": frame["item_rows"].astype("int64"),
+            "order_rows": frame["order_rows"].astype("int64"),
+            "order_value": frame["order_value"].astype("float64")
+        })
+
+    def _totals(self):
+        first, last, unique_orders, item_count, item_orders = self._cursor().execute(
+            "SELECT first_order_time, last_order_time, unique_orders, item_count, item_orders FROM totals"
+        ).fetchone()
+        return {
+            # None (no rows) becomes NaT
+            "first_order_time": pd.Timestamp(first),
+            "last_order_time": pd.Timestamp(last),
+            "unique_orders": int(unique_orders),
+            "item_count": int(item_count),
+            "item_orders": int(item_orders)
+        }
+
+    @lru_cache(maxsize=2)
+    def _global_aggregate(self, version):
+        return MappingProxyType({
+            "hourly": self._rollup_frame("SELECT * FROM global_hourly ORDER BY day, hour"),
+            "items": self._items(),
+            **self._totals()
+        })
+
+    @lru_cache(maxsize=64)
+    def _merchant_hourly(self, version, merchant_id):
+        return self._rollup_frame(
+            "SELECT * FROM merchant_hourly WHERE merchant_id = ? ORDER BY day, hour",
+            "merchant_id",
+            (merchant_id,)
+        )
+
+    def global_aggregate(self):
+        return self._global_aggregate(self.ensure_database())
+
+    def merchant_hourly(self, merchant_id):
+        version = self.ensure_database()
+        if merchant_id is None:
+            return _empty_rollup("merchant_id")
+        return self._merchant_hourly(version, str(merchant_id))
+
+    def rollup_range(self, start, end):
+        """Rollup of the rows with start <= order_time < end, filtered by the engine"""
+        self.ensure_database()
+        return self._rollup_frame(
+            self._rollup_sql(where="AND order_time >= ? AND order_time < ?"),
+            params=(pd.Timestamp(start).value, pd.Timestamp(end).value)
+        )
+
+
+def _engine_rows(batch, columns):
+    """A batch's engine columns, times as int64 nanoseconds and missing values as None"""
+    frame = {}
+    for col, kind in columns:
+        values = batch[col]
+        if col == "order_time":
+            values = pd.Series(values.to_numpy().view("int64"), dtype="Int64").mask(values.isna().to_numpy())
+        elif kind == "TEXT":
+            values = values.astype(object).where(values.notna().to_numpy(), None)
+        frame[col] = values.reset_index(drop=True)
+    return pd.DataFrame(frame)
+
+
+class SQLiteEngine(SQLEngine):
+    """SQLite (standard library) engine; one connection per thread"""
+
+    name = "sqlite"
+    suffix = "sqlite"
+    int_div = "/"
+
+    def __init__(self, directory=ENGINE_DIR):
+        super().__init__(directory)
+        self._local = threading.local()
+
+    def _connect(self, path, read_only):
+        if read_only:
+            return sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        connection = sqlite3.connect(path)
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        return connection
+
+    def _insert(self, connection, table, frame):
+        placeholders = ", ".join("?" for _ in frame.columns)
+        rows = frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+        connection.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+
+    def _finish_load(self, connection):
+        # Merchant and time range filters become index range scans
+        connection.execute("CREATE INDEX td_merchant_time ON transaction_data (merchant_id, order_time)")
+        connection.execute("CREATE INDEX td_time ON transaction_data (order_time)")
+        connection.execute("CREATE INDEX td_order ON transaction_data (order_id)")
+        connection.execute("ANALYZE")
+
+    def _materialize(self, connection):
+        super()._materialize(connection)
+        connection.execute("CREATE INDEX merchant_hourly_merchant ON merchant_hourly (merchant_id)")
+
+    def _cursor(self):
+        # sqlite3 connections can't be shared between threads
+        generation, connection = getattr(self._local, "connection", (None, None))
+        if connection is None or generation != self._generation:
+            connection = self._connect(self.path, read_only=True)
+            self._local.connection = (self._generation, connection)
+        return connection
+
+    def _query(self, sql, params=()):
+        return pd.read_sql_query(sql, self._cursor(), params=params)
+
+
+class DuckDBEngine(SQLEngine):
+    """DuckDB engine; queries are vectorized and spread over every core"""
+
+    name = "duckdb"
+    suffix = "duckdb"
+    int_div = "//"
+
+    def __init__(self, directory=ENGINE_DIR):
+        if not DUCKDB_AVAILABLE:
+            raise RuntimeError("The duckdb analytics engine needs the duckdb package (pip install duckdb)")
+        super().__init__(directory)
+        self._connection = None
+        self._local = threading.local()
+
+    def _connect(self, path, read_only):
+        return duckdb.connect(path, read_only=read_only)
+
+    def _insert(self, connection, table, frame):
+        connection.register("engine_batch", frame)
+        connection.execute(f"INSERT INTO {table} SELECT * FROM engine_batch")
+        connection.unregister("engine_batch")
+
+    def _reset(self):
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = self._connect(self.path, read_only=True)
+
+    def _cursor(self):
+        # Each thread gets its own cursor on the shared read-only database
+        generation, cursor = getattr(self._local, "cursor", (None, None))
+        if cursor is None or generation != self._generation:
+            cursor = self._connection.cursor()
+            self._local.cursor = (self._generation, cursor)
+        return cursor
+
+    def _query(self, sql, params=()):
+        return self._cursor().execute(sql, list(params)).df()
+
+
+def create_engine(name=ANALYTICS_ENGINE):
+    """Build the analytics engine for a name ("pandas", "sqlite" or "duckdb")"""
+    if name == "pandas":
+        return PandasEngine()
+    if name == "sqlite":
+        return SQLiteEngine()
+    if name == "duckdb":
+        return DuckDBEngine()
+    raise ValueError(f"Unknown analytics engine: {name}")
+
+
+# Shared by every BusinessAnalytics instance in the process
+analytics_engine = create_engine()
+
+
+def get_engine():
+    return analytics_engine
+
+
+def set_engine(engine):
+    """
+    Swap in another engine, any object with global_aggregate(),
+    merchant_hourly(merchant_id) and rollup_range(start, end) methods
+    """
+    global analytics_engine
+    analytics_engine = engine
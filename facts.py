@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed
+
+# Columns of the order-item fact table, one row per ordered item
+FACT_COLUMNS = [
+    "order_id", "order_time", "merchant_id", "item_id",
+    "item_name", "cuisine_tag", "item_price", "order_value"
+]
+
+
+@timed("build_fact_table")
+def build_fact_table(transaction_data, transaction_items, items):
+    """
+    Join transaction items with their order and the item catalog once.
+
+    order_id strings are replaced by integer codes before joining, and come
+    back as a categorical over those codes. Items without a matching order
+    are dropped; an item row repeats once per transaction row sharing its
+    order_id, as with a plain merge. Rows are sorted by order_time so the
+    table can be sliced by date with indexes.DateIndex.
+    """
+    order_ids = pd.Index(transaction_data["order_id"].dropna().unique())
+    orders = pd.DataFrame({
+        "order_key": order_ids.get_indexer(transaction_data["order_id"]).astype(np.int32),
+        "order_time": transaction_data["order_time"].to_numpy(),
+        "merchant_id": transaction_data["merchant_id"].to_numpy(),
+        "order_value": transaction_data["order_value"].to_numpy()
+    })
+    lines = pd.DataFrame({
+        "order_key": order_ids.get_indexer(transaction_items["order_id"]).astype(np.int32),
+        "item_id": transaction_items["item_id"].to_numpy()
+    })
+
+    fact = lines[lines["order_key"] >= 0].merge(orders[orders["order_key"] >= 0], on="order_key")
+    fact = fact.merge(
+        items[["item_id", "item_name", "cuisine_tag", "item_price"]],
+        on="item_id",
+        how="left"
+    )
+    fact["order_id"] = pd.Categorical.from_codes(fact["order_key"], categories=order_ids)
+    fact["merchant_id"] = fact["merchant_id"].astype(transaction_data["merchant_id"].dtype)
+    return fact.sort_values("order_time", kind="stable")[FACT_COLUMNS].reset_index(drop=True)
+
+
+def item_velocity(order_items):
+    """
+    Daily sales velocity of every item in a fact table, in one grouped pass.
+
+    Returns one row per item_name (sorted) with:
+    - total_orders: order-item rows of the item
+    - avg_daily_orders / std_daily_orders: mean and sample std of its
+      orders per day, over the days it sold
+    - active_days: number of days it sold
+    - trend: least-squares slope of orders per day against the date, in
+      orders/day per day (NaN with a single active day)
+    """
+    codes, names = pd.factorize(order_items["item_name"], sort=True)
+    days = order_items["order_time"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    valid = (codes >= 0) & ~np.isnat(order_items["order_time"].to_numpy())
+    codes, days = codes[valid], days[valid]
+    n_items = len(names)
+    if not len(codes):
+        days = np.zeros(0, dtype=np.int64)
+
+    # Orders per (item, day): one integer key per pair, counted in one pass
+    first = days.min() if len(days) else 0
+    span = (days.max() - first + 1) if len(days) else 1
+    pairs, orders = np.unique(codes * span + (days - first), return_counts=True)
+    item, day = pairs // span, pairs % span
+
+    # Day number since the item's first sale, for the regression sums
+    item_first = np.full(n_items, np.iinfo(np.int64).max)
+    np.minimum.at(item_first, item, day)
+    x = (day - item_first[item]).astype(np.float64)
+    y = orders.astype(np.float64)
+
+    def per_item(values=None):
+        return np.bincount(item, weights=values, minlength=n_items)
+
+    n, sum_y, sum_yy = per_item(), per_item(y), per_item(y * y)
+    sum_x, sum_xx, sum_xy = per_item(x), per_item(x * x), per_item(x * y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = sum_y / n
+        std = np.sqrt(np.maximum(sum_yy - sum_y * mean, 0) / (n - 1))
+        x_var = sum_xx - sum_x * sum_x / n
+        trend = np.where(x_var > 0, (sum_xy - sum_x * sum_y / n) / x_var, np.nan)
+    std[n < 2] = np.nan
+
+    return pd.DataFrame({
+        "total_orders": np.bincount(codes, minlength=n_items),
+        "avg_daily_orders": mean,
+        "std_daily_orders": std,
+        "active_days": n.astype(np.int64),
+        "trend": trend
+    }, index=pd.Index(names, name="item_name"))
@@ -1,39 +1,82 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from data_loader import load_data
-from smart_nudges import SmartNudges
+from facts import item_velocity
+from data_loader import (
+    acquire_data,
+    load_fact_index,
+    load_fact_table,
+    load_merchant_data,
+    release_data
+)
+from engines import get_engine
+from instrumentation import timed
+from nudge_table import load_merchant_nudges
+from results_cache import memoized
+from rollups import as_order_value_agg, rollup_by
+from smart_nudges import SmartNudges, format_nudge
 from typing import List
 
 class BusinessAnalytics:
+    @timed("BusinessAnalytics.__init__")
     def __init__(self, merchant_id=None):
-        data = load_data()
-        self.transaction_data = data["transaction_data"]
-        self.transaction_items = data["transaction_items"]
-        self.merchant = data["merchant"]
-        self.items = data["items"]
-        self.keywords = data["keywords"]
+        # Shared, read-only dataset; tables are loaded on first access
+        self.data_version, self.data = acquire_data()
+        self.merchant = self.data["merchant"]
+        self.items = self.data["items"]
+        self.keywords = self.data["keywords"]
         self.merchant_id = merchant_id
         
-        # Convert date columns to datetime
-        self.transaction_data['order_time'] = pd.to_datetime(self.transaction_data['order_time'])
+        # Aggregations run on the configured engine (engines.py)
+        self.engine = get_engine()
         
-        # Merge transaction items with items data
-        self.merged_data = self.transaction_items.merge(
-            self.items, 
-            on='item_id', 
-            how='left'
-        )
+        # Cross-merchant aggregates shared by every session
+        self.global_aggregate = self.engine.global_aggregate()
+        self.global_hourly = self.global_aggregate["hourly"]
+        
+        # Only this merchant's partitions are read for merchant-scoped views
+        merchant_data = load_merchant_data(merchant_id)
+        self.merchant_transactions = merchant_data["transaction_data"]
+        self.merchant_transaction_items = merchant_data["transaction_items"]
+        self.merchant_hourly = self.engine.merchant_hourly(merchant_id)
         
         # Initialize SmartNudges if merchant_id is provided
         if merchant_id:
             self.smart_nudges = SmartNudges(
-                self.transaction_data, 
+                self.merchant_transactions, 
                 merchant_id,
                 self.items,
-                self.transaction_items
+                self.merchant_transaction_items,
+                hourly_rollup=self.merchant_hourly,
+                order_items=load_fact_table(merchant_id)
             )
     
+    @property
+    def transaction_data(self):
+        """All merchants' transactions, loaded on first use"""
+        return self.data["transaction_data"]
+    
+    @property
+    def transaction_items(self):
+        """All merchants' transaction items, loaded on first use"""
+        return self.data["transaction_items"]
+    
+    @property
+    def merged_data(self):
+        """All merchants' order items joined with their order and the item catalog"""
+        return load_fact_table()
+    
+    def close(self):
+        """Release the shared dataset held by this instance"""
+        if getattr(self, 'data_version', None) is not None:
+            release_data(self.data_version)
+            self.data_version = None
+    
+    def __del__(self):
+        self.close()
+    
+    @timed()
+    @memoized()
     def get_smart_nudges(self) -> List[str]:
         """Get personalized smart nudges for the merchant"""
         if not hasattr(self, 'smart_nudges'):
@@ -43,19 +86,24 @@ class BusinessAnalytics:
             self.merchant['merchant_id'] == self.merchant_id
         ]['merchant_name'].iloc[0]
         
+        # Served from the batch nudge table when it is current for this merchant
+        stored = load_merchant_nudges(self.merchant_id)
+        if stored is not None:
+            return [
+                format_nudge(merchant_name, nudge_type, message)
+                for nudge_type, message in zip(stored['type'], stored['message'])
+            ]
+        
         return self.smart_nudges.get_personalized_nudges(merchant_name)
     
+    @timed()
+    @memoized(per_merchant=False)
     def get_weekly_growth_trends(self):
         """Calculate weekly growth trends from real transaction data with more detailed insights"""
-        # Calculate daily sales
-        daily_sales = self.transaction_data.groupby(
-            self.transaction_data['order_time'].dt.date
-        ).agg({
-            'order_value': 'sum',
-            'order_id': 'count'
-        }).rename(columns={
-            'order_value': 'total_sales',
-            'order_id': 'order_count'
+        # Calculate daily sales from the global hourly rollup
+        daily_sales = rollup_by(self.global_hourly, 'date')[['sales', 'orders']].rename(columns={
+            'sales': 'total_sales',
+            'orders': 'order_count'
         })
         
         # Calculate daily growth rates
@@ -95,23 +143,17 @@ class BusinessAnalytics:
             'trend': 'increasing' if current_week[('sales_growth', 'mean')] > previous_week[('sales_growth', 'mean')] else 'decreasing'
         }
     
+    @timed()
+    @memoized()
     def get_top_3_items(self, days=7, metric='revenue'):
         """Get top 3 items with detailed metrics"""
         try:
-            # Get recent transactions
-            recent_date = self.transaction_data['order_time'].max()
+            # Get recent transactions (relative to the latest order of any merchant)
+            recent_date = self.global_aggregate['last_order_time']
             start_date = recent_date - timedelta(days=days)
             
-            # Filter by merchant and date
-            recent_transactions = self.transaction_data[
-                (self.transaction_data['order_time'] >= start_date) &
-                (self.transaction_data['merchant_id'] == self.merchant_id)
-            ]
-            
-            # Merge with items and calculate metrics
-            recent_items = self.merged_data[
-                self.merged_data['order_id'].isin(recent_transactions['order_id'])
-            ]
+            # Merchant's order items since that date
+            recent_items = load_fact_index(self.merchant_id).range(start_date)
             
             # Calculate various metrics
             item_metrics = (
@@ -147,69 +189,50 @@ class BusinessAnalytics:
             print(f"Error in get_top_3_items: {str(e)}")
             return []
     
-    def get_low_stock_alerts(self, threshold_days=3):
-        """Get low stock alerts with advanced predictive analysis"""
-        # Calculate sales frequency (number of times each item is ordered per day)
-        daily_sales = (
-            self.merged_data.groupby([
-                'item_name', 
-                self.transaction_data['order_time'].dt.date
-            ])
-            .agg({
-                'order_id': 'count',  # Count number of orders per item per day
-                'item_price': 'mean'  # Average price of the item
-            })
-            .reset_index()
-        )
-        
-        # Calculate average daily sales and price trends
-        item_metrics = (
-            daily_sales.groupby('item_name')
-            .agg({
-                'order_id': ['mean', 'std', 'count'],  # Daily order frequency metrics
-                'item_price': 'mean'  # Average price
-            })
-        )
-        
-        # Calculate total sales for each item
-        total_sales = (
-            self.merged_data.groupby('item_name')
-            .agg({
-                'order_id': 'count',  # Total number of orders
-                'item_price': 'mean'  # Average price
-            })
+    @timed()
+    @memoized(per_merchant=False)
+    def get_low_stock_alerts(self, threshold_days=3, merchant_id=None):
+        """Get low stock alerts with advanced predictive analysis, optionally for one merchant"""
+        # Daily order frequency of every item, computed in one grouped pass
+        velocity = item_velocity(load_fact_table(merchant_id))
+        avg_daily_orders = velocity['avg_daily_orders']
+        std_daily_orders = velocity['std_daily_orders']
+        
+        # Sales velocity (orders per day) and risk based on its variability
+        sales_velocity = avg_daily_orders
+        risk_score = std_daily_orders / avg_daily_orders
+        
+        # Increasing sales: the fitted daily trend adds over half the average
+        # velocity across the days the item sold (NaN trends never count)
+        increasing = (velocity['trend'] > 0) & (
+            velocity['trend'] * velocity['active_days'] > avg_daily_orders * 0.5
         )
         
-        # Calculate alerts based on sales frequency
-        alerts = []
-        for item in item_metrics.index:
-            avg_daily_orders = item_metrics.loc[item, ('order_id', 'mean')]
-            std_daily_orders = item_metrics.loc[item, ('order_id', 'std')]
-            total_orders = total_sales.loc[item, 'order_id']
-            
-            if avg_daily_orders > 0:  # Only process items with sales history
-                # Calculate sales velocity (orders per day)
-                sales_velocity = avg_daily_orders
-                
-                # Calculate risk based on sales frequency and standard deviation
-                risk_score = (std_daily_orders / avg_daily_orders) if avg_daily_orders > 0 else 0
-                
-                # Generate alert based on risk level
-                if risk_score > 0.5 or sales_velocity > avg_daily_orders * 1.5:  # High risk if high variability or increasing sales
-                    risk_level = "URGENT" if risk_score > 1.0 else "HIGH"
-                    alerts.append({
-                        'item': item,
-                        'current_sales': int(total_orders),
-                        'avg_daily_sales': round(avg_daily_orders, 1),
-                        'days_until_stockout': {
-                            'optimistic': round(30 / (sales_velocity + std_daily_orders), 1),  # Assuming 30 days of stock
-                            'pessimistic': round(30 / max(1, sales_velocity - std_daily_orders), 1)
-                        },
-                        'risk_level': risk_level,
-                        'suggestion': self._generate_stock_suggestion(
-                            item, total_orders, avg_daily_orders
-                        )
-                    })
+        # High risk if high variability or increasing sales
+        at_risk = (avg_daily_orders > 0) & ((risk_score > 0.5) | increasing)
+        velocity = velocity.assign(
+            risk_level=np.where(risk_score > 1.0, "URGENT", "HIGH"),
+            optimistic=30 / (sales_velocity + std_daily_orders),  # Assuming 30 days of stock
+            pessimistic=30 / np.maximum(1, sales_velocity - std_daily_orders)
+        )[at_risk]
+        
+        alerts = [
+            {
+                'item': item,
+                'current_sales': int(row.total_orders),
+                'avg_daily_sales': round(row.avg_daily_orders, 1),
+                'trend': round(row.trend, 2),
+                'days_until_stockout': {
+                    'optimistic': round(row.optimistic, 1),
+                    'pessimistic': round(row.pessimistic, 1)
+                },
+                'risk_level': row.risk_level,
+                'suggestion': self._generate_stock_suggestion(
+                    item, row.total_orders, row.avg_daily_orders
+                )
+            }
+            for item, row in zip(velocity.index, velocity.itertuples(index=False))
+        ]
         
         return alerts if alerts else [{'status': 'healthy', 'message': 'All stock levels are healthy'}]
     
@@ -229,12 +252,14 @@ class BusinessAnalytics:
         else:
             return f"Review {item} performance. No recent sales activity detected."
     
+    @timed()
+    @memoized()
     def get_personalized_suggestions(self, merchant_type, business_size):
         """Generate personalized business suggestions with data-driven insights"""
         suggestions = []
         
         # Get merchant-specific data
-        merchant_data = self.transaction_data[self.transaction_data['merchant_id'] == self.merchant_id]
+        merchant_data = self.merchant_transactions
         
         if merchant_data.empty:
             return ["No data available for this merchant. Please check back later."]
@@ -243,21 +268,13 @@ class BusinessAnalytics:
         total_sales = merchant_data['order_value'].sum()
         avg_order_value = merchant_data['order_value'].mean()
         
-        # Get merchant's sales patterns
-        daily_sales = (
-            merchant_data.groupby(
-                merchant_data['order_time'].dt.day_name()
-            ).agg({
-                'order_value': ['sum', 'count'],
-                'order_id': 'nunique'
-            })
+        # Get merchant's sales patterns from its hourly rollup
+        daily_sales = as_order_value_agg(
+            rollup_by(self.merchant_hourly, 'weekday'),
+            [('order_value', 'sum'), ('order_value', 'count'), ('order_id', 'nunique')]
         )
         
-        hourly_sales = (
-            merchant_data.groupby(
-                merchant_data['order_time'].dt.hour
-            )['order_value'].sum()
-        )
+        hourly_sales = rollup_by(self.merchant_hourly, 'hour')['sales']
         
         # Get merchant's top and bottom performing items
         top_items = self.get_top_3_items(metric='revenue')
@@ -319,7 +336,7 @@ class BusinessAnalytics:
             )
         
         # Inventory suggestions
-        stock_alerts = self.get_low_stock_alerts()
+        stock_alerts = self.get_low_stock_alerts(merchant_id=self.merchant_id)
         if isinstance(stock_alerts, list) and len(stock_alerts) > 0:
             for alert in stock_alerts:
                 if isinstance(alert, dict) and 'suggestion' in alert:
@@ -361,40 +378,36 @@ class BusinessAnalytics:
         
         return suggestions
     
+    @timed()
+    @memoized(per_merchant=False)
     def get_yearly_sales(self, year=None):
         """Calculate total sales and metrics for a specific year"""
         try:
+            hourly = self.global_hourly
+            years = hourly['date'].dt.year
+            
             # If no year provided, use the most recent year with data
             if year is None:
-                year = self.transaction_data['order_time'].dt.year.max()
+                year = years.max()
             
             # Filter data for the specified year
-            yearly_data = self.transaction_data[
-                self.transaction_data['order_time'].dt.year == year
-            ]
+            yearly_data = hourly[years == year]
             
             if yearly_data.empty:
                 return f"No sales data available for {year}"
             
             # Calculate yearly metrics
-            total_sales = yearly_data['order_value'].sum()
-            total_orders = len(yearly_data)
+            total_sales = yearly_data['sales'].sum()
+            total_orders = yearly_data['orders'].sum()
             avg_order_value = total_sales / total_orders if total_orders > 0 else 0
             
             # Calculate monthly breakdown
-            monthly_sales = yearly_data.groupby(
-                yearly_data['order_time'].dt.month
-            ).agg({
-                'order_value': ['sum', 'count'],
-                'order_id': 'nunique'
-            })
+            monthly_sales = rollup_by(yearly_data, 'month')
             
             # Calculate growth compared to previous year
             prev_year = year - 1
-            prev_year_data = self.transaction_data[
-                self.transaction_data['order_time'].dt.year == prev_year
-            ]
-            prev_year_sales = prev_year_data['order_value'].sum() if not prev_year_data.empty else 0
+            prev_year_data = hourly[years == prev_year]
+            prev_year_sales = prev_year_data['sales'].sum() if not prev_year_data.empty else 0
             year_over_year_growth = ((total_sales - prev_year_sales) / prev_year_sales * 100) if prev_year_sales > 0 else 0
             
             # Format monthly data for display
@@ -403,8 +416,8 @@ class BusinessAnalytics:
                 if month in monthly_sales.index:
                     data = monthly_sales.loc[month]
                     monthly_breakdown[month] = {
-                        'sales': data[('order_value', 'sum')],
-                        'orders': data[('order_id', 'nunique')]
+                        'sales': data['sales'],
+                        'orders': data['unique_orders']
                     }
                 else:
                     monthly_breakdown[month] = {
@@ -419,27 +432,26 @@ class BusinessAnalytics:
                 'average_order_value': avg_order_value,
                 'monthly_breakdown': monthly_breakdown,
                 'year_over_year_growth': year_over_year_growth,
-                'best_month': monthly_sales[('order_value', 'sum')].idxmax() if not monthly_sales.empty else None,
-                'worst_month': monthly_sales[('order_value', 'sum')].idxmin() if not monthly_sales.empty else None
+                'best_month': monthly_sales['sales'].idxmax() if not monthly_sales.empty else None,
+                'worst_month': monthly_sales['sales'].idxmin() if not monthly_sales.empty else None
             }
             
         except Exception as e:
             return f"Error calculating yearly sales: {str(e)}"
 
+    @timed()
+    @memoized()
     def get_sales_insights(self):
         """Get comprehensive sales insights and trends"""
         growth_trends = self.get_weekly_growth_trends()
         top_items = self.get_top_3_items()
         
         # Get daily sales patterns
-        daily_sales = (
-            self.transaction_data.groupby(
-                self.transaction_data['order_time'].dt.day_name()
-            )['order_value'].sum()
-        )
+        hourly = self.global_hourly
+        daily_sales = rollup_by(hourly, 'weekday')['sales']
         
         # Get yearly sales data
-        current_year = self.transaction_data['order_time'].dt.year.max()
+        current_year = hourly['date'].dt.year.max()
         yearly_data = self.get_yearly_sales(current_year)
         
         insights = {
@@ -450,20 +462,22 @@ class BusinessAnalytics:
             'top_items': top_items,
             'best_day': daily_sales.idxmax(),
             'worst_day': daily_sales.idxmin(),
-            'avg_order_value': self.transaction_data['order_value'].mean(),
+            'avg_order_value': hourly['sales'].sum() / hourly['orders'].sum(),
             'yearly_data': yearly_data
         }
         
         return insights
 
+    @timed()
+    @memoized(per_merchant=False)
     def get_customer_behavior_insights(self):
         """Analyze customer behavior patterns and preferences"""
         try:
+            aggregate = self.global_aggregate
+            
             # Get unique orders by hour
             hourly_orders = (
-                self.transaction_data
-                .groupby(self.transaction_data['order_time'].dt.hour)['order_id']
-                .nunique()  # Count unique orders per hour
+                rollup_by(self.global_hourly, 'hour')['unique_orders']
                 .sort_values(ascending=False)
             )
             
@@ -471,15 +485,18 @@ class BusinessAnalytics:
             peak_hours = hourly_orders.head(3).to_dict()
             
             # Calculate total unique orders for percentage calculation
-            total_unique_orders = self.transaction_data['order_id'].nunique()
+            total_unique_orders = aggregate['unique_orders']
+            
+            # Item rows per cuisine
+            cuisine_items = aggregate['items'].merge(self.items, on='item_id', how='left')
             
             # Calculate customer metrics
             customer_metrics = {
-                'average_order_value': self.transaction_data.groupby('order_id')['order_value'].sum().mean(),
-                'average_items_per_order': self.merged_data.groupby('order_id')['item_id'].count().mean(),
+                'average_order_value': self.global_hourly['sales'].sum() / total_unique_orders,
+                'average_items_per_order': aggregate['item_count'] / aggregate['item_orders'],
                 'peak_hours': peak_hours,
                 'total_orders': total_unique_orders,
-                'popular_cuisines': self.merged_data.groupby('cuisine_tag')['order_id'].count().sort_values(ascending=False).head(3).to_dict()
+                'popular_cuisines': cuisine_items.groupby('cuisine_tag')['rows'].sum().sort_values(ascending=False).head(3).to_dict()
             }
             
             return customer_metrics
@@ -493,81 +510,75 @@ class BusinessAnalytics:
                 'popular_cuisines': {}
             }
 
+    @timed()
+    @memoized(per_merchant=False)
     def get_seasonal_trends(self):
         """Analyze seasonal patterns in sales and customer behavior"""
-        # Extract month and day of week from order time
-        seasonal_data = self.transaction_data.copy()
-        seasonal_data['month'] = seasonal_data['order_time'].dt.month
-        seasonal_data['day_of_week'] = seasonal_data['order_time'].dt.day_name()
+        # Roll the hourly aggregate up to months and days of the week
+        hourly = self.global_hourly
         
         # Calculate monthly trends
-        monthly_trends = seasonal_data.groupby('month').agg({
-            'order_value': ['sum', 'count'],
-            'order_id': 'nunique'
-        })
+        monthly_trends = as_order_value_agg(
+            rollup_by(hourly, 'month'),
+            [('order_value', 'sum'), ('order_value', 'count'), ('order_id', 'nunique')]
+        )
         
         # Calculate day of week trends
-        weekday_trends = seasonal_data.groupby('day_of_week').agg({
-            'order_value': ['sum', 'mean'],
-            'order_id': 'count'
-        })
+        weekday_trends = as_order_value_agg(
+            rollup_by(hourly, 'weekday'),
+            [('order_value', 'sum'), ('order_value', 'mean'), ('order_id', 'count')],
+            'day_of_week'
+        )
         
         return {
             'monthly_trends': monthly_trends,
             'weekday_trends': weekday_trends
         }
 
+    @timed()
+    @memoized(per_merchant=False)
     def get_profitability_analysis(self):
         """Analyze profitability of different items and categories"""
-        # Merge transaction data with items to get complete order information
-        profitability_data = self.merged_data.merge(
-            self.transaction_data[['order_id', 'order_value']],
-            on='order_id',
+        # Join the per-item aggregate with the catalog to get names and prices
+        profitability_data = self.global_aggregate['items'].merge(
+            self.items,
+            on='item_id',
             how='left'
         )
+        profitability_data['price_total'] = profitability_data['item_price'] * profitability_data['order_rows']
         
-        # Calculate item-level profitability
-        item_profitability = profitability_data.groupby('item_name').agg({
-            'order_id': 'count',  # Number of times item was ordered
-            'item_price': 'mean',  # Average price of the item
-            'order_value': 'sum'   # Total revenue from the item
-        }).rename(columns={
-            'order_id': 'total_orders',
-            'item_price': 'average_price',
-            'order_value': 'total_revenue'
-        })
+        def summarize(group_column):
+            grouped = profitability_data.groupby(group_column).agg({
+                'order_rows': 'sum',    # Number of times items were ordered
+                'price_total': 'sum',   # For the average item price
+                'order_value': 'sum'    # Total revenue from the items
+            })
+            return pd.DataFrame({
+                'total_orders': grouped['order_rows'],
+                'average_price': grouped['price_total'] / grouped['order_rows'],
+                'total_revenue': grouped['order_value']
+            })
         
-        # Calculate category-level profitability
-        category_profitability = profitability_data.groupby('cuisine_tag').agg({
-            'order_id': 'count',  # Number of orders in category
-            'item_price': 'mean',  # Average price in category
-            'order_value': 'sum'   # Total revenue in category
-        }).rename(columns={
-            'order_id': 'total_orders',
-            'item_price': 'average_price',
-            'order_value': 'total_revenue'
-        })
+        # Calculate item-level and category-level profitability
+        item_profitability = summarize('item_name')
+        category_profitability = summarize('cuisine_tag')
         
         return {
             'item_profitability': item_profitability,
             'category_profitability': category_profitability
         }
 
+    @timed()
+    @memoized(per_merchant=False)
     def get_inventory_optimization_suggestions(self):
         """Generate data-driven suggestions for inventory optimization"""
         try:
-            # Calculate sales frequency and average price for each item
-            item_metrics = self.merged_data.groupby('item_id').agg({
-                'order_id': 'count',  # Number of times item was ordered
-                'item_price': 'mean'  # Average price of the item
-            }).reset_index()
-            
-            # Merge with items data to get item names
-            item_metrics = item_metrics.merge(
-                self.items[['item_id', 'item_name']],
+            # Sales frequency and catalog price for each item
+            item_metrics = self.global_aggregate['items'].merge(
+                self.items[['item_id', 'item_name', 'item_price']],
                 on='item_id',
                 how='left'
-            )
+            ).rename(columns={'rows': 'order_id'})[['item_id', 'order_id', 'item_price', 'item_name']]
             
             # Calculate average daily sales (assuming 30 days period)
             item_metrics['avg_daily_sales'] = item_metrics['order_id'] / 30
@@ -602,22 +613,27 @@ class BusinessAnalytics:
         except Exception as e:
             return [f"Error generating inventory suggestions: {str(e)}"]
 
+    @timed()
+    @memoized(per_merchant=False)
     def get_promotion_effectiveness(self):
         """Analyze the effectiveness of promotions based on order patterns"""
         try:
             # Get the most recent 30 days of data for analysis
-            recent_date = self.transaction_data['order_time'].max()
+            recent_date = self.global_aggregate['last_order_time']
             start_date = recent_date - pd.Timedelta(days=30)
             
-            recent_data = self.transaction_data[
-                self.transaction_data['order_time'] >= start_date
-            ]
+            # Whole hours come from the rollup; the cutoff falls inside an
+            # hour, so that partial hour is rolled up from the raw rows
+            first_full_hour = start_date.ceil('h')
+            hourly = self.global_hourly
+            bucket_start = hourly['date'] + pd.to_timedelta(hourly['hour'], unit='h')
+            recent_data = hourly[bucket_start >= first_full_hour]
+            partial_hour = self.engine.rollup_range(start_date, first_full_hour)
+            if not partial_hour.empty:
+                recent_data = pd.concat([recent_data, partial_hour])
             
             # Calculate daily metrics
-            daily_metrics = recent_data.groupby(recent_data['order_time'].dt.date).agg({
-                'order_value': ['sum', 'count'],
-                'order_id': 'nunique'
-            }).reset_index()
+            daily_metrics = rollup_by(recent_data, 'date').reset_index()
             
             daily_metrics.columns = ['date', 'total_sales', 'order_count', 'unique_orders']
             
@@ -0,0 +1,315 @@
+import bisect
+import heapq
+import re
+
+import numpy as np
+import pandas as pd
+
+
+class DateIndex:
+    """
+    Time-ordered positions of a frame's rows, so a day or time range lookup
+    is a binary search plus a contiguous slice instead of a full-table scan.
+
+    Frames already sorted by the column are sliced directly; otherwise only
+    the sort order is kept (one int64 per row) rather than a sorted copy of
+    the table.
+    """
+
+    def __init__(self, df, column="order_time"):
+        times = df[column].to_numpy()
+        self.frame = df
+        self.column = column
+        if df[column].is_monotonic_increasing:
+            self._order = None
+            self._times = times
+        else:
+            # Stable so rows at the same timestamp keep their original order
+            self._order = np.argsort(times, kind="stable")
+            self._times = times[self._order]
+
+    def __len__(self):
+        return len(self._times)
+
+    def _position(self, timestamp, side):
+        return int(np.searchsorted(self._times, pd.Timestamp(timestamp).to_datetime64(), side=side))
+
+    def _rows(self, lo, hi):
+        if self._order is None:
+            return self.frame.iloc[lo:hi]
+        return self.frame.take(self._order[lo:hi])
+
+    def range(self, start=None, end=None, include_end=False):
+        """Rows with start <= time < end (time <= end when include_end)"""
+        lo = 0 if start is None else self._position(start, "left")
+        hi = len(self._times) if end is None else self._position(end, "right" if include_end else "left")
+        return self._rows(lo, max(lo, hi))
+
+    def day(self, date):
+        """All rows on one calendar day (date, datetime or 'YYYY-MM-DD')"""
+        start = pd.Timestamp(date).normalize()
+        return self.range(start, start + pd.Timedelta(days=1))
+
+    def days(self, first_date, last_date):
+        """All rows from first_date through last_date, both days inclusive"""
+        start = pd.Timestamp(first_date).normalize()
+        return self.range(start, pd.Timestamp(last_date).normalize() + pd.Timedelta(days=1))
+
+    def last(self):
+        """Latest timestamp, or None for an empty frame (NaT sorts last)"""
+        valid = self._times[~np.isnat(self._times)]
+        return pd.Timestamp(valid[-1]) if len(valid) else None
+
+
+# Funnel stages of keywords.csv, in order
+FUNNEL_STAGES = ("view", "menu", "checkout", "order")
+
+# Tokens shorter than this only match exactly in fuzzy search
+FUZZY_MIN_LENGTH = 4
+
+# Question words left out when a question falls back to a fuzzy search
+STOP_WORDS = frozenset((
+    "a", "about", "an", "and", "are", "as", "at", "by", "conversion", "convert",
+    "converting", "did", "do", "does", "doing", "for", "funnel", "how", "in", "is",
+    "it", "keyword", "keywords", "me", "my", "of", "on", "our", "search", "show",
+    "term", "the", "to", "was", "what", "whats", "with"
+))
+
+# A term in quotes ("how is 'spring rolls' converting?") is looked up as is;
+# an apostrophe inside a word ("what's") doesn't open one
+_QUOTED = re.compile(r"(?<!\w)['\"‘“]([^'\"’”]+)['\"’”](?!\w)")
+
+
+def _tokens(text):
+    return re.findall(r"\w+", str(text).lower())
+
+
+def _deletions(token):
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+class KeywordIndex:
+    """
+    In-memory lookups over the search keyword funnel (keywords.csv) and
+    the item names it relates to. Keywords are normalized (lower case,
+    words only) and repeated keywords summed. Every lookup is a dict
+    access or a binary search over sorted keywords and words, so it
+    doesn't touch the frames:
+    - funnel(): one keyword's counts and stage conversion ratios
+    - prefix(): keywords, or words of keywords, starting with a prefix
+    - fuzzy(): keywords sharing words with the text, allowing one typo
+      per word (symmetric-delete table over the keyword words)
+    - find(): keywords and item names mentioned in free text
+    - item_funnel(): an item's keywords and their combined funnel
+    """
+
+    def __init__(self, keywords, items=None):
+        names = keywords["keyword"].map(lambda keyword: " ".join(_tokens(keyword)))
+        counts = keywords[list(FUNNEL_STAGES)].groupby(names.to_numpy(), sort=True).sum()
+        counts = counts[counts.index != ""]
+        self.keywords = counts.index.tolist()
+        self.counts = counts.to_numpy(dtype=np.int64)
+        # view->menu, menu->checkout, checkout->order and view->order
+        numerators = np.column_stack([self.counts[:, 1:], self.counts[:, 3]])
+        denominators = np.column_stack([self.counts[:, :-1], self.counts[:, 0]])
+        self.rates = np.divide(
+            numerators, denominators,
+            out=np.zeros(numerators.shape), where=denominators > 0
+        )
+        # Plain lists, so building one result doesn't go through NumPy scalars
+        self._count_rows = self.counts.tolist()
+        self._rate_rows = self.rates.tolist()
+        self._orders = self.counts[:, 3].tolist()
+        self._ids = {keyword: i for i, keyword in enumerate(self.keywords)}
+        self._lengths = [len(keyword.split()) for keyword in self.keywords]
+        self._longest = max(self._lengths, default=0)
+
+        # Inverted index: word -> keyword ids, plus the sorted words for prefixes
+        postings = {}
+        for i, keyword in enumerate(self.keywords):
+            for token in set(keyword.split()):
+                postings.setdefault(token, []).append(i)
+        self._postings = postings
+        self._tokens = sorted(postings)
+        self._deletes = {}
+        for token in self._tokens:
+            if len(token) >= FUZZY_MIN_LENGTH:
+                for variant in _deletions(token) | {token}:
+                    self._deletes.setdefault(variant, set()).add(token)
+
+        # Items linked to the keywords found in their name, and to the
+        # keywords their name is part of
+        self._items = {}
+        self._longest_item = 0
+        self._item_keywords = {}
+        self._keyword_items = {}
+        if items is not None:
+            for name in items["item_name"].dropna().unique():
+                key = " ".join(_tokens(name))
+                if key:
+                    self._items.setdefault(key, name)
+                    self._longest_item = max(self._longest_item, len(key.split()))
+            for key, name in self._items.items():
+                self._item_keywords[name] = {i for _, _, i in self._ngrams(key.split(), self._ids)}
+            for i, keyword in enumerate(self.keywords):
+                for _, _, name in self._ngrams(keyword.split(), self._items, self._longest_item):
+                    self._item_keywords[name].add(i)
+            for name, linked in self._item_keywords.items():
+                for i in linked:
+                    self._keyword_items.setdefault(i, []).append(name)
+            self._item_keywords = {name: sorted(linked) for name, linked in self._item_keywords.items()}
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def _ngrams(self, words, lookup, longest=None, greedy=False):
+        """
+        (start, end, value) of each run of words that is a key of lookup;
+        greedy keeps only the longest run at a position and skips past it
+        """
+        longest = longest or self._longest
+        start = 0
+        while start < len(words):
+            following = start + 1
+            for end in range(min(len(words), start + longest), start, -1):
+                value = lookup.get(" ".join(words[start:end]))
+                if value is not None:
+                    yield start, end, value
+                    if greedy:
+                        following = end
+                        break
+            start = following
+
+    def _funnel(self, i):
+        view, menu, checkout, order = self._count_rows[i]
+        menu_rate, checkout_rate, order_rate, conversion = self._rate_rows[i]
+        return {
+            "keyword": self.keywords[i],
+            "view": view,
+            "menu": menu,
+            "checkout": checkout,
+            "order": order,
+            "menu_rate": menu_rate,
+            "checkout_rate": checkout_rate,
+            "order_rate": order_rate,
+            "conversion": conversion,
+            "items": self._keyword_items.get(i, [])
+        }
+
+    def _ranked(self, ids, limit):
+        """Funnels of ids, most orders first"""
+        return [self._funnel(i) for i in heapq.nsmallest(limit, ids, key=lambda i: -self._orders[i])]
+
+    def funnel(self, keyword):
+        """Counts and conversion ratios of one keyword, or None if it isn't indexed"""
+        i = self._ids.get(" ".join(_tokens(keyword)))
+        return None if i is None else self._funnel(i)
+
+    def prefix(self, prefix, limit=10):
+        """
+        Keywords starting with prefix, then keywords with a word starting
+        with its last word; most orders first within each
+        """
+        words = _tokens(prefix)
+        if not words:
+            return []
+        text = " ".join(words)
+        lo = bisect.bisect_left(self.keywords, text)
+        hi = bisect.bisect_left(self.keywords, text + "\uffff")
+        ids = list(range(lo, hi))
+        if len(ids) < limit:
+            lo = bisect.bisect_left(self._tokens, words[-1])
+            hi = bisect.bisect_left(self._tokens, words[-1] + "\uffff")
+            found = set(ids)
+            others = {
+                i for token in self._tokens[lo:hi] for i in self._postings[token]
+                if i not in found and all(word in self.keywords[i] for word in words[:-1])
+            }
+            return self._ranked(ids, limit) + self._ranked(others, limit - len(ids))
+        return self._ranked(ids, limit)
+
+    def _similar_tokens(self, word):
+        if len(word) < FUZZY_MIN_LENGTH:
+            return {word: 1.0} if word in self._postings else {}
+        similar = {}
+        for variant in _deletions(word) | {word}:
+            for token in self._deletes.get(variant, ()):
+                similar[token] = 1.0 if token == word else 0.8
+        return similar
+
+    def fuzzy(self, text, limit=10):
+        """
+        Keywords sharing the most words with text, where a word may be one
+        typo off (an exact word scores 1, a near one 0.8); ties go to the
+        keyword with fewer other words, then to the one with more orders
+        """
+        scores = {}
+        for word in set(_tokens(text)):
+            best = {}
+            for token, score in self._similar_tokens(word).items():
+                for i in self._postings[token]:
+                    best[i] = max(best.get(i, 0.0), score)
+            for i, score in best.items():
+                scores[i] = scores.get(i, 0.0) + score
+        ranked = heapq.nsmallest(
+            limit, scores,
+            key=lambda i: (-scores[i], self._lengths[i] - scores[i], -self._orders[i])
+        )
+        return [self._funnel(i) for i in ranked]
+
+    def find(self, text):
+        """
+        Keywords and item names mentioned in text, taking the longest one
+        at each position: ({keyword: funnel}, [item names])
+        """
+        words = _tokens(text)
+        keywords = {}
+        for start, end, i in self._ngrams(words, self._ids, greedy=True):
+            keywords.setdefault(self.keywords[i], self._funnel(i))
+        items = []
+        for start, end, name in self._ngrams(words, self._items, self._longest_item, greedy=True):
+            if name not in items:
+                items.append(name)
+        return keywords, items
+
+    def item_funnel(self, item_name):
+        """
+        The keywords linked to an item and their summed funnel, or None for
+        an unknown item name
+        """
+        name = self._items.get(" ".join(_tokens(item_name)))
+        if name is None:
+            return None
+        ids = self._item_keywords.get(name, [])
+        counts = self.counts[ids].sum(axis=0) if ids else np.zeros(len(FUNNEL_STAGES), dtype=np.int64)
+        totals = {stage: int(count) for stage, count in zip(FUNNEL_STAGES, counts)}
+        return {
+            "item": name,
+            **totals,
+            "conversion": totals["order"] / totals["view"] if totals["view"] else 0.0,
+            "keywords": self._ranked(ids, len(ids))
+        }
+
+    def lookup(self, text, limit=10):
+        """
+        Answer a free-text question about search keywords: a quoted term,
+        else the keywords and items it mentions, else a prefix and fuzzy
+        search over its words. Returns {"term", "items": [item funnels],
+        "keywords": [keyword funnels]}.
+        """
+        quoted = _QUOTED.search(text)
+        term = quoted.group(1) if quoted else text
+        keywords, items = self.find(term)
+        if quoted and not keywords and not items:
+            found = self.funnel(term)
+            keywords = {found["keyword"]: found} if found else {
+                funnel["keyword"]: funnel for funnel in self.prefix(term, limit) or self.fuzzy(term, limit)
+            }
+        elif not keywords and not items:
+            words = " ".join(word for word in _tokens(term) if word not in STOP_WORDS)
+            keywords = {funnel["keyword"]: funnel for funnel in self.fuzzy(words, limit)}
+        return {
+            "term": term,
+            "items": [self.item_funnel(name) for name in items],
+            "keywords": list(keywords.values())[:limit]
+        }
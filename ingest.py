@@ -0,0 +1,242 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import (
+    DATA_FILES,
+    DELTA_DIR,
+    get_partition_version,
+    get_peak_rss_mb,
+    get_read_options,
+    list_deltas
+)
+from rollups import build_rollup
+from snapshot import PYARROW_AVAILABLE, PartitionBuilder, SnapshotWriter
+
+# Working memory allowed for one chunk, in MB. The rows per chunk are derived
+# from it by sampling the file, unless MEX_INGEST_CHUNK_ROWS fixes them.
+INGEST_MEMORY_MB = int(os.environ.get("MEX_INGEST_MEMORY_MB", "256"))
+INGEST_CHUNK_ROWS = int(os.environ.get("MEX_INGEST_CHUNK_ROWS", "0")) or None
+
+# A parsed chunk is held about this many times over while it is split by
+# merchant, rolled up and converted for the snapshot writer
+CHUNK_OVERHEAD = 4
+SAMPLE_ROWS = 10000
+
+
+def _sources(name, deltas):
+    """(path, is_base) of a table's base CSV followed by its delta batches"""
+    sources = [(DATA_FILES[name], True)]
+    for batch in deltas:
+        path = os.path.join(DELTA_DIR, batch, DATA_FILES[name])
+        if os.path.exists(path):
+            sources.append((path, False))
+    return sources
+
+
+def chunk_rows_for(path, read_options, memory_mb=INGEST_MEMORY_MB):
+    """Rows per chunk that keep a chunk's working set within memory_mb"""
+    sample = pd.read_csv(path, nrows=SAMPLE_ROWS, **read_options)
+    row_bytes = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+    return max(1000, int(memory_mb * 2**20 / (max(row_bytes, 1) * CHUNK_OVERHEAD)))
+
+
+def _categories(sources, read_options, chunk_rows):
+    """
+    Sorted categories of each categorical column, per file and across all
+    files. Chunks parse their own categories, so they are re-cast to these
+    to keep every chunk (and every partition) on one dtype.
+    """
+    columns = [col for col, dtype in read_options["dtype"].items() if dtype == "category"]
+    per_file = {}
+    for path, _ in sources:
+        values = {col: set() for col in columns}
+        if columns:
+            for chunk in pd.read_csv(path, usecols=columns, dtype=str, chunksize=chunk_rows):
+                for col in columns:
+                    values[col].update(chunk[col].dropna().unique())
+        per_file[path] = {col: pd.CategoricalDtype(sorted(values[col])) for col in columns}
+    union = {
+        col: pd.CategoricalDtype(sorted(set().union(*(
+            set(dtypes[col].categories) for dtypes in per_file.values()
+        ))))
+        for col in columns
+    }
+    return per_file, union
+
+
+def _cast(chunk, dtypes):
+    for col, dtype in dtypes.items():
+        chunk[col] = chunk[col].astype(dtype)
+    return chunk
+
+
+def _order_keys(order_ids):
+    """
+    64-bit hashes of order ids. The order lookup keeps these instead of the
+    strings (a collision between two ids is ~1e-7 likely at millions of
+    orders).
+    """
+    return pd.util.hash_pandas_object(order_ids, index=False).to_numpy()
+
+
+def _add_buckets(total, part, keys):
+    return part if total is None else pd.concat([total, part]).groupby(keys, as_index=False).sum()
+
+
+def _stream(name, sources, read_options, categories, chunk_rows, progress):
+    """Yield each chunk of a table cast to the shared dtypes, writing base snapshots on the way"""
+    per_file, union = categories
+    for path, is_base in sources:
+        started = time.perf_counter()
+        writer = SnapshotWriter(path, read_options) if is_base else None
+        options = read_options if is_base else get_read_options(name, path)
+        rows = 0
+        for chunk in pd.read_csv(path, chunksize=chunk_rows, **options):
+            # The snapshot gets the file's own categories, like a full parse
+            chunk = _cast(chunk, per_file[path])
+            if writer is not None:
+                writer.write(chunk)
+            rows += len(chunk)
+            yield _cast(chunk, union)
+        if writer is not None:
+            writer.close()
+        progress(f"Ingested {path}: {rows:,} rows in {time.perf_counter() - started:,.1f} s")
+
+
+def ingest_partitions(version=None, deltas=None, memory_mb=INGEST_MEMORY_MB, chunk_rows=INGEST_CHUNK_ROWS, progress=print):
+    """
+    Build the Feather snapshots and per-merchant partitions of the
+    transaction tables (plus delta batches) by streaming the CSVs in
+    bounded-memory chunks, without loading either table whole.
+
+    Produces what data_loader.ensure_partitions() builds from the loaded
+    tables: the partitions, merchant_hourly rollups, global_hourly and
+    global_items aggregates and dataset totals. Chunk working memory stays
+    within memory_mb; the only state that grows with the data is the order
+    lookup used to route items to their order's merchant (about 20 bytes
+    per order). Returns the partition manifest.
+    """
+    if not PYARROW_AVAILABLE:
+        raise RuntimeError("Chunked ingestion writes Feather partitions and needs pyarrow")
+    version = version or get_partition_version()
+    deltas = list_deltas() if deltas is None else deltas
+    started = time.perf_counter()
+    builder = PartitionBuilder()
+
+    # transaction_data: partitions, rollups and the order lookup
+    sources = _sources("transaction_data", deltas)
+    read_options = get_read_options("transaction_data")
+    rows = chunk_rows or chunk_rows_for(sources[0][0], read_options, memory_mb)
+    categories = _categories(sources, read_options, rows)
+    merchant_dtype = categories[1]["merchant_id"]
+    progress(f"Ingesting transaction_data in chunks of {rows:,} rows ({memory_mb} MB budget)")
+
+    global_hourly = None
+    first_order_time = last_order_time = None
+    lookup_parts = []
+    for chunk in _stream("transaction_data", sources, read_options, categories, rows, progress):
+        merchant_hourly = build_rollup(chunk, by="merchant_id")
+        builder.add({
+            "transaction_data": (chunk, chunk["merchant_id"]),
+            "merchant_hourly": (merchant_hourly, merchant_hourly["merchant_id"])
+        })
+        global_hourly = _add_buckets(global_hourly, build_rollup(chunk), ["date", "hour"])
+        chunk_first, chunk_last = chunk["order_time"].min(), chunk["order_time"].max()
+        first_order_time = chunk_first if first_order_time is None else min(first_order_time, chunk_first)
+        last_order_time = chunk_last if last_order_time is None else max(last_order_time, chunk_last)
+
+        orders = chunk[chunk["order_id"].notna()]
+        lookup_parts.append(pd.DataFrame({
+            "key": _order_keys(orders["order_id"]),
+            "merchant": orders["merchant_id"].cat.codes.to_numpy(),
+            "order_value": orders["order_value"].to_numpy()
+        }))
+
+    # Merchant of an order's first row, and the rows/value an item joins to
+    lookup = pd.concat(lookup_parts, ignore_index=True)
+    del lookup_parts
+    first = lookup.drop_duplicates("key").set_index("key")["merchant"]
+    orders = lookup.groupby("key", sort=True)["order_value"].agg(["size", "sum"])
+    del lookup
+    order_keys = orders.index.to_numpy()
+    order_merchants = first.reindex(orders.index).to_numpy()
+    order_rows = orders["size"].to_numpy()
+    order_values = orders["sum"].to_numpy()
+    del first, orders
+
+    # transaction_items: partitions by their order's merchant, item totals
+    sources = _sources("transaction_items", deltas)
+    read_options = get_read_options("transaction_items")
+    rows = chunk_rows or chunk_rows_for(sources[0][0], read_options, memory_mb)
+    categories = _categories(sources, read_options, rows)
+    progress(f"Ingesting transaction_items in chunks of {rows:,} rows ({memory_mb} MB budget)")
+
+    item_parts = []
+    item_order_keys = []
+    item_count = 0
+    for chunk in _stream("transaction_items", sources, read_options, categories, rows, progress):
+        keys = _order_keys(chunk["order_id"])
+        has_order = chunk["order_id"].notna().to_numpy()
+        if len(order_keys):
+            position = np.minimum(np.searchsorted(order_keys, keys), len(order_keys) - 1)
+            found = has_order & (order_keys[position] == keys)
+        else:
+            position = np.zeros(len(keys), dtype=np.int64)
+            found = np.zeros(len(keys), dtype=bool)
+
+        merchants = pd.Categorical.from_codes(
+            np.where(found, order_merchants[position], -1), dtype=merchant_dtype
+        )
+        builder.add({"transaction_items": (chunk, pd.Series(merchants, index=chunk.index))})
+
+        # An item row joins every transaction row of its order (or one NaN row)
+        item_parts.append(pd.DataFrame({
+            "item_id": chunk["item_id"].to_numpy(),
+            "rows": 1,
+            "order_rows": np.where(found, order_rows[position], 1),
+            "order_value": np.where(found, order_values[position], 0.0)
+        }).groupby("item_id").sum())
+        item_count += int(chunk.loc[has_order, "item_id"].count())
+        item_order_keys.append(np.unique(keys[has_order]))
+
+    global_items = pd.concat(item_parts).groupby(level=0).sum().rename_axis("item_id").reset_index()
+    item_orders = len(np.unique(np.concatenate(item_order_keys))) if item_order_keys else 0
+
+    meta = {
+        "first_order_time": first_order_time.isoformat(),
+        "last_order_time": last_order_time.isoformat(),
+        "unique_orders": int(len(order_keys)),
+        "item_count": item_count,
+        "item_orders": item_orders,
+        "deltas": deltas
+    }
+    manifest = builder.finish(
+        version,
+        aggregates={"global_hourly": global_hourly, "global_items": global_items},
+        meta=meta,
+        # Buckets split across chunks are summed back together
+        combine={"merchant_hourly": lambda frame: frame.groupby(
+            ["merchant_id", "date", "hour"], observed=True, as_index=False
+        ).sum()}
+    )
+
+    peak_rss = get_peak_rss_mb()
+    lookup_mb = (order_keys.nbytes + order_merchants.nbytes + order_rows.nbytes + order_values.nbytes) / 2**20
+    progress(
+        f"Ingestion finished in {time.perf_counter() - started:,.1f} s: "
+        f"{len(manifest['keys'])} partitions, order lookup {lookup_mb:,.1f} MB"
+        + (f", peak RSS {peak_rss:,.0f} MB" if peak_rss is not None else "")
+    )
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream the transaction CSVs into snapshots and partitions")
+    parser.add_argument("--memory-mb", type=int, default=INGEST_MEMORY_MB, help="working memory per chunk")
+    parser.add_argument("--chunk-rows", type=int, default=INGEST_CHUNK_ROWS, help="fixed rows per chunk")
+    args = parser.parse_args()
+    ingest_partitions(memory_mb=args.memory_mb, chunk_rows=args.chunk_rows)
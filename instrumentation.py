@@ -0,0 +1,284 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+# Spans are recorded only when enabled ("1"); disabled, span() and timed()
+# cost one flag check per call
+INSTRUMENTATION = os.environ.get("MEX_INSTRUMENTATION", "0") == "1"
+
+# Finished traces kept for the debug panel and the JSON export
+TRACE_HISTORY = int(os.environ.get("MEX_TRACE_HISTORY", "50"))
+
+# When set, the Prometheus text export is rewritten to this file after each
+# trace (e.g. for node_exporter's textfile collector)
+METRICS_FILE = os.environ.get("MEX_METRICS_FILE")
+
+_enabled = INSTRUMENTATION
+_local = threading.local()
+_lock = threading.Lock()
+_traces = deque(maxlen=TRACE_HISTORY)
+# span name -> [calls, seconds, max seconds, rows]
+_totals = {}
+
+
+class Span:
+    """One timed stage: its name, attributes, duration, row count and nested spans"""
+
+    __slots__ = ("name", "attrs", "rows", "started", "seconds", "children")
+
+    def __init__(self, name, rows=None, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.rows = rows
+        self.started = time.time()
+        self.seconds = None
+        self.children = []
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @property
+    def self_seconds(self):
+        """Time not spent in nested spans (e.g. Streamlit rendering in a query branch)"""
+        return (self.seconds or 0.0) - sum(child.seconds or 0.0 for child in self.children)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started": self.started,
+            "ms": (self.seconds or 0.0) * 1000,
+            "self_ms": self.self_seconds * 1000,
+            "rows": self.rows,
+            "attrs": {key: str(value) for key, value in self.attrs.items()},
+            "children": [child.to_dict() for child in self.children]
+        }
+
+
+class _NullSpan:
+    """Stands in for a span when instrumentation is disabled"""
+
+    __slots__ = ()
+    name = None
+    # Shared by every caller, so row counts set on it are dropped
+    rows = property(lambda self: None, lambda self, value: None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class _SpanContext:
+    def __init__(self, name, rows, attrs, root):
+        self.span = Span(name, rows, attrs)
+        self.root = root
+
+    def __enter__(self):
+        stack = _stack()
+        if stack and not self.root:
+            stack[-1].children.append(self.span)
+        stack.append(self.span)
+        self._started = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self.span
+        span.seconds = time.perf_counter() - self._started
+        if exc_type is not None:
+            span.attrs["error"] = exc_type.__name__
+        stack = _stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        _add_totals(span)
+        if self.root:
+            with _lock:
+                _traces.append(span)
+            if METRICS_FILE:
+                export_prometheus(METRICS_FILE)
+        return False
+
+
+def _add_totals(span):
+    with _lock:
+        totals = _totals.setdefault(span.name, [0, 0.0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += span.seconds
+        totals[2] = max(totals[2], span.seconds)
+        totals[3] += span.rows or 0
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(enabled):
+    """Turn span recording on or off for the whole process"""
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def span(name, rows=None, **attrs):
+    """
+    Context manager timing a stage nested under the span open in this
+    thread. Set .rows (or .set(...) attributes) on the yielded span once
+    they are known.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _SpanContext(name, rows, attrs, root=False)
+
+
+def trace(name, **attrs):
+    """Like span(), but starts a new trace kept in recent_traces() (e.g. one chat query)"""
+    if not _enabled:
+        return _NULL_SPAN
+    return _SpanContext(name, None, attrs, root=True)
+
+
+def current_span():
+    """Innermost open span of this thread, or None"""
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def rename_span(name):
+    """Rename the innermost open span, e.g. once a dispatcher knows which branch it took"""
+    span = current_span()
+    if _enabled and span is not None:
+        span.name = name
+
+
+def _rows_of(result):
+    if isinstance(result, (pd.DataFrame, pd.Series, list)):
+        return len(result)
+    return None
+
+
+def timed(name=None, rows=_rows_of):
+    """
+    Decorator recording each call as a span named name (default: the
+    function's qualified name), with rows(result) as its row count
+    """
+    def decorator(function):
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _SpanContext(label, None, {}, root=False) as span:
+                result = function(*args, **kwargs)
+                span.rows = rows(result) if rows is not None else None
+                return result
+        return wrapper
+    return decorator
+
+
+def recent_traces():
+    """Finished traces, oldest first"""
+    with _lock:
+        return list(_traces)
+
+
+def span_totals():
+    """Per span name: calls, total and max seconds and rows, over every recorded span"""
+    with _lock:
+        return {
+            name: {"calls": calls, "seconds": seconds, "max_seconds": longest, "rows": rows}
+            for name, (calls, seconds, longest, rows) in sorted(_totals.items())
+        }
+
+
+def reset():
+    with _lock:
+        _traces.clear()
+        _totals.clear()
+
+
+def flatten(trace_span):
+    """Rows of (depth, name, ms, self ms, rows, attributes) of a trace, depth first, for display"""
+    rows = []
+
+    def visit(span, depth):
+        rows.append({
+            "stage": "  " * depth + span.name,
+            "ms": round((span.seconds or 0.0) * 1000, 1),
+            "self_ms": round(span.self_seconds * 1000, 1),
+            "rows": span.rows,
+            "details": ", ".join(f"{key}={value}" for key, value in span.attrs.items())
+        })
+        for child in span.children:
+            visit(child, depth + 1)
+
+    visit(trace_span, 0)
+    return rows
+
+
+def to_json():
+    return json.dumps({
+        "traces": [span.to_dict() for span in recent_traces()],
+        "totals": span_totals()
+    }, indent=2)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def to_prometheus():
+    """span_totals() in the Prometheus text exposition format"""
+    totals = span_totals()
+    lines = []
+    metrics = (
+        ("mex_span_seconds_total", "counter", "Total time spent in the span", "seconds"),
+        ("mex_span_calls_total", "counter", "Times the span was recorded", "calls"),
+        ("mex_span_rows_total", "counter", "Rows handled by the span", "rows"),
+        ("mex_span_max_seconds", "gauge", "Longest single span", "max_seconds")
+    )
+    for metric, kind, help_text, field in metrics:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{span="{_label(name)}"}} {values[field]}' for name, values in totals.items()]
+    return "\n".join(lines) + "\n"
+
+
+def _write(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Replace atomically so scrapers never read a half-written file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def export_json(path):
+    """Write the recent traces and per-span totals as JSON"""
+    _write(path, to_json())
+
+
+def export_prometheus(path):
+    """Write the per-span totals in the Prometheus text format"""
+    try:
+        _write(path, to_prometheus())
+    except Exception as e:
+        print(f"Error exporting metrics: {str(e)}")
@@ -0,0 +1,158 @@
+import re
+
+# Trigger phrases of app.process_query: topics are tried in TOPICS order
+# (the first one found picks the branch), the other intents refine a branch.
+# Phrases match anywhere in the lower-cased query, as substrings.
+QUERY_INTENTS = {
+    "keyword_funnel": ["convert", "conversion", "funnel", "keyword", "search term"],
+    "sales": [
+        "sales", "how much", "revenue", "earnings", "income",
+        "top selling", "best selling", "popular items", "top items", "most sold",
+        "what's selling", "what sells", "selling well", "trends",
+        "compare", "versus", "vs", "difference", "average", "mean",
+        "median", "total", "sum", "amount", "value"
+    ],
+    "customer_behavior": ["customer", "behavior", "pattern", "preference"],
+    "profitability": ["profit", "revenue", "income", "earnings"],
+    "seasonal_trends": ["seasonal", "trend", "pattern", "monthly"],
+    "inventory": ["inventory", "stock", "supply", "restock"],
+    "promotions": ["promotion", "discount", "offer", "deal"],
+    "greeting": ["hi", "hello", "hey", "greetings"],
+    "help": ["help", "what can you do", "capabilities"],
+    "business_tips": ["business tips", "suggestions", "improve", "advice", "recommendations"],
+    "sales_graph": ["trend", "graph", "chart", "sales trend", "sales graph"],
+    "best_day": ["best day", "worst day", "best performing", "worst performing", "best and worst"],
+    "peak_hours": ["peak hours", "busiest hours", "busy times", "rush hours"],
+    "popular_cuisines": ["popular cuisines", "most popular cuisines", "cuisine preferences", "favorite cuisines"],
+    "compare": ["compare", "vs", "versus", "difference"],
+    "metric": ["average", "mean", "median", "total", "sum"],
+    "today": ["today"],
+    "yesterday": ["yesterday"],
+    "order": ["order"],
+    "value": ["value"],
+    "revenue": ["revenue"],
+    "total": ["total"],
+    "trend": ["trend"],
+    "top_items": ["top selling", "best selling", "popular items", "top items", "most sold"],
+    "monthly_sales": ["monthly sales", "sales by month", "monthly revenue"]
+}
+QUERY_TOPICS = (
+    "keyword_funnel", "sales", "customer_behavior", "profitability", "seasonal_trends", "inventory",
+    "promotions", "greeting", "help", "business_tips", "sales_graph", "best_day",
+    "peak_hours", "popular_cuisines"
+)
+
+# Trigger phrases of chat_interface.process_query
+CHAT_INTENTS = {
+    "sales": ["sales", "revenue", "earnings", "income", "how much"],
+    "inventory": ["stock", "inventory", "items", "running low"],
+    "tips": ["tip", "suggest", "advice", "help", "improve"],
+    "top_items": ["top", "best", "selling", "popular"],
+    "weekly": ["week", "weekly", "trend", "growth"]
+}
+CHAT_TOPICS = ("sales", "inventory", "tips", "top_items")
+
+# Years 2000-2099, wherever they appear in the query (also inside longer numbers)
+YEAR_PATTERN = r"20\d\d"
+
+
+def _trie_pattern(phrases):
+    """
+    Regex matching the longest of phrases at a position. The phrases are
+    merged into a trie first, so the regex engine follows one branch per
+    character instead of trying every phrase in turn.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Greedy, so a longer phrase wins over one that ends here
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return build(trie)
+
+
+class IntentMatch:
+    """
+    Intents found in one query (text), with its topics ranked, the years
+    it mentions and the (start, end) spans of the phrases found
+    """
+
+    __slots__ = ("text", "intents", "topics", "years", "spans")
+
+    def __init__(self, text, intents, topics, years, spans):
+        self.text = text
+        self.intents = intents
+        self.topics = topics
+        self.years = years
+        self.spans = spans
+
+    @property
+    def topic(self):
+        """Highest-ranked topic, or "fallback" when the query has none"""
+        return self.topics[0] if self.topics else "fallback"
+
+    @property
+    def year(self):
+        """Earliest year mentioned, or None"""
+        return min(self.years) if self.years else None
+
+    def has(self, *intents):
+        return any(intent in self.intents for intent in intents)
+
+    def __repr__(self):
+        return f"IntentMatch(topic={self.topic!r}, intents={sorted(self.intents)}, years={self.years})"
+
+
+class IntentRouter:
+    """
+    Matches a query against every trigger phrase (and year) in one regex
+    pass. The regex is compiled once; a lookahead tries it at every
+    position, so overlapping phrases are all found, and each phrase found
+    also counts the shorter phrases it contains.
+    """
+
+    def __init__(self, intents, topics):
+        self.topics = tuple(topics)
+        phrases = sorted({phrase for words in intents.values() for phrase in words})
+        phrase_intents = {
+            phrase: frozenset(intent for intent, words in intents.items() if phrase in words)
+            for phrase in phrases
+        }
+        self._found = {
+            phrase: frozenset().union(*(phrase_intents[other] for other in phrases if other in phrase))
+            for phrase in phrases
+        }
+        self._regex = re.compile(f"(?=(?:(?P<phrase>{_trie_pattern(phrases)})|(?P<year>{YEAR_PATTERN})))")
+
+    def match(self, query):
+        """Intents, ranked topics and years of a lower-cased query"""
+        intents = set()
+        years = set()
+        spans = []
+        for found in self._regex.finditer(query):
+            phrase = found.group("phrase")
+            if phrase is not None:
+                intents |= self._found[phrase]
+                spans.append((found.start(), found.start() + len(phrase)))
+            else:
+                years.add(int(found.group("year")))
+        return IntentMatch(
+            query,
+            frozenset(intents),
+            [topic for topic in self.topics if topic in intents],
+            sorted(years),
+            spans
+        )
+
+
+QUERY_ROUTER = IntentRouter(QUERY_INTENTS, QUERY_TOPICS)
+CHAT_ROUTER = IntentRouter(CHAT_INTENTS, CHAT_TOPICS)
@@ -1,29 +1,25 @@
 import pandas as pd
 import streamlit as st
 
-from data_loader import load_data
+from data_loader import load_data, load_date_index, load_fact_index, load_fact_table
 from datetime import datetime, timedelta
+from facts import build_fact_table
 from helper import BusinessAnalytics
+from instrumentation import timed
 
 # Initialize BusinessAnalytics
 analytics = BusinessAnalytics()
 
+# Shared dataset; tables are loaded on first access
 data = load_data()
-items = data["items"]
-transaction_data = data["transaction_data"]
-transaction_items = data["transaction_items"]
-
-# merge items and transaction_items for next operation
-merged_data = transaction_items.merge(items, on = "item_id", how = "left")
 
 def get_merged_data(data):
-    """Helper function to merge transaction items with items data"""
-    return data["transaction_items"].merge(
-        data["items"],
-        on="item_id",
-        how="left"
-    )
+    """Order items of data joined with their order and item data (built once per version for the shared dataset)"""
+    if data is load_data():
+        return load_fact_table()
+    return build_fact_table(data["transaction_data"], data["transaction_items"], data["items"])
 
+@timed("logic.get_daily_sales_summary")
 def get_daily_sales_summary(date_str=None):
     """Get daily sales summary with detailed metrics based on selected date and merchant."""
     try:
@@ -37,17 +33,14 @@ def get_daily_sales_summary(date_str=None):
         # Convert to datetime object
         current_date = datetime.strptime(date_str, "%Y-%m-%d")
         yesterday_date = current_date - timedelta(days=1)
-        yesterday = yesterday_date.strftime("%Y-%m-%d")
 
         # Format dates for display
         display_date = current_date.strftime("%d %b %Y")
         display_yesterday = yesterday_date.strftime("%d %b %Y")
 
-        # Filter by date AND merchant
-        daily_data = analytics.transaction_data[
-            (analytics.transaction_data['order_time'].dt.strftime('%Y-%m-%d') == date_str) &
-            (analytics.transaction_data['merchant_id'] == merchant_id)
-        ]
+        # Day lookups are binary searches over this merchant's rows
+        merchant_index = load_date_index(merchant_id)
+        daily_data = merchant_index.day(current_date)
 
         if daily_data.empty:
             return f"No sales data available for {display_date} (Merchant: {merchant_id})"
@@ -58,10 +51,7 @@ def get_daily_sales_summary(date_str=None):
         avg_order_value = total_sales / num_orders if num_orders > 0 else 0
 
         # Yesterday's data for the same merchant
-        yesterday_data = analytics.transaction_data[
-            (analytics.transaction_data['order_time'].dt.strftime('%Y-%m-%d') == yesterday) &
-            (analytics.transaction_data['merchant_id'] == merchant_id)
-        ]
+        yesterday_data = merchant_index.day(yesterday_date)
         yesterday_sales = yesterday_data['order_value'].sum() if not yesterday_data.empty else 0
 
         # Growth calculation
@@ -83,6 +73,7 @@ def get_daily_sales_summary(date_str=None):
     except Exception as e:
         return f"Error calculating daily sales summary: {str(e)}"
 
+@timed("logic.get_sales_trend_for_merchant")
 def get_sales_trend_for_merchant(days=7):
     """Return last N days of sales for the current merchant."""
     try:
@@ -90,11 +81,8 @@ def get_sales_trend_for_merchant(days=7):
         end_date = st.session_state.selected_date
         start_date = end_date - timedelta(days=days - 1)
 
-        # Filter transaction data for the date range and merchant
-        df = analytics.transaction_data.copy()
-        df = df[(df["order_time"].dt.date >= start_date) &
-                (df["order_time"].dt.date <= end_date) &
-                (df["merchant_id"] == merchant_id)]
+        # Slice the merchant's transactions for the date range
+        df = load_date_index(merchant_id).days(start_date, end_date)
 
         # Group by date and sum order values
         daily_sales = df.groupby(df["order_time"].dt.date)["order_value"].sum().reset_index()
@@ -107,30 +95,19 @@ def get_sales_trend_for_merchant(days=7):
         st.error(f"Error generating sales trend: {e}")
         return pd.DataFrame(columns=["Date", "Total Sales (RM)"])
 
+@timed("logic.get_top_selling_items")
 def get_top_selling_items(top_n=3, date_str=None):
     """Get top selling items with detailed metrics"""
     try:
         # If no date provided, use the most recent date with data
         if date_str is None:
             # Get the most recent date from transaction data
-            most_recent_date = analytics.transaction_data['order_time'].max().strftime('%Y-%m-%d')
+            most_recent_date = analytics.global_aggregate['last_order_time'].strftime('%Y-%m-%d')
             date_str = most_recent_date
             print(f"Using most recent date with data: {date_str}")
         
-        # Merge transaction items with transaction data to get order_time
-        merged_with_time = analytics.merged_data.merge(
-            analytics.transaction_data[['order_id', 'order_time']],
-            on='order_id',
-            how='left'
-        )
-        
-        # Convert order_time to datetime if it's not already
-        merged_with_time['order_time'] = pd.to_datetime(merged_with_time['order_time'])
-        
-        # Get items data for the specified date
-        daily_items = merged_with_time[
-            merged_with_time['order_time'].dt.strftime('%Y-%m-%d') == date_str
-        ]
+        # Items of the orders placed on that day
+        daily_items = load_fact_index().day(date_str)
         
         if daily_items.empty:
             return [f"No sales data available for {date_str}"]
@@ -155,6 +132,7 @@ def get_top_selling_items(top_n=3, date_str=None):
         print(f"Error in get_top_selling_items: {str(e)}")
         return [f"Error getting top selling items: {str(e)}"]
 
+@timed("logic.get_low_stock_alerts")
 def get_low_stock_alerts(data, merchant_id=None, threshold=5):
     """
     Get alerts for items that are running low on stock.
@@ -169,15 +147,15 @@ def get_low_stock_alerts(data, merchant_id=None, threshold=5):
         list: List of dictionaries containing low stock alerts
     """
     try:
-        # Get the merged data
-        merged_data = get_merged_data(data)
+        # Get the order items (only the merchant's partition when filtering the shared dataset)
+        merged_data = load_fact_table(merchant_id) if merchant_id and data is load_data() else get_merged_data(data)
         
         # Filter by merchant if specified
         if merchant_id:
             merged_data = merged_data[merged_data['merchant_id'] == merchant_id]
         
         # Calculate sales frequency per item
-        sales_frequency = merged_data.groupby(['merchant_id', 'item_id', 'item_name'])['order_id'].count().reset_index()
+        sales_frequency = merged_data.groupby(['merchant_id', 'item_id', 'item_name'], observed=True)['order_id'].count().reset_index()
         sales_frequency.columns = ['merchant_id', 'item_id', 'item_name', 'sales_count']
         
         # Calculate average sales per item
@@ -213,21 +191,20 @@ def get_low_stock_alerts(data, merchant_id=None, threshold=5):
         print(f"Error in get_low_stock_alerts: {str(e)}")
         return []
 
+@timed("logic.get_sales_trends")
 def get_sales_trends(days=7):
     """Get sales trends over the specified number of days"""
     try:
         # Get the most recent date with data
-        most_recent_date = analytics.transaction_data['order_time'].max()
+        date_index = load_date_index()
+        most_recent_date = date_index.last()
         end_date = most_recent_date
         start_date = end_date - timedelta(days=days)
         
         print(f"Analyzing trends from {start_date.date()} to {end_date.date()}")
         
-        # Filter data for the specified date range
-        filtered = analytics.transaction_data[
-            (analytics.transaction_data['order_time'] >= start_date) &
-            (analytics.transaction_data['order_time'] <= end_date)
-        ]
+        # Slice the time-ordered rows for the specified date range
+        filtered = date_index.range(start_date, end_date, include_end=True)
         
         if filtered.empty:
             return {
@@ -296,6 +273,7 @@ def get_sales_trends(days=7):
             'outliers': []
         }
 
+@timed("logic.get_simple_suggestion")
 def get_simple_suggestion(merchant_type=None, business_size=None):
     """Get personalized business suggestions"""
     try:
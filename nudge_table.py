@@ -0,0 +1,123 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from data_loader import get_dataset_version, load_data, load_fact_table, load_merchant_data
+from facts import build_fact_table
+from rollups import build_rollup
+from smart_nudges import NudgeMatrices, render_messages
+from snapshot import concat_rows, read_result_table, write_result_table
+
+# Stored as <SNAPSHOT_DIR>/nudges.feather, one row per nudge with columns
+# merchant_id, type, day, hour, item, growth and message
+NUDGE_TABLE = "nudges"
+
+
+def compute_nudges(transaction_data, order_items, render=True):
+    """
+    Smart nudges of every merchant in the given rows, evaluated in one
+    vectorized pass (see smart_nudges.NudgeMatrices) instead of one
+    SmartNudges per merchant.
+
+    order_items is the matching order-item fact table (facts.FACT_COLUMNS).
+    Rows come out per merchant in the order SmartNudges.generate_nudges()
+    lists them: weekday nudges, the peak hour nudge, then item nudges.
+    The message column is only rendered when render is True.
+    """
+    # The rules only read sales, skip counting distinct orders
+    hourly = build_rollup(transaction_data, by="merchant_id", measures=("sales",))
+    matrices = NudgeMatrices.build(hourly, order_items)
+    nudges = matrices.evaluate()
+    table = pd.DataFrame(nudges)
+    table["hour"] = table["hour"].astype("Int64")
+    if render:
+        table["message"] = render_messages(nudges)
+    return table
+
+
+def _nudge_shard(merchant_ids):
+    """Nudges of a subset of merchants, read from their own partitions"""
+    tables = [load_merchant_data(merchant_id) for merchant_id in merchant_ids]
+    transaction_data = concat_rows([t["transaction_data"] for t in tables])
+    transaction_items = concat_rows([t["transaction_items"] for t in tables])
+    return compute_nudges(
+        transaction_data, build_fact_table(transaction_data, transaction_items, load_data()["items"])
+    )
+
+
+def build_nudge_table(merchant_ids=None, workers=1):
+    """
+    Nudge table of the given merchants (all of merchant.csv by default).
+
+    With workers > 1 the merchants are split into that many shards computed
+    in a process pool, which pays off once there are thousands of them.
+    """
+    data = load_data()
+    merchant_ids = [str(m) for m in (
+        merchant_ids if merchant_ids is not None else data["merchant"]["merchant_id"]
+    )]
+    if workers > 1 and len(merchant_ids) > 1:
+        shards = [shard.tolist() for shard in np.array_split(np.array(merchant_ids, dtype=object), workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_nudge_shard, [shard for shard in shards if shard]))
+        table = pd.concat(parts, ignore_index=True)
+        # Each merchant sits in one shard, a stable sort keeps its row order
+        return table.sort_values("merchant_id", kind="stable").reset_index(drop=True)
+
+    table = compute_nudges(data["transaction_data"], load_fact_table())
+    return table[table["merchant_id"].isin(merchant_ids)].reset_index(drop=True)
+
+
+def write_nudge_table(merchant_ids=None, workers=1):
+    """Build the nudge table and store it for the current dataset version"""
+    version = get_dataset_version()
+    data = load_data()
+    merchant_ids = [str(m) for m in (
+        merchant_ids if merchant_ids is not None else data["merchant"]["merchant_id"]
+    )]
+    table = build_nudge_table(merchant_ids, workers=workers)
+    write_result_table(NUDGE_TABLE, table, {"version": version, "merchants": merchant_ids})
+    _load_nudge_table.cache_clear()
+    return table
+
+
+@lru_cache(maxsize=2)
+def _load_nudge_table(version):
+    table, meta = read_result_table(NUDGE_TABLE)
+    if table is None or meta.get("version") != version:
+        return None
+    return table, frozenset(meta["merchants"])
+
+
+def load_merchant_nudges(merchant_id):
+    """
+    One merchant's rows of the stored nudge table, or None when no table
+    was written for the current dataset version or it doesn't cover the
+    merchant
+    """
+    try:
+        stored = _load_nudge_table(get_dataset_version())
+    except Exception as e:
+        print(f"Error reading nudge table: {str(e)}")
+        return None
+    if stored is None or str(merchant_id) not in stored[1]:
+        return None
+    table = stored[0]
+    return table[table["merchant_id"] == str(merchant_id)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute and store the smart nudges of many merchants")
+    parser.add_argument("merchant_ids", nargs="*", help="merchants to include (default: all of merchant.csv)")
+    parser.add_argument("--workers", type=int, default=1, help="process pool size (1 computes in this process)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    table = write_nudge_table(args.merchant_ids or None, workers=args.workers)
+    print(f"Stored {len(table)} nudges for {table['merchant_id'].nunique()} merchants "
+          f"in {time.perf_counter() - started:,.1f} s")
+    print(table.groupby("type").size().to_string())
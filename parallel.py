@@ -0,0 +1,58 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Process pool size for the sharded global aggregations (1 runs them in
+# this process)
+AGGREGATE_WORKERS = int(os.environ.get("MEX_AGGREGATE_WORKERS", str(min(16, os.cpu_count() or 1))))
+
+# Below this many rows the pool's start-up and transfer cost more than the
+# aggregation itself
+PARALLEL_MIN_ROWS = int(os.environ.get("MEX_PARALLEL_MIN_ROWS", "500000"))
+
+
+def shard_by_key(frames, keys, shards):
+    """
+    Split frames into shards by their key column, so rows with equal keys
+    (in any of the frames) land in the same shard. Rows keep their index
+    and relative order. Returns one tuple of frames per shard.
+    """
+    # One factorize over every frame's keys gives them shared codes;
+    # missing keys all get -1 and share the last shard
+    codes, _ = pd.factorize(pd.concat([frame[key] for frame, key in zip(frames, keys)], ignore_index=True))
+    split = []
+    start = 0
+    for frame in frames:
+        frame_codes = codes[start:start + len(frame)] % shards
+        start += len(frame)
+        order = np.argsort(frame_codes, kind="stable")
+        bounds = np.searchsorted(frame_codes[order], np.arange(shards + 1))
+        # One gather, then every shard is a contiguous slice of it
+        ordered = frame.take(order)
+        split.append([ordered.iloc[bounds[i]:bounds[i + 1]] for i in range(shards)])
+    return list(zip(*split))
+
+
+def map_shards(function, shards, workers=AGGREGATE_WORKERS):
+    """function(*shard) for every shard, in a process pool when workers > 1"""
+    if workers <= 1 or len(shards) <= 1:
+        return [function(*shard) for shard in shards]
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+        return list(executor.map(function, *zip(*shards)))
+
+
+def sharded_aggregate(function, merge, frames, keys, workers=AGGREGATE_WORKERS):
+    """
+    Aggregate frames shard by shard and merge the partial results.
+
+    function(*frames) computes a partial aggregate of one shard and
+    merge(partials) combines them. The shards split the rows by a hash of
+    keys (one column per frame), so merge can treat them as disjoint: sums
+    and counts add up, and so do distinct counts of the key. Small inputs
+    and workers <= 1 skip the pool and run function on the whole frames.
+    """
+    if workers <= 1 or max(len(frame) for frame in frames) < PARALLEL_MIN_ROWS:
+        return merge([function(*frames)])
+    return merge(map_shards(function, shard_by_key(frames, keys, workers), workers))
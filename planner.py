@@ -0,0 +1,216 @@
+import re
+from datetime import datetime, timedelta
+
+from intents import QUERY_ROUTER
+from instrumentation import span
+
+# Where a query is split into clauses ("today's sales and top items"); a
+# conjunction inside a trigger phrase ("best and worst") doesn't split
+CONJUNCTIONS = re.compile(r"\s*(?:,|;|&|\band\b|\balso\b|\bplus\b|\bas well as\b)\s*")
+
+# Intents a process_query branch answers. A clause whose branch only
+# answers intents already answered by the plan adds no step; branches
+# without any (the generic sales summary, greetings, help, the fallback)
+# are only used for the query as a whole.
+BRANCH_INTENTS = {
+    "keyword_funnel": {"keyword_funnel"},
+    "sales.compare": {"compare", "today", "yesterday"},
+    "sales.average_order_value": {"metric", "order", "value"},
+    "sales.total_revenue": {"metric", "revenue", "total"},
+    "sales.today": {"today"},
+    "sales.yesterday": {"yesterday"},
+    "sales.trends": {"trend"},
+    "sales.top_items": {"top_items"},
+    "sales.graph": {"sales_graph"},
+    "sales.monthly": {"monthly_sales"},
+    "customer_behavior": {"customer_behavior"},
+    "profitability": {"profitability"},
+    "seasonal_trends": {"seasonal_trends"},
+    "inventory": {"inventory"},
+    "promotions": {"promotions"},
+    "business_tips": {"business_tips"},
+    "sales_graph": {"sales_graph"},
+    "best_day": {"best_day"},
+    "peak_hours": {"peak_hours"},
+    "popular_cuisines": {"popular_cuisines"}
+}
+
+
+def resolve_branch(match, date_param=None):
+    """The process_query branch answering a matched query (the first that applies)"""
+    if match.topic != "sales":
+        return match.topic
+    if match.has("compare") and match.has("today") and match.has("yesterday"):
+        return "sales.compare"
+    if match.has("metric"):
+        if match.has("order") and match.has("value"):
+            return "sales.average_order_value"
+        if match.has("revenue", "total"):
+            return "sales.total_revenue"
+    if match.years:
+        return "sales.yearly"
+    if match.has("today"):
+        return "sales.today"
+    if match.has("yesterday") and not date_param:
+        return "sales.yesterday"
+    if match.has("trend"):
+        return "sales.trends"
+    if match.has("top_items"):
+        return "sales.top_items"
+    if match.has("sales_graph"):
+        return "sales.graph"
+    if match.has("monthly_sales"):
+        return "sales.monthly"
+    return "sales.summary"
+
+
+def branch_aggregates(branch, match, date_param=None):
+    """(name, *args) keys of the aggregates a branch renders from"""
+    if branch == "sales.compare":
+        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        return [("daily_summary", None), ("daily_summary", yesterday)]
+    if branch == "sales.yearly":
+        return [("yearly_sales", match.year)]
+    if branch == "sales.today":
+        return [("daily_summary", None)]
+    if branch == "sales.yesterday":
+        return [("daily_summary", (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d"))]
+    if branch == "sales.summary":
+        return [("daily_summary", date_param)]
+    if branch == "sales.top_items":
+        return [("top_selling_items", date_param)]
+    if branch == "keyword_funnel":
+        return [("keyword_funnel", match.text)]
+    if branch == "business_tips":
+        return [
+            ("personalized_suggestions",), ("inventory_suggestions",), ("promotion_effectiveness",),
+            ("customer_insights",), ("profitability",)
+        ]
+    return {
+        "sales.average_order_value": [("global_hourly",)],
+        "sales.total_revenue": [("global_hourly",)],
+        "sales.monthly": [("global_hourly",)],
+        "best_day": [("global_hourly",)],
+        "sales.trends": [("sales_trends",)],
+        "sales.graph": [("sales_trend_chart",)],
+        "sales_graph": [("sales_trend_chart",)],
+        "customer_behavior": [("customer_insights",)],
+        "peak_hours": [("customer_insights",)],
+        "popular_cuisines": [("customer_insights",)],
+        "profitability": [("profitability",)],
+        "seasonal_trends": [("seasonal_trends",)],
+        "inventory": [("low_stock_alerts",)],
+        "promotions": [("promotion_effectiveness",)]
+    }.get(branch, [])
+
+
+class Step:
+    """One branch of a plan, with the match it was resolved from and the aggregates it needs"""
+
+    __slots__ = ("branch", "match", "aggregates")
+
+    def __init__(self, branch, match, aggregates):
+        self.branch = branch
+        self.match = match
+        self.aggregates = aggregates
+
+    def __repr__(self):
+        return f"Step({self.branch!r}, aggregates={self.aggregates})"
+
+
+class QueryPlan:
+    """Steps answering a query, in order, and the aggregates they need between them"""
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    @property
+    def aggregates(self):
+        """Aggregate keys of every step, each once, in first-use order"""
+        return list(dict.fromkeys(key for step in self.steps for key in step.aggregates))
+
+    @property
+    def name(self):
+        return "+".join(step.branch for step in self.steps)
+
+
+def _clauses(query, match):
+    """Split query at the conjunctions that aren't part of a trigger phrase"""
+    clauses = []
+    start = 0
+    for conjunction in CONJUNCTIONS.finditer(query):
+        inside = any(begin < conjunction.end() and conjunction.start() < end for begin, end in match.spans)
+        if not inside:
+            clauses.append(query[start:conjunction.start()])
+            start = conjunction.end()
+    clauses.append(query[start:])
+    return [clause for clause in clauses if clause]
+
+
+def _answers(branch, match):
+    if branch == "sales.yearly":
+        return {f"year:{match.year}"}
+    return BRANCH_INTENTS.get(branch, set()) & match.intents
+
+
+def plan_query(query, date_param=None):
+    """
+    Plan the steps answering a lower-cased query. The branch the whole
+    query resolves to is always a step; each clause of a compound query
+    ("today's sales and top items") adds its own branch when it asks for
+    something the other steps don't answer. Steps follow the clauses'
+    order.
+    """
+    match = QUERY_ROUTER.match(query)
+    branch = resolve_branch(match, date_param)
+    whole = Step(branch, match, branch_aggregates(branch, match, date_param))
+    whole_answers = _answers(branch, match)
+    clauses = _clauses(query, match)
+    if len(clauses) == 1:
+        return QueryPlan([whole])
+    steps = []
+    answered = set()
+    for clause in clauses:
+        clause_match = QUERY_ROUTER.match(clause)
+        clause_branch = resolve_branch(clause_match, date_param)
+        intents = _answers(clause_branch, clause_match)
+        if whole not in steps and intents & whole_answers:
+            # A clause resolving to the same branch stands in for the whole
+            # query, so e.g. a keyword lookup only sees its own clause
+            if clause_branch == whole.branch:
+                whole = Step(clause_branch, clause_match, branch_aggregates(clause_branch, clause_match, date_param))
+            steps.append(whole)
+            answered |= whole_answers
+        if not intents or intents <= answered:
+            continue
+        aggregates = branch_aggregates(clause_branch, clause_match, date_param)
+        if any(step.branch == clause_branch and step.aggregates == aggregates for step in steps):
+            continue
+        steps.append(Step(clause_branch, clause_match, aggregates))
+        answered |= intents
+    if whole not in steps:
+        steps.insert(0, whole)
+    return QueryPlan(steps)
+
+
+class Aggregates:
+    """
+    Aggregates shared by the steps of one plan, by (name, *args) key. Each
+    is computed by functions[name](*args) on first use and then reused.
+    """
+
+    def __init__(self, functions):
+        self.functions = functions
+        self.values = {}
+
+    def get(self, name, *args):
+        key = (name,) + args
+        if key not in self.values:
+            with span(f"aggregate.{name}"):
+                self.values[key] = self.functions[name](*args)
+        return self.values[key]
+
+    def compute(self, plan):
+        """Compute every aggregate the plan needs, once each"""
+        for key in plan.aggregates:
+            self.get(*key)
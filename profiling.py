@@ -0,0 +1,260 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import nullcontext
+
+from instrumentation import current_span
+from snapshot import SNAPSHOT_DIR
+
+# "off", "cprofile" (deterministic, saved as .prof for snakeviz/flameprof)
+# or "sampling" (stack samples saved as collapsed .folded stacks for
+# flamegraph.pl/speedscope)
+PROFILER_MODES = ("off", "cprofile", "sampling")
+PROFILER = os.environ.get("MEX_PROFILER", "off")
+
+# What one profile covers: a "query" (process_query) or a whole "rerun" of the app
+PROFILE_SCOPES = ("query", "rerun")
+PROFILE_SCOPE = os.environ.get("MEX_PROFILE_SCOPE", "query")
+
+# Only requests at least this slow are saved
+PROFILE_SLOW_MS = float(os.environ.get("MEX_PROFILE_SLOW_MS", "1000"))
+
+# Saved profiles kept on disk and in recent_profiles(); older ones are deleted
+PROFILE_HISTORY = int(os.environ.get("MEX_PROFILE_HISTORY", "20"))
+PROFILE_DIR = os.environ.get("MEX_PROFILE_DIR", os.path.join(SNAPSHOT_DIR, "profiles"))
+
+# Time between stack samples of the sampling profiler
+SAMPLE_INTERVAL_MS = float(os.environ.get("MEX_PROFILE_INTERVAL_MS", "5"))
+
+# Shows the profiler controls in the app's sidebar ("1")
+PROFILER_ADMIN = os.environ.get("MEX_PROFILER_ADMIN", "0") == "1"
+
+_settings = {"mode": "off", "scope": "query", "slow_ms": PROFILE_SLOW_MS}
+_lock = threading.Lock()
+_profiles = deque(maxlen=PROFILE_HISTORY)
+_local = threading.local()
+
+
+def profiler_settings():
+    return dict(_settings)
+
+
+def configure_profiler(mode=None, scope=None, slow_ms=None):
+    """Change the profiler mode, scope or slow threshold for the whole process (the admin toggle)"""
+    if mode is not None:
+        if mode not in PROFILER_MODES:
+            raise ValueError(f"Unknown profiler mode: {mode}")
+        _settings["mode"] = mode
+    if scope is not None:
+        if scope not in PROFILE_SCOPES:
+            raise ValueError(f"Unknown profile scope: {scope}")
+        _settings["scope"] = scope
+    if slow_ms is not None:
+        _settings["slow_ms"] = float(slow_ms)
+
+
+configure_profiler(mode=PROFILER, scope=PROFILE_SCOPE)
+
+
+def _frame_label(code):
+    # Collapsed stacks separate frames with ";" and end with " count"
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class _Sampler:
+    """
+    Samples one thread's Python stack from a background thread. A sample
+    can only be taken when the sampled thread lets go of the GIL, so each
+    one is weighted by the intervals elapsed since the previous sample;
+    time in a long pandas/NumPy call lands on the Python frame that made it.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mex-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        target = next((t for t in threading.enumerate() if t.ident == self.thread_id), None)
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            if target is not None and not target.is_alive():
+                break
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                # Nothing to charge the gap to, so the next sample doesn't get it
+                last = now
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += max(1, round((now - last) / self.interval))
+            last = now
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class _Profile:
+    """One profiled request: started by start_profile(), saved by finish_profile() when slow"""
+
+    def __init__(self, name, attrs, mode):
+        self.name = name
+        self.attrs = attrs
+        self.mode = mode
+        if mode == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler = _Sampler(threading.get_ident(), SAMPLE_INTERVAL_MS / 1000)
+            self.profiler.start()
+        self.started = time.time()
+        self._started = time.perf_counter()
+
+    def stop(self):
+        if self.mode == "cprofile":
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+        return (time.perf_counter() - self._started) * 1000
+
+    def summary(self, limit=15):
+        """Top functions by cumulative time (cProfile) or the hottest sampled frames"""
+        if self.mode == "cprofile":
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+            return out.getvalue()
+        leaves = Counter()
+        for stack, count in self.profiler.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return "\n".join(f"{count / total:6.1%}  {frame}" for frame, count in leaves.most_common(limit))
+
+    def save(self, ms):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started)) + f"{self.started % 1:.3f}"[1:]
+        label = re.sub(r"[^A-Za-z0-9_.-]+", "_", self.name)
+        path = os.path.join(PROFILE_DIR, f"{stamp}-{label}-{ms:.0f}ms")
+        if self.mode == "cprofile":
+            path += ".prof"
+            self.profiler.dump_stats(path)
+        else:
+            path += ".folded"
+            with open(path, "w") as f:
+                f.write(self.profiler.collapsed())
+        return path
+
+
+def _prune(directory, keep):
+    """Delete all but the newest keep profiles (names start with their timestamp)"""
+    names = sorted(name for name in os.listdir(directory) if name.endswith((".prof", ".folded")))
+    for name in names[:-keep] if keep > 0 else names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def start_profile(name, scope="query", **attrs):
+    """
+    Start profiling the calling thread if the profiler is on for this
+    scope; returns a handle for finish_profile() (None when off). A profile
+    left unfinished in this thread (e.g. a rerun cut short by st.rerun())
+    is discarded.
+    """
+    if scope != _settings["scope"]:
+        return None
+    stale = getattr(_local, "profile", None)
+    if stale is not None:
+        _local.profile = None
+        stale.stop()
+    mode = _settings["mode"]
+    if mode == "off":
+        return None
+    try:
+        _local.profile = _Profile(name, attrs, mode)
+    except Exception as e:
+        # cProfile can't run while another profiler is active in the process
+        print(f"Error starting profiler: {str(e)}")
+        return None
+    return _local.profile
+
+
+def finish_profile(profile):
+    """
+    Stop a profile from start_profile() and, if the request took at least
+    the slow threshold, save it to PROFILE_DIR and keep it in the ring of
+    the last PROFILE_HISTORY profiles. Returns the saved entry, or None.
+    """
+    if profile is None:
+        return None
+    if getattr(_local, "profile", None) is profile:
+        _local.profile = None
+    ms = profile.stop()
+    if ms < _settings["slow_ms"]:
+        return None
+    try:
+        entry = {
+            "name": profile.name,
+            "attrs": {key: str(value) for key, value in profile.attrs.items()},
+            "mode": profile.mode,
+            "started": profile.started,
+            "ms": ms,
+            "path": profile.save(ms),
+            "summary": profile.summary()
+        }
+    except Exception as e:
+        print(f"Error saving profile: {str(e)}")
+        return None
+    with _lock:
+        _profiles.append(entry)
+        _prune(PROFILE_DIR, PROFILE_HISTORY)
+    # Link the profile from the instrumentation span open around the request
+    span = current_span()
+    if span is not None:
+        span.set(profile=entry["path"])
+    return entry
+
+
+class _ProfileContext:
+    def __init__(self, name, scope, attrs):
+        self.args = (name, scope, attrs)
+
+    def __enter__(self):
+        name, scope, attrs = self.args
+        self.profile = start_profile(name, scope, **attrs)
+        return self
+
+    def __exit__(self, *exc):
+        self.entry = finish_profile(self.profile)
+        return False
+
+
+def profile_request(name, scope="query", **attrs):
+    """Context manager form of start_profile()/finish_profile()"""
+    if _settings["mode"] == "off":
+        return nullcontext()
+    return _ProfileContext(name, scope, attrs)
+
+
+def recent_profiles():
+    """Saved slow-request profiles, oldest first"""
+    with _lock:
+        return list(_profiles)
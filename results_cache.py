@@ -0,0 +1,268 @@
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import current_span
+from snapshot import SNAPSHOT_DIR
+
+# Most results kept per process before the least recently used is dropped
+RESULTS_CACHE_SIZE = int(os.environ.get("MEX_RESULTS_CACHE_SIZE", "256"))
+
+# "memory": per-process only. "sqlite": a per-process LRU in front of a
+# SQLite file shared by every worker on the host, so a result computed by
+# one worker is served to all of them.
+RESULTS_CACHE_BACKEND = os.environ.get("MEX_RESULTS_CACHE_BACKEND", "memory")
+RESULTS_CACHE_PATH = os.environ.get(
+    "MEX_RESULTS_CACHE_PATH", os.path.join(SNAPSHOT_DIR, "results.sqlite")
+)
+SHARED_CACHE_SIZE = int(os.environ.get("MEX_SHARED_CACHE_SIZE", "4096"))
+
+_MISSING = object()
+
+
+class ResultsCache:
+    """Thread-safe LRU of computed analytics results with hit/miss counters"""
+
+    def __init__(self, max_entries=RESULTS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class SQLiteResultsCache:
+    """
+    Results pickled into a SQLite file, shared by every process that opens
+    it. Entries past max_entries are evicted least recently used first.
+    """
+
+    def __init__(self, path=RESULTS_CACHE_PATH, max_entries=SHARED_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key, default=_MISSING):
+        digest = self._digest(key)
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT value FROM results WHERE key = ?", (digest,)).fetchone()
+            if row is not None:
+                value = pickle.loads(row[0])
+                connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), digest))
+                self._count("hits")
+                return value
+        except Exception as e:
+            print(f"Error reading shared results cache: {str(e)}")
+            self._count("errors")
+        self._count("misses")
+        return default
+
+    def put(self, key, value):
+        try:
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # Not picklable, keep it out of the shared store
+            return
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, last_used) VALUES (?, ?, ?)",
+                (self._digest(key), sqlite3.Binary(payload), time.time())
+            )
+            connection.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        except Exception as e:
+            print(f"Error writing shared results cache: {str(e)}")
+            self._count("errors")
+
+    def clear(self):
+        self._connection().execute("DELETE FROM results")
+
+    def stats(self):
+        try:
+            entries = self._connection().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        except Exception:
+            entries = None
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class TieredResultsCache:
+    """A fast local cache in front of a shared one; misses fall through and fill it"""
+
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key, default=_MISSING):
+        value = self.local.get(key)
+        if value is _MISSING:
+            value = self.shared.get(key)
+            if value is _MISSING:
+                return default
+            self.local.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.local.put(key, value)
+        self.shared.put(key, value)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def stats(self):
+        return {"local": self.local.stats(), "shared": self.shared.stats()}
+
+
+def create_results_cache(backend=RESULTS_CACHE_BACKEND):
+    """Build the results cache for a backend name ("memory" or "sqlite")"""
+    if backend == "memory":
+        return ResultsCache()
+    if backend == "sqlite":
+        return TieredResultsCache(ResultsCache(), SQLiteResultsCache())
+    raise ValueError(f"Unknown results cache backend: {backend}")
+
+
+# Shared by every BusinessAnalytics instance in the process
+results_cache = create_results_cache()
+
+
+def set_results_cache(cache):
+    """
+    Swap in another cache, any object with get(key, default), put(key,
+    value), clear() and stats() methods
+    """
+    global results_cache
+    results_cache = cache
+
+
+def memoized(per_merchant=True):
+    """
+    Cache a BusinessAnalytics method's result in results_cache.
+
+    The key is (dataset version, merchant_id, method, arguments), with
+    defaults filled in so f() and f(7) share an entry when 7 is the default.
+    Lookups go to whichever cache is installed when the method is called.
+    Methods whose result doesn't depend on the instance's merchant pass
+    per_merchant=False so every merchant shares one entry. Results are
+    shared between callers and must be treated as read-only.
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            version = getattr(self, "data_version", None)
+            if version is None:
+                return method(self, *args, **kwargs)
+
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = tuple(bound.arguments.items())[1:]
+            key = (
+                version,
+                self.merchant_id if per_merchant else None,
+                method.__qualname__,
+                arguments
+            )
+            try:
+                hash(key)
+            except TypeError:
+                # Unhashable arguments, nothing to key on
+                return method(self, *args, **kwargs)
+
+            result = results_cache.get(key, _MISSING)
+            # Marks the method's span (see instrumentation.timed) as served from cache or not
+            span = current_span()
+            if span is not None:
+                span.set(cached=result is not _MISSING)
+            if result is _MISSING:
+                result = method(self, *args, **kwargs)
+                results_cache.put(key, result)
+            return result
+
+        return wrapper
+    return decorator
@@ -0,0 +1,71 @@
+import pandas as pd
+
+from instrumentation import timed
+
+# Measures kept for every (date, hour) bucket of the rollup
+ROLLUP_MEASURES = ("sales", "orders", "unique_orders")
+
+
+@timed("build_rollup")
+def build_rollup(transaction_data, by=None, measures=ROLLUP_MEASURES):
+    """
+    Sales, order rows and distinct orders per (date, hour), optionally
+    split by a key column such as merchant_id.
+
+    Every date/hour/weekday/month/year view of the transactions can be
+    answered from this frame instead of regrouping the raw rows. Callers
+    that only need some of the measures can skip the others (distinct
+    orders is by far the most expensive).
+    """
+    aggregations = {
+        "sales": ("order_value", "sum"),
+        "orders": ("order_value", "size"),
+        "unique_orders": ("order_id", "nunique")
+    }
+    order_time = transaction_data["order_time"]
+    keys = [order_time.dt.normalize().rename("date"), order_time.dt.hour.rename("hour")]
+    if by is not None:
+        keys.insert(0, transaction_data[by])
+    return transaction_data.groupby(keys, observed=True).agg(
+        **{measure: aggregations[measure] for measure in measures}
+    ).reset_index()
+
+
+def _bucket(rollup, period):
+    dates = rollup["date"]
+    if period == "hour":
+        return rollup["hour"]
+    if period == "date":
+        return dates.dt.date
+    if period == "weekday":
+        return dates.dt.day_name()
+    if period == "month":
+        return dates.dt.month
+    if period == "year":
+        return dates.dt.year
+    raise ValueError(f"Unknown rollup period: {period}")
+
+
+def rollup_by(rollup, period):
+    """
+    Re-aggregate a rollup to one row per hour, date, weekday, month or year,
+    indexed by that period, with summed sales/orders/unique_orders.
+    """
+    return rollup.groupby(_bucket(rollup, period).rename(period))[list(ROLLUP_MEASURES)].sum()
+
+
+def as_order_value_agg(totals, measures, index_name=None):
+    """
+    Shape rolled-up totals like a raw
+    groupby(...).agg({'order_value': [...], 'order_id': [...]}) result,
+    for callers that read its MultiIndex columns.
+    """
+    columns = {
+        ("order_value", "sum"): totals["sales"],
+        ("order_value", "count"): totals["orders"],
+        ("order_value", "mean"): totals["sales"] / totals["orders"],
+        ("order_id", "nunique"): totals["unique_orders"],
+        ("order_id", "count"): totals["orders"]
+    }
+    frame = pd.DataFrame({measure: columns[measure] for measure in measures})
+    return frame.rename_axis(index_name) if index_name is not None else frame
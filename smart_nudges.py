@@ -1,162 +1,273 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from facts import build_fact_table
+from instrumentation import timed
+from rollups import build_rollup
+
+# Nudge rules: a weekday or item whose sales deviate from the merchant's
+# average by more than these percentages, and a peak hour in these
+# (inclusive) meal windows
+DAILY_GROWTH_THRESHOLD = 20
+ITEM_GROWTH_THRESHOLD = 30
+LUNCH_HOURS = (11, 14)
+DINNER_HOURS = (17, 20)
+
+NUDGE_TYPES = ['daily_pattern', 'hourly_pattern', 'item_performance']
+NUDGE_ICONS = {'daily_pattern': '📅', 'hourly_pattern': '⏰', 'item_performance': '🍽️'}
+
+# Weekday columns of NudgeMatrices, in the order nudges list them
+WEEKDAYS = ['Friday', 'Monday', 'Saturday', 'Sunday', 'Thursday', 'Tuesday', 'Wednesday']
+# WEEKDAYS column of each dayofweek (Monday=0)
+_WEEKDAY_COLUMNS = np.array([1, 5, 6, 4, 0, 2, 3])
+HOURS = 24
+
+
+def daily_pattern_message(day: str, growth: float) -> str:
+    """Message for a weekday whose sales deviate from the merchant's average"""
+    return (
+        f"Your sales are {abs(growth):.0f}% {'higher' if growth > 0 else 'lower'} "
+        f"than average on {day}s. Consider {'scheduling promotions' if growth > 0 else 'offering special discounts'} "
+        f"on {day}s to {'maximize revenue' if growth > 0 else 'boost sales'}."
+    )
+
+
+def hourly_pattern_message(hour: int) -> Optional[str]:
+    """Message for a peak hour in the lunch or dinner window (None otherwise)"""
+    if LUNCH_HOURS[0] <= hour <= LUNCH_HOURS[1]:
+        return (
+            f"Your busiest time is during lunch hours ({hour}:00). "
+            "Consider offering lunch specials or quick meal deals to attract more customers."
+        )
+    if DINNER_HOURS[0] <= hour <= DINNER_HOURS[1]:
+        return (
+            f"Your peak sales occur during dinner hours ({hour}:00). "
+            "Consider introducing family meal deals or dinner specials to increase order value."
+        )
+    return None
+
+
+def item_performance_message(item: str, growth: float) -> str:
+    """Message for an item whose sales deviate from the merchant's average item"""
+    return (
+        f"Your {item} sales are {abs(growth):.0f}% {'above' if growth > 0 else 'below'} average. "
+        f"Consider {'creating a special combo meal' if growth > 0 else 'bundling with popular items'} "
+        f"to {'maximize revenue' if growth > 0 else 'boost sales'}."
+    )
+
+
+def format_nudge(merchant_name: str, nudge_type: str, message: str) -> str:
+    """Display text of a nudge, addressed to the merchant"""
+    return f"{NUDGE_ICONS[nudge_type]} Hey {merchant_name}, {message}"
+
+
+@timed("SmartNudges.render")
+def render_messages(nudges: Dict[str, np.ndarray]) -> List[str]:
+    """Message text of each nudge returned by NudgeMatrices.evaluate()"""
+    messages = []
+    for nudge_type, day, hour, item, growth in zip(
+        nudges['type'], nudges['day'], nudges['hour'], nudges['item'], nudges['growth']
+    ):
+        if nudge_type == 'daily_pattern':
+            messages.append(daily_pattern_message(day, growth))
+        elif nudge_type == 'hourly_pattern':
+            messages.append(hourly_pattern_message(hour))
+        else:
+            messages.append(item_performance_message(item, growth))
+    return messages
+
+
+def _bucket_sums(keys: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    """Sum of values per key in range(size), NaN for keys without rows"""
+    totals = np.bincount(keys, weights=values, minlength=size)
+    return np.where(np.bincount(keys, minlength=size) > 0, totals, np.nan)
+
+
+def _deviation_pct(sales: np.ndarray, mean: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (sales - mean) / mean * 100
+
+
+class NudgeMatrices:
+    """
+    Sales aggregates the nudge rules run on, for one or many merchants:
+    merchant x weekday and merchant x hour matrices (NaN where a merchant has
+    no rows) and sales per (merchant, item) pair, kept as parallel arrays
+    sorted by merchant then item since each merchant sells its own menu.
+    """
+
+    def __init__(self, merchant_ids: np.ndarray, weekday_sales: np.ndarray, hour_sales: np.ndarray,
+                 item_merchants: np.ndarray, item_names: np.ndarray, item_sales: np.ndarray):
+        self.merchant_ids = merchant_ids
+        self.weekday_sales = weekday_sales
+        self.hour_sales = hour_sales
+        self.item_merchants = item_merchants
+        self.item_names = item_names
+        self.item_sales = item_sales
+
+    @classmethod
+    @timed("SmartNudges.matrices")
+    def build(cls, hourly_rollup: pd.DataFrame, order_items: pd.DataFrame, merchant_id: Optional[str] = None) -> 'NudgeMatrices':
+        """
+        Aggregate a rollup (see rollups.build_rollup) and the matching
+        order-item fact rows. Frames without a merchant_id column are taken
+        to be all of merchant_id.
+        """
+        def merchant_codes(frame):
+            # Row codes plus their labels; a categorical column is just its codes
+            if 'merchant_id' not in frame:
+                return np.zeros(len(frame), dtype=np.int64), [str(merchant_id)]
+            codes, labels = pd.factorize(frame['merchant_id'])
+            return codes, [str(label) for label in labels]
+
+        rollup_codes, rollup_labels = merchant_codes(hourly_rollup)
+        fact_codes, fact_labels = merchant_codes(order_items)
+        merchant_ids = np.unique(np.asarray(rollup_labels + fact_labels, dtype=object))
+        merchant_index = pd.Index(merchant_ids)
+        n_merchants = len(merchant_ids)
+
+        # Rollup rows never lack a merchant, groupby drops missing keys
+        codes = merchant_index.get_indexer(rollup_labels)[rollup_codes]
+        sales = hourly_rollup['sales'].to_numpy(dtype=np.float64)
+        weekdays = _WEEKDAY_COLUMNS[hourly_rollup['date'].dt.dayofweek.to_numpy()]
+        hours = hourly_rollup['hour'].to_numpy().astype(np.int64)
+        weekday_sales = _bucket_sums(codes * 7 + weekdays, sales, n_merchants * 7).reshape(n_merchants, 7)
+        hour_sales = _bucket_sums(codes * HOURS + hours, sales, n_merchants * HOURS).reshape(n_merchants, HOURS)
+
+        # One key per (merchant, item name); items without a name are skipped
+        name_codes, names = pd.factorize(order_items['item_name'], sort=True)
+        valid = (name_codes >= 0) & (fact_codes >= 0)
+        item_merchants = merchant_index.get_indexer(fact_labels)[fact_codes[valid]]
+        pairs = item_merchants * max(len(names), 1) + name_codes[valid]
+        pair_rows, pairs = pd.factorize(pairs, sort=True)
+        values = np.nan_to_num(order_items['order_value'].to_numpy(dtype=np.float64)[valid])
+
+        return cls(
+            merchant_ids,
+            weekday_sales,
+            hour_sales,
+            pairs // max(len(names), 1),
+            np.asarray(names, dtype=object)[pairs % max(len(names), 1)],
+            np.bincount(pair_rows, weights=values, minlength=len(pairs))
+        )
+
+    @timed("SmartNudges.evaluate", rows=lambda nudges: len(nudges['type']))
+    def evaluate(self) -> Dict[str, np.ndarray]:
+        """
+        Apply the nudge rules to every merchant at once, as masks over the
+        matrices. Returns the nudges as parallel columns merchant_id, type,
+        day, hour, item and growth, listed per merchant as weekday nudges,
+        the peak hour nudge, then item nudges. Messages are left to
+        render_messages().
+        """
+        n_merchants = len(self.merchant_ids)
+
+        # Weekdays deviating from the merchant's mean weekday
+        weekday_sales = self.weekday_sales
+        present = ~np.isnan(weekday_sales)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weekday_mean = np.nansum(weekday_sales, axis=1) / present.sum(axis=1)
+        day_growth = _deviation_pct(weekday_sales, weekday_mean[:, None])
+        day_merchants, day_columns = np.nonzero(np.abs(day_growth) > DAILY_GROWTH_THRESHOLD)
+
+        # Peak hour (the earliest on ties) falling in a meal window
+        has_hours = ~np.isnan(self.hour_sales).all(axis=1)
+        peaks = np.argmax(np.where(np.isnan(self.hour_sales), -np.inf, self.hour_sales), axis=1)
+        meal = (
+            ((peaks >= LUNCH_HOURS[0]) & (peaks <= LUNCH_HOURS[1])) |
+            ((peaks >= DINNER_HOURS[0]) & (peaks <= DINNER_HOURS[1]))
+        )
+        hour_merchants = np.flatnonzero(has_hours & meal)
+
+        # Items deviating from the merchant's mean item
+        with np.errstate(divide='ignore', invalid='ignore'):
+            item_mean = (
+                np.bincount(self.item_merchants, weights=self.item_sales, minlength=n_merchants) /
+                np.bincount(self.item_merchants, minlength=n_merchants)
+            )
+        item_growth = _deviation_pct(self.item_sales, item_mean[self.item_merchants])
+        item_rows = np.flatnonzero(np.abs(item_growth) > ITEM_GROWTH_THRESHOLD)
+
+        counts = [len(day_merchants), len(hour_merchants), len(item_rows)]
+        merchants = np.concatenate([day_merchants, hour_merchants, self.item_merchants[item_rows]])
+        types = np.repeat(np.arange(len(NUDGE_TYPES)), counts)
+        # lexsort is stable, so each type keeps its day/item order
+        order = np.lexsort((types, merchants))
+
+        day = np.full(len(merchants), None, dtype=object)
+        day[:counts[0]] = np.asarray(WEEKDAYS, dtype=object)[day_columns]
+        hour = np.full(len(merchants), None, dtype=object)
+        hour[counts[0]:counts[0] + counts[1]] = [int(peak) for peak in peaks[hour_merchants]]
+        item = np.full(len(merchants), None, dtype=object)
+        item[counts[0] + counts[1]:] = self.item_names[item_rows]
+        growth = np.concatenate([
+            day_growth[day_merchants, day_columns], np.full(counts[1], np.nan), item_growth[item_rows]
+        ])
+
+        return {
+            'merchant_id': self.merchant_ids[merchants][order],
+            'type': np.asarray(NUDGE_TYPES, dtype=object)[types][order],
+            'day': day[order],
+            'hour': hour[order],
+            'item': item[order],
+            'growth': growth[order]
+        }
+
 
 class SmartNudges:
-    def __init__(self, transaction_data: pd.DataFrame, merchant_id: str, items_data: pd.DataFrame, transaction_items: pd.DataFrame):
+    def __init__(self, transaction_data: pd.DataFrame, merchant_id: str, items_data: pd.DataFrame, transaction_items: pd.DataFrame,
+                 hourly_rollup: Optional[pd.DataFrame] = None, order_items: Optional[pd.DataFrame] = None):
         self.transaction_data = transaction_data
         self.merchant_id = merchant_id
         self.items_data = items_data
         self.transaction_items = transaction_items
         self.merchant_data = self._filter_merchant_data()
+        # Per (date, hour) totals of this merchant, built here if not supplied
+        self.hourly_rollup = hourly_rollup if hourly_rollup is not None else build_rollup(self.merchant_data)
+        # This merchant's order-item fact rows (see facts.FACT_COLUMNS)
+        self.order_items = order_items if order_items is not None else build_fact_table(
+            self.merchant_data, self.transaction_items, self.items_data
+        )
+        self._matrices = None
         
+    @timed("SmartNudges.filter")
     def _filter_merchant_data(self) -> pd.DataFrame:
         """Filter transaction data for the specific merchant"""
         return self.transaction_data[self.transaction_data['merchant_id'] == self.merchant_id]
     
-    def _analyze_weekly_patterns(self) -> Dict[str, Any]:
-        """Analyze sales patterns by day of week"""
-        # Group by day of week and calculate metrics
-        daily_patterns = self.merchant_data.groupby(
-            self.merchant_data['order_time'].dt.day_name()
-        ).agg({
-            'order_value': ['sum', 'count', 'mean'],
-            'order_id': 'nunique'
-        })
-        
-        # Calculate growth compared to average
-        avg_sales = daily_patterns[('order_value', 'sum')].mean()
-        daily_patterns['growth_vs_avg'] = (
-            (daily_patterns[('order_value', 'sum')] - avg_sales) / avg_sales * 100
-        )
-        
-        return daily_patterns
+    @property
+    def matrices(self) -> NudgeMatrices:
+        """This merchant's nudge aggregates, built on first use"""
+        if self._matrices is None:
+            self._matrices = NudgeMatrices.build(self.hourly_rollup, self.order_items, self.merchant_id)
+        return self._matrices
     
-    def _analyze_hourly_patterns(self) -> Dict[str, Any]:
-        """Analyze sales patterns by hour of day"""
-        hourly_patterns = self.merchant_data.groupby(
-            self.merchant_data['order_time'].dt.hour
-        ).agg({
-            'order_value': ['sum', 'count', 'mean'],
-            'order_id': 'nunique'
-        })
+    def generate_nudges(self, render: bool = True) -> List[Dict[str, Any]]:
+        """Generate personalized nudges based on merchant data (without messages unless render)"""
+        nudges = self.matrices.evaluate()
+        messages = render_messages(nudges) if render else None
         
-        return hourly_patterns
-    
-    def _analyze_item_performance(self) -> Dict[str, Any]:
-        """Analyze item performance patterns"""
-        # First merge merchant transactions with transaction_items
-        merchant_transactions = self.merchant_data.merge(
-            self.transaction_items,
-            on='order_id',
-            how='left'
-        )
-        
-        # Then merge with items data to get item names
-        merged_data = merchant_transactions.merge(
-            self.items_data[['item_id', 'item_name']],
-            on='item_id',
-            how='left'
-        )
-        
-        # Group by item name and calculate metrics
-        item_performance = merged_data.groupby('item_name').agg({
-            'order_value': ['sum', 'count', 'mean'],
-            'order_id': 'nunique'
-        })
+        result = []
+        for i, nudge_type in enumerate(nudges['type']):
+            nudge = {'type': nudge_type}
+            if nudge_type == 'daily_pattern':
+                nudge.update(day=nudges['day'][i], growth=nudges['growth'][i])
+            elif nudge_type == 'hourly_pattern':
+                nudge['hour'] = nudges['hour'][i]
+            else:
+                nudge.update(item=nudges['item'][i], growth=nudges['growth'][i])
+            if messages is not None:
+                nudge['message'] = messages[i]
+            result.append(nudge)
         
-        # Calculate growth compared to average
-        avg_item_sales = item_performance[('order_value', 'sum')].mean()
-        item_performance['growth_vs_avg'] = (
-            (item_performance[('order_value', 'sum')] - avg_item_sales) / avg_item_sales * 100
-        )
-        
-        return item_performance
-    
-    def generate_nudges(self) -> List[Dict[str, Any]]:
-        """Generate personalized nudges based on merchant data"""
-        nudges = []
-        
-        # Analyze patterns
-        daily_patterns = self._analyze_weekly_patterns()
-        hourly_patterns = self._analyze_hourly_patterns()
-        item_performance = self._analyze_item_performance()
-        
-        # Generate daily pattern nudges
-        for day, data in daily_patterns.iterrows():
-            growth = data['growth_vs_avg']
-            if isinstance(growth, (int, float)) and abs(growth) > 20:  # Significant deviation from average
-                nudge = {
-                    'type': 'daily_pattern',
-                    'day': day,
-                    'growth': growth,
-                    'message': (
-                        f"Your sales are {abs(growth):.0f}% {'higher' if growth > 0 else 'lower'} "
-                        f"than average on {day}s. Consider {'scheduling promotions' if growth > 0 else 'offering special discounts'} "
-                        f"on {day}s to {'maximize revenue' if growth > 0 else 'boost sales'}."
-                    )
-                }
-                nudges.append(nudge)
-        
-        # Generate hourly pattern nudges
-        peak_hour = hourly_patterns[('order_value', 'sum')].idxmax()
-        if isinstance(peak_hour, (int, float)) and peak_hour >= 11 and peak_hour <= 14:  # Lunch hours
-            nudge = {
-                'type': 'hourly_pattern',
-                'hour': peak_hour,
-                'message': (
-                    f"Your busiest time is during lunch hours ({peak_hour}:00). "
-                    "Consider offering lunch specials or quick meal deals to attract more customers."
-                )
-            }
-            nudges.append(nudge)
-        elif isinstance(peak_hour, (int, float)) and peak_hour >= 17 and peak_hour <= 20:  # Dinner hours
-            nudge = {
-                'type': 'hourly_pattern',
-                'hour': peak_hour,
-                'message': (
-                    f"Your peak sales occur during dinner hours ({peak_hour}:00). "
-                    "Consider introducing family meal deals or dinner specials to increase order value."
-                )
-            }
-            nudges.append(nudge)
-        
-        # Generate item performance nudges
-        for item, data in item_performance.iterrows():
-            growth = data['growth_vs_avg']
-            if isinstance(growth, (int, float)) and abs(growth) > 30:  # Significant deviation from average
-                nudge = {
-                    'type': 'item_performance',
-                    'item': item,
-                    'growth': growth,
-                    'message': (
-                        f"Your {item} sales are {abs(growth):.0f}% {'above' if growth > 0 else 'below'} average. "
-                        f"Consider {'creating a special combo meal' if growth > 0 else 'bundling with popular items'} "
-                        f"to {'maximize revenue' if growth > 0 else 'boost sales'}."
-                    )
-                }
-                nudges.append(nudge)
-        
-        return nudges
+        return result
     
     def get_personalized_nudges(self, merchant_name: str) -> List[str]:
         """Get formatted nudges for display"""
         nudges = self.generate_nudges()
-        formatted_nudges = []
-        
-        for nudge in nudges:
-            if nudge['type'] == 'daily_pattern':
-                formatted_nudges.append(
-                    f"📅 Hey {merchant_name}, {nudge['message']}"
-                )
-            elif nudge['type'] == 'hourly_pattern':
-                formatted_nudges.append(
-                    f"⏰ Hey {merchant_name}, {nudge['message']}"
-                )
-            elif nudge['type'] == 'item_performance':
-                formatted_nudges.append(
-                    f"🍽️ Hey {merchant_name}, {nudge['message']}"
-                )
+        formatted_nudges = [
+            format_nudge(merchant_name, nudge['type'], nudge['message']) for nudge in nudges
+        ]
         
         return formatted_nudges 
\ No newline at end of file
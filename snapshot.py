@@ -0,0 +1,479 @@
+import hashlib
+import json
+import os
+import shutil
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa  # feather snapshots and string[pyarrow] columns
+    from pyarrow import feather
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pa = feather = None
+    PYARROW_AVAILABLE = False
+
+# Typed columnar copies of the source CSVs live here
+SNAPSHOT_DIR = os.environ.get("MEX_SNAPSHOT_DIR", ".snapshots")
+
+# Per-merchant partitions and the global aggregates built alongside them
+PARTITION_DIR = os.path.join(SNAPSHOT_DIR, "partitions")
+EMPTY_PARTITION = "__empty__"
+
+# Appended delta batches, one segment directory per batch next to the base set
+SEGMENT_DIR = os.path.join(PARTITION_DIR, "segments")
+
+# "feather": one Feather file per table, read fully into the process heap.
+# "npy": one NumPy file per column, memory-mapped read-only so every worker
+# on the host shares the same page cache instead of holding its own copy.
+SNAPSHOT_FORMATS = ("feather", "npy")
+
+
+def _source_stamp(csv_path):
+    """mtime/size of the source CSV, used to detect stale snapshots"""
+    stat = os.stat(csv_path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _schema_fingerprint(read_options):
+    """Hash of the read options so a schema change also invalidates snapshots"""
+    encoded = json.dumps(read_options, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def snapshot_paths(csv_path, fmt="feather"):
+    """Return (data_path, meta_path) of the snapshot for a CSV"""
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    data_name = f"{name}.feather" if fmt == "feather" else f"{name}.columns"
+    return (
+        os.path.join(SNAPSHOT_DIR, data_name),
+        os.path.join(SNAPSHOT_DIR, f"{name}.{fmt}.json")
+    )
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(csv_path, read_options, fmt="feather"):
+    """True when the snapshot exists and matches the current CSV and schema"""
+    data_path, meta_path = snapshot_paths(csv_path, fmt)
+    if not os.path.exists(data_path):
+        return False
+    meta = _read_meta(meta_path)
+    return (
+        meta is not None and
+        meta.get("source") == _source_stamp(csv_path) and
+        meta.get("schema") == _schema_fingerprint(read_options)
+    )
+
+
+def _write_feather(df, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.reset_index(drop=True).to_feather(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _read_feather(path):
+    # string[pyarrow] columns come back as string[python] unless asked for
+    with pd.option_context("mode.string_storage", "pyarrow"):
+        return pd.read_feather(path)
+
+
+def _replace_dir(tmp_dir, path):
+    """Swap a freshly written directory into place"""
+    # Readers that already opened the old files keep their (unlinked) copies
+    if os.path.exists(path):
+        stale_dir = f"{path}.{os.getpid()}.old"
+        os.replace(path, stale_dir)
+        shutil.rmtree(stale_dir, ignore_errors=True)
+    os.replace(tmp_dir, path)
+
+
+def _write_columns(df, path):
+    """Write each column as .npy; strings and categoricals as codes + labels"""
+    tmp_dir = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        entry = {"name": col, "file": f"{i}.npy"}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            entry["kind"] = "category"
+            entry["labels"] = series.cat.categories.tolist()
+            values = series.cat.codes.to_numpy()
+        elif series.dtype == object or isinstance(series.dtype, pd.StringDtype):
+            # Strings can't be memory-mapped, store them dictionary-encoded
+            codes, labels = pd.factorize(series)
+            entry["kind"] = "object"
+            entry["dtype"] = str(series.dtype)
+            entry["labels"] = list(labels)
+            values = codes.astype(np.int32)
+        else:
+            entry["kind"] = "numpy"
+            values = series.to_numpy()
+        np.save(os.path.join(tmp_dir, entry["file"]), values, allow_pickle=False)
+        columns.append(entry)
+
+    with open(os.path.join(tmp_dir, "columns.json"), "w") as f:
+        json.dump(columns, f)
+
+    _replace_dir(tmp_dir, path)
+
+
+def _read_columns(path):
+    """Build a DataFrame over memory-mapped column files without copying"""
+    with open(os.path.join(path, "columns.json")) as f:
+        columns = json.load(f)
+
+    data = {}
+    for entry in columns:
+        values = np.load(os.path.join(path, entry["file"]), mmap_mode="r")
+        if entry["kind"] == "category":
+            data[entry["name"]] = pd.Categorical.from_codes(values, categories=entry["labels"])
+        elif entry["kind"] == "object":
+            # Decoded into the heap; only numeric/datetime/category data is shared
+            labels = np.array(entry["labels"] + [np.nan], dtype=object)
+            data[entry["name"]] = pd.array(labels[values], dtype=entry["dtype"])
+        else:
+            data[entry["name"]] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def write_snapshot(df, csv_path, read_options, fmt="feather"):
+    """Write df as the snapshot of csv_path (atomically, safe across workers)"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    data_path, meta_path = snapshot_paths(csv_path, fmt)
+    meta = {
+        "source": _source_stamp(csv_path),
+        "schema": _schema_fingerprint(read_options),
+        "rows": len(df)
+    }
+
+    if fmt == "feather":
+        _write_feather(df, data_path)
+    else:
+        _write_columns(df, data_path)
+
+    tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_meta, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, meta_path)
+
+
+class SnapshotWriter:
+    """
+    Write a CSV's Feather snapshot chunk by chunk, for files parsed in
+    pieces. Every chunk must carry the same dtypes (including categories)
+    as the first one; close() publishes the snapshot with its metadata.
+    """
+
+    def __init__(self, csv_path, read_options):
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        self.csv_path = csv_path
+        self.read_options = read_options
+        self.data_path, self.meta_path = snapshot_paths(csv_path, "feather")
+        self._tmp_path = f"{self.data_path}.{os.getpid()}.tmp"
+        self._writer = None
+        self._schema = None
+        self.rows = 0
+
+    def write(self, df):
+        if self._writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self._schema = table.schema
+            compression = "lz4" if pa.Codec.is_available("lz4") else None
+            self._writer = pa.ipc.new_file(
+                self._tmp_path, self._schema, options=pa.ipc.IpcWriteOptions(compression=compression)
+            )
+        else:
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        os.replace(self._tmp_path, self.data_path)
+        meta = {
+            "source": _source_stamp(self.csv_path),
+            "schema": _schema_fingerprint(self.read_options),
+            "rows": self.rows
+        }
+        tmp_meta = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp_meta, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_meta, self.meta_path)
+
+
+def read_table(csv_path, read_options=None, fmt="feather"):
+    """
+    Load a CSV through its columnar snapshot.
+
+    read_options are passed to pd.read_csv when the snapshot is missing or
+    stale; the parsed, typed frame is then written back as the new snapshot.
+    Tables read with fmt="npy" are backed by read-only memory maps. Without
+    pyarrow the feather format degrades to a plain pd.read_csv.
+    """
+    read_options = read_options or {}
+    if fmt not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Unknown snapshot format: {fmt}")
+    if fmt == "feather" and not PYARROW_AVAILABLE:
+        return pd.read_csv(csv_path, **read_options)
+
+    if is_fresh(csv_path, read_options, fmt):
+        data_path, _ = snapshot_paths(csv_path, fmt)
+        try:
+            if fmt == "feather":
+                return _read_feather(data_path)
+            return _read_columns(data_path)
+        except Exception as e:
+            print(f"Error reading snapshot for {csv_path}, reparsing CSV: {str(e)}")
+
+    df = pd.read_csv(csv_path, **read_options)
+    try:
+        write_snapshot(df, csv_path, read_options, fmt)
+        if fmt == "npy":
+            # Serve the mapped copy so this worker shares pages with the others
+            return _read_columns(snapshot_paths(csv_path, fmt)[0])
+    except Exception as e:
+        print(f"Error writing snapshot for {csv_path}: {str(e)}")
+    return df
+
+
+def read_table_batches(csv_path, read_options=None, batch_rows=100000):
+    """
+    Yield a CSV's rows as typed frames without loading it whole: record
+    batch by record batch from its Feather snapshot when that is fresh,
+    otherwise parsed from the CSV batch_rows at a time.
+    """
+    read_options = read_options or {}
+    if PYARROW_AVAILABLE and is_fresh(csv_path, read_options, "feather"):
+        data_path, _ = snapshot_paths(csv_path, "feather")
+        with pa.memory_map(data_path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                with pd.option_context("mode.string_storage", "pyarrow"):
+                    yield reader.get_batch(i).to_pandas()
+        return
+    yield from pd.read_csv(csv_path, chunksize=batch_rows, **read_options)
+
+
+def _partition_path(base, table, key):
+    return os.path.join(base, table, f"{quote(str(key), safe='')}.feather")
+
+
+def read_partition_manifest():
+    """Manifest of the stored partitions, or None if they were never built"""
+    return _read_meta(os.path.join(PARTITION_DIR, "manifest.json"))
+
+
+def _write_manifest(base, manifest):
+    tmp_path = os.path.join(base, f"manifest.json.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, default=str)
+    os.replace(tmp_path, os.path.join(base, "manifest.json"))
+
+
+def _write_partition_files(base, tables, aggregates):
+    """Write tables split by key plus aggregate frames under base"""
+    partition_keys = set()
+    for name, (df, keys) in tables.items():
+        os.makedirs(os.path.join(base, name))
+        # Schema-only file served for keys without any rows
+        df.iloc[:0].reset_index(drop=True).to_feather(
+            _partition_path(base, name, EMPTY_PARTITION)
+        )
+        for key, part in df.groupby(keys, observed=True, sort=False):
+            part.reset_index(drop=True).to_feather(_partition_path(base, name, key))
+            partition_keys.add(str(key))
+
+    for name, frame in (aggregates or {}).items():
+        frame.reset_index(drop=True).to_feather(os.path.join(base, f"{name}.feather"))
+    return partition_keys
+
+
+def write_partitions(version, tables, aggregates=None, meta=None):
+    """
+    Split tables into one Feather file per key and store them with the
+    shared aggregate frames, replacing any previous partition set.
+
+    tables maps a table name to (df, keys), where keys is a Series aligned
+    with df that names the partition of each row.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    tmp_dir = f"{PARTITION_DIR}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    partition_keys = _write_partition_files(tmp_dir, tables, aggregates)
+    manifest = {"version": version, "keys": sorted(partition_keys), "segments": [], **(meta or {})}
+    _write_manifest(tmp_dir, manifest)
+
+    _replace_dir(tmp_dir, PARTITION_DIR)
+    return manifest
+
+
+class PartitionBuilder:
+    """
+    Build a partition set from tables that arrive in chunks.
+
+    add() takes the same {name: (df, keys)} mapping as write_partitions()
+    and spills each key's rows of the chunk to their own Arrow piece file;
+    finish() concatenates every key's pieces, in arrival order, into its
+    partition file and swaps the set into place. Memory is bounded by a
+    chunk or the largest key instead of the whole table. Every chunk of a
+    table must carry the same dtypes (including categories).
+    """
+
+    def __init__(self):
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        self.tmp_dir = f"{PARTITION_DIR}.{os.getpid()}.tmp"
+        self.spill_dir = os.path.join(self.tmp_dir, "spill")
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.spill_dir)
+        self.keys = {}
+        self.chunks = 0
+
+    def add(self, tables):
+        for name, (df, keys) in tables.items():
+            df = df.reset_index(drop=True)
+            if name not in self.keys:
+                os.makedirs(os.path.join(self.tmp_dir, name))
+                # Schema-only file served for keys without any rows
+                df.iloc[:0].to_feather(_partition_path(self.tmp_dir, name, EMPTY_PARTITION))
+                self.keys[name] = set()
+            # One conversion per chunk, the pieces are zero-copy slices of it
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            groups = pd.Series(keys.to_numpy()).groupby(keys.to_numpy(), observed=True, sort=False).indices
+            for key, rows in groups.items():
+                piece_dir = os.path.join(self.spill_dir, name, quote(str(key), safe=""))
+                os.makedirs(piece_dir, exist_ok=True)
+                piece = table.take(pa.array(rows))
+                with pa.ipc.new_file(os.path.join(piece_dir, f"{self.chunks:06d}.arrow"), piece.schema) as writer:
+                    writer.write_table(piece)
+                self.keys[name].add(str(key))
+        self.chunks += 1
+
+    def finish(self, version, aggregates=None, meta=None, combine=None):
+        """
+        Write the partitions, aggregates and manifest. combine maps a table
+        name to a function applied to a key's concatenated rows when several
+        chunks contributed to it, e.g. to re-sum their rollup buckets.
+        """
+        combine = combine or {}
+        for name, keys in self.keys.items():
+            for key in keys:
+                piece_dir = os.path.join(self.spill_dir, name, quote(key, safe=""))
+                pieces = [
+                    pa.ipc.open_file(os.path.join(piece_dir, piece)).read_all()
+                    for piece in sorted(os.listdir(piece_dir))
+                ]
+                table = pa.concat_tables(pieces).unify_dictionaries().combine_chunks()
+                path = _partition_path(self.tmp_dir, name, key)
+                if name in combine and len(pieces) > 1:
+                    with pd.option_context("mode.string_storage", "pyarrow"):
+                        frame = table.to_pandas()
+                    combine[name](frame).reset_index(drop=True).to_feather(path)
+                else:
+                    # The pandas metadata travels with the table, so it reads
+                    # back exactly like a DataFrame.to_feather() file
+                    feather.write_feather(table, path)
+                shutil.rmtree(piece_dir)
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+        for name, frame in (aggregates or {}).items():
+            frame.reset_index(drop=True).to_feather(os.path.join(self.tmp_dir, f"{name}.feather"))
+        partition_keys = set().union(*self.keys.values()) if self.keys else set()
+        manifest = {"version": version, "keys": sorted(partition_keys), "segments": [], **(meta or {})}
+        _write_manifest(self.tmp_dir, manifest)
+
+        _replace_dir(self.tmp_dir, PARTITION_DIR)
+        return manifest
+
+
+def append_partitions(segment, tables, aggregates=None, meta=None):
+    """
+    Store a delta batch as a new segment of the current partition set.
+
+    Existing files are left untouched: the batch is split by key like in
+    write_partitions() into its own directory, then the manifest is updated
+    to list the segment, with meta merged over the previous manifest values.
+    """
+    manifest = read_partition_manifest()
+    segment_path = os.path.join(SEGMENT_DIR, segment)
+    tmp_dir = f"{segment_path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    partition_keys = _write_partition_files(tmp_dir, tables, aggregates)
+    _replace_dir(tmp_dir, segment_path)
+
+    manifest.update(meta or {})
+    manifest["keys"] = sorted(set(manifest["keys"]) | partition_keys)
+    manifest["segments"] = manifest.get("segments", []) + [segment]
+    _write_manifest(PARTITION_DIR, manifest)
+    return manifest
+
+
+def read_partition(table, key, segments=()):
+    """
+    Rows of table stored under key, followed by the rows appended for it in
+    each of the given segments (an empty, typed frame if there are none)
+    """
+    path = _partition_path(PARTITION_DIR, table, key)
+    if not os.path.exists(path):
+        path = _partition_path(PARTITION_DIR, table, EMPTY_PARTITION)
+    parts = [_read_feather(path)]
+    for segment in segments:
+        segment_path = _partition_path(os.path.join(SEGMENT_DIR, segment), table, key)
+        if os.path.exists(segment_path):
+            parts.append(_read_feather(segment_path))
+    return parts[0] if len(parts) == 1 else concat_rows(parts)
+
+
+def read_partition_aggregate(name, segments=()):
+    """Aggregate frame stored alongside the partitions, plus the rows of each segment"""
+    parts = [_read_feather(os.path.join(PARTITION_DIR, f"{name}.feather"))]
+    for segment in segments:
+        parts.append(_read_feather(os.path.join(SEGMENT_DIR, segment, f"{name}.feather")))
+    return parts[0] if len(parts) == 1 else concat_rows(parts)
+
+
+def write_result_table(name, df, meta):
+    """Store a derived table as <name>.feather under SNAPSHOT_DIR with a JSON sidecar"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    _write_feather(df, os.path.join(SNAPSHOT_DIR, f"{name}.feather"))
+    meta_path = os.path.join(SNAPSHOT_DIR, f"{name}.json")
+    tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, default=str)
+    os.replace(tmp_path, meta_path)
+
+
+def read_result_table(name):
+    """(df, meta) of a table stored with write_result_table(), or (None, None)"""
+    meta = _read_meta(os.path.join(SNAPSHOT_DIR, f"{name}.json"))
+    path = os.path.join(SNAPSHOT_DIR, f"{name}.feather")
+    if meta is None or not os.path.exists(path):
+        return None, None
+    return _read_feather(path), meta
+
+
+def concat_rows(parts):
+    """Stack frames with the same columns, keeping categorical columns categorical"""
+    combined = pd.concat(parts, ignore_index=True)
+    for col in parts[0].columns:
+        # Differing category sets would otherwise fall back to object
+        if isinstance(parts[0][col].dtype, pd.CategoricalDtype) and not isinstance(combined[col].dtype, pd.CategoricalDtype):
+            combined[col] = combined[col].astype("category")
+    return combined
@@ -0,0 +1,143 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from data_loader import load_data, load_date_index, load_fact_index, load_global_aggregate, load_keyword_index
+from engines import get_engine
+from helper import BusinessAnalytics
+
+# Worker count for the per-merchant stage
+WARMUP_WORKERS = int(os.environ.get("MEX_WARMUP_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+# Merchant-independent BusinessAnalytics views, computed once for everyone
+SHARED_VIEWS = (
+    "get_weekly_growth_trends",
+    "get_yearly_sales",
+    "get_customer_behavior_insights",
+    "get_seasonal_trends",
+    "get_profitability_analysis",
+    "get_inventory_optimization_suggestions",
+    "get_promotion_effectiveness"
+)
+
+
+def print_progress(done, total, label, seconds):
+    print(f"Warm-up [{done}/{total}] {label} ({seconds * 1000:,.0f} ms)")
+
+
+def _load_tables():
+    data = load_data()
+    for name in data:
+        data[name]
+
+
+def _warm_shared_views(merchant_id):
+    analytics = BusinessAnalytics(merchant_id=merchant_id)
+    try:
+        for view in SHARED_VIEWS:
+            getattr(analytics, view)()
+    finally:
+        analytics.close()
+
+
+def warm_merchant(merchant_id):
+    """Build one merchant's partitions, fact table and nudges; returns the nudge count"""
+    analytics = BusinessAnalytics(merchant_id=merchant_id)
+    try:
+        return len(analytics.get_smart_nudges())
+    finally:
+        analytics.close()
+
+
+def _timed_warm_merchant(merchant_id):
+    started = time.perf_counter()
+    return warm_merchant(merchant_id), time.perf_counter() - started
+
+
+def warm_up(merchant_ids=None, workers=WARMUP_WORKERS, processes=False, progress=print_progress):
+    """
+    Precompute what a login needs so it is served from warm caches.
+
+    Shared stages run first, in order: parse every table, build the
+    per-merchant partitions and global aggregate, load the analytics
+    engine, the global date index, fact table and keyword index, and the
+    merchant-independent views. Then every merchant
+    (all of merchant.csv by default) gets its partitions, fact table and
+    smart nudges built in a pool of `workers`.
+
+    Threads fill this process's caches. Processes only leave behind what is
+    stored on disk (snapshots, partitions and, with the sqlite results
+    backend, the computed results), which is what a CLI run before server
+    start can hand over. progress(done, total, label, seconds) is called
+    after each step. Returns {merchant_id: nudge count or error message}.
+    """
+    merchant_ids = list(merchant_ids) if merchant_ids is not None else list(
+        load_data()["merchant"]["merchant_id"]
+    )
+    shared = [
+        ("tables", _load_tables),
+        ("partitions and global aggregate", load_global_aggregate),
+        # Loads the database of a SQL engine, a cache hit for pandas
+        ("analytics engine", lambda: get_engine().global_aggregate()),
+        ("date index", load_date_index),
+        ("fact table", load_fact_index),
+        ("keyword index", load_keyword_index)
+    ]
+    if merchant_ids:
+        shared.append(("shared views", lambda: _warm_shared_views(merchant_ids[0])))
+    total = len(shared) + len(merchant_ids)
+
+    done = 0
+    for label, stage in shared:
+        started = time.perf_counter()
+        stage()
+        done += 1
+        progress(done, total, label, time.perf_counter() - started)
+
+    results = {}
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(_timed_warm_merchant, merchant_id): merchant_id
+            for merchant_id in merchant_ids
+        }
+        for future in as_completed(futures):
+            merchant_id = futures[future]
+            try:
+                results[merchant_id], seconds = future.result()
+                label = f"merchant {merchant_id}: {results[merchant_id]} nudges"
+            except Exception as e:
+                results[merchant_id], seconds = f"Error: {str(e)}", 0.0
+                label = f"merchant {merchant_id}: {results[merchant_id]}"
+            done += 1
+            progress(done, total, label, seconds)
+    return results
+
+
+def start_background_warmup(merchant_ids=None, workers=WARMUP_WORKERS):
+    """Run warm_up() on a daemon thread so the server keeps answering meanwhile"""
+    def run():
+        started = time.perf_counter()
+        try:
+            warm_up(merchant_ids, workers=workers)
+            print(f"Warm-up finished in {time.perf_counter() - started:,.1f} s")
+        except Exception as e:
+            print(f"Error in warm-up: {str(e)}")
+
+    thread = threading.Thread(target=run, name="mex-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute caches and smart nudges before serving")
+    parser.add_argument("merchant_ids", nargs="*", help="merchants to warm (default: all of merchant.csv)")
+    parser.add_argument("--workers", type=int, default=WARMUP_WORKERS, help="pool size for the per-merchant stage")
+    parser.add_argument("--processes", action="store_true", help="use a process pool instead of threads")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    warm_up(args.merchant_ids or None, workers=args.workers, processes=args.processes)
+    print(f"Warm-up finished in {time.perf_counter() - started:,.1f} s")